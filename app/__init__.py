@@ -2,18 +2,30 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
+from flask_mail import Mail
+from werkzeug.middleware.proxy_fix import ProxyFix
 import os
 import cloudinary
 
-db = SQLAlchemy()
+from app.replicas import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 migrate = Migrate()
 login = LoginManager()
 login.login_view = "main.login"  # safer with blueprint prefix
+mail = Mail()
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object("config.Config")  # make sure Config has SECRET_KEY & SQLALCHEMY_DATABASE_URI
 
+    # Behind the platform's router every request comes from the router's
+    # address; take the client's from X-Forwarded-For instead (rate limits
+    # are keyed on it)
+    hops = app.config["PROXY_FIX_HOPS"]
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
     # Cloudinary setup
     cloudinary.config(
         cloud_name=os.environ.get("CLOUDINARY_CLOUD_NAME"),
@@ -22,17 +34,58 @@ def create_app():
         secure=True
     )
 
+    # Read replicas are extra binds that RoutingSession sends GET reads to
+    from app import replicas
+    app.config.setdefault("SQLALCHEMY_BINDS", {}).update(
+        replicas.replica_binds(app.config["SQLALCHEMY_REPLICA_URIS"])
+    )
+
     # Initialize extensions
     db.init_app(app)
+    replicas.init_app(app, db)
     migrate.init_app(app, db)
     login.init_app(app)
+    mail.init_app(app)
+
+    from app import media, ratelimit, analytics, profiling, metrics, autocomplete, trending, facets, offline, message_store
+    media.init_app(app)
+    ratelimit.init_app(app)
+    analytics.init_app(app)
+    profiling.init_app(app, db)
+    metrics.init_app(app, db)
+    autocomplete.init_app(app, db)
+    trending.init_app(app, db)
+    facets.init_app(app, db)
+    offline.init_app(app)
+    message_store.init_app(app, db)
 
     # Register blueprint
     from app.routes import main
     app.register_blueprint(main)
+    from app.api import api
+    app.register_blueprint(api)
+
+    # After all blueprints, so every template is precompiled
+    from app import templating
+    templating.init_app(app, db)
+
+    # CLI commands
+    from app.email import mail_cli
+    app.cli.add_command(mail_cli)
+    from app.related import related_cli
+    app.cli.add_command(related_cli)
+    from app.geo import geo_cli
+    app.cli.add_command(geo_cli)
+    from app.variants import variants_cli
+    app.cli.add_command(variants_cli)
 
     # Create tables automatically if they don't exist
     with app.app_context():
         db.create_all()
 
+    # Build in-process indexes now, so gunicorn's preloaded master shares them
+    if app.config["PRELOAD_INDEXES"]:
+        autocomplete.preload(app)
+        facets.preload(app)
+
     return app
@@ -0,0 +1,256 @@
+"""Seller analytics: buffered view counters and daily rollups.
+
+Product page views are counted in memory by ``ViewBuffer`` and written as
+batched upserts into ``product_daily_stats``/``seller_daily_stats``. A
+background thread in each worker flushes every ``ANALYTICS_FLUSH_SECONDS``,
+or as soon as ``ANALYTICS_FLUSH_SIZE`` distinct keys are waiting, and once
+more when the worker exits. A request never waits on a flush, and a page
+view never updates a hot row inline.
+
+Message counts come from the ``message`` table itself: ``flask analytics
+rollup`` recounts a range of days with one GROUP BY per day and overwrites
+the rollup columns, so it is safe to re-run; ``--loop`` (the Procfile's
+``analytics`` process) keeps today's counts current.
+
+The seller dashboard only ever reads the rollup tables.
+"""
+import atexit
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+
+from app import db
+from app.models import Message, Product, ProductDailyStats, SellerDailyStats
+
+
+def _today():
+    # Message timestamps are UTC, so days are UTC days too
+    return datetime.utcnow().date()
+
+
+# =========================
+# UPSERTS
+# =========================
+# ON CONFLICT inserts; init_app refuses databases without one
+INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _insert(table):
+    return INSERTS[db.engine.dialect.name](table)
+
+
+def upsert(conn, model, key_columns, rows, increment=(), overwrite=()):
+    """Insert ``rows`` into ``model``'s table, merging on ``key_columns``.
+
+    Columns in ``increment`` are added to the stored value, columns in
+    ``overwrite`` replace it.
+    """
+    if not rows:
+        return
+    table = model.__table__
+    stmt = _insert(table)
+    updates = {col: table.c[col] + stmt.excluded[col] for col in increment}
+    updates.update({col: stmt.excluded[col] for col in overwrite})
+    conn.execute(
+        stmt.on_conflict_do_update(index_elements=list(key_columns), set_=updates),
+        rows,
+    )
+
+
+# =========================
+# VIEW BUFFER
+# =========================
+class ViewBuffer:
+    """Per-worker view counts waiting to be flushed."""
+
+    def __init__(self, flush_size=500, flush_seconds=30.0):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._wake = threading.Event()
+        self._flusher_pid = None
+
+    def record(self, product_id, seller_id, day=None):
+        with self._lock:
+            self._counts[(product_id, seller_id, day or _today())] += 1
+            full = len(self._counts) >= self.flush_size
+        self._start_flusher()
+        if full:
+            self._wake.set()
+
+    def _start_flusher(self):
+        # Started on first use in each process: threads do not survive the
+        # fork from gunicorn's preloaded master
+        if self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        app = current_app._get_current_object()
+        threading.Thread(target=self._run, args=(app,), name="view-buffer", daemon=True).start()
+
+    def _run(self, app):
+        while True:
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            if self.due():
+                with app.app_context():
+                    self.flush()
+
+    def due(self):
+        return bool(self._counts) and (
+            len(self._counts) >= self.flush_size
+            or time.monotonic() - self._last_flush >= self.flush_seconds
+        )
+
+    def _take(self):
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._last_flush = time.monotonic()
+        return counts
+
+    def flush(self):
+        counts = self._take()
+        if not counts:
+            return 0
+
+        per_seller = Counter()
+        for (product_id, seller_id, day), views in counts.items():
+            per_seller[(seller_id, day)] += views
+
+        try:
+            # Own transaction, on the flusher thread or at exit
+            with db.engine.begin() as conn:
+                upsert(conn, ProductDailyStats, ("product_id", "day"), [
+                    {"product_id": pid, "day": day, "seller_id": sid, "views": views, "messages": 0}
+                    for (pid, sid, day), views in counts.items()
+                ], increment=("views",))
+                upsert(conn, SellerDailyStats, ("seller_id", "day"), [
+                    {"seller_id": sid, "day": day, "views": views, "messages": 0}
+                    for (sid, day), views in per_seller.items()
+                ], increment=("views",))
+        except Exception:
+            # Keep the counts for the next attempt rather than losing them
+            with self._lock:
+                self._counts.update(counts)
+            current_app.logger.exception("Flushing view counters failed")
+            return 0
+        return sum(counts.values())
+
+
+def init_app(app):
+    backend = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name()
+    if backend not in INSERTS:
+        raise RuntimeError(
+            f"Seller analytics need PostgreSQL or SQLite for their upserts, not {backend} "
+            "(SQLALCHEMY_DATABASE_URI)"
+        )
+    buffer = ViewBuffer(
+        flush_size=app.config["ANALYTICS_FLUSH_SIZE"],
+        flush_seconds=app.config["ANALYTICS_FLUSH_SECONDS"],
+    )
+    app.extensions["view_buffer"] = buffer
+    app.cli.add_command(analytics_cli)
+
+    def flush_on_exit():
+        with app.app_context():
+            buffer.flush()
+    atexit.register(flush_on_exit)
+
+
+def record_product_view(product):
+    current_app.extensions["view_buffer"].record(product.id, product.seller_id)
+
+
+# =========================
+# ROLLUPS
+# =========================
+def rollup_messages(day):
+    """Recount one day's buyer messages per product and seller."""
+    start = datetime.combine(day, datetime.min.time())
+    end = start + timedelta(days=1)
+    counts = (
+        db.session.query(Product.id, Product.seller_id, db.func.count(Message.id))
+        .join(Message, Message.product_id == Product.id)
+        .filter(Message.receiver_id == Product.seller_id)
+        .filter(Message.timestamp >= start, Message.timestamp < end)
+        .group_by(Product.id, Product.seller_id)
+        .all()
+    )
+    per_seller = Counter()
+    for _, seller_id, messages in counts:
+        per_seller[seller_id] += messages
+
+    with db.engine.begin() as conn:
+        # Start from zero so products that lost messages are corrected too
+        for model in (ProductDailyStats, SellerDailyStats):
+            conn.execute(model.__table__.update().where(model.day == day).values(messages=0))
+        upsert(conn, ProductDailyStats, ("product_id", "day"), [
+            {"product_id": pid, "day": day, "seller_id": sid, "views": 0, "messages": messages}
+            for pid, sid, messages in counts
+        ], overwrite=("messages",))
+        upsert(conn, SellerDailyStats, ("seller_id", "day"), [
+            {"seller_id": sid, "day": day, "views": 0, "messages": messages}
+            for sid, messages in per_seller.items()
+        ], overwrite=("messages",))
+    return sum(per_seller.values())
+
+
+# =========================
+# DASHBOARD READS
+# =========================
+def seller_summary(seller_id, days=30):
+    """Totals for the seller and per product over the last ``days`` days."""
+    since = _today() - timedelta(days=days - 1)
+    views, messages = db.session.query(
+        db.func.coalesce(db.func.sum(SellerDailyStats.views), 0),
+        db.func.coalesce(db.func.sum(SellerDailyStats.messages), 0),
+    ).filter(
+        SellerDailyStats.seller_id == seller_id, SellerDailyStats.day >= since
+    ).one()
+
+    per_product = {
+        pid: {"views": v, "messages": m}
+        for pid, v, m in db.session.query(
+            ProductDailyStats.product_id,
+            db.func.sum(ProductDailyStats.views),
+            db.func.sum(ProductDailyStats.messages),
+        ).filter(
+            ProductDailyStats.seller_id == seller_id, ProductDailyStats.day >= since
+        ).group_by(ProductDailyStats.product_id)
+    }
+    return {"days": days, "views": views, "messages": messages, "products": per_product}
+
+
+# =========================
+# CLI
+# =========================
+analytics_cli = AppGroup("analytics", help="Seller analytics rollups.")
+
+
+@analytics_cli.command("rollup")
+@click.option("--days", type=int, default=2, show_default=True, help="How many days back to recount, including today.")
+@click.option("--loop", is_flag=True, help="Keep recounting every --interval seconds.")
+@click.option("--interval", type=float, default=300.0, show_default=True, help="Seconds between passes with --loop.")
+def rollup_command(days, loop, interval):
+    """Recount message totals into the daily rollup tables."""
+    while True:
+        today = _today()
+        for offset in range(days):
+            day = today - timedelta(days=offset)
+            click.echo(f"{day}: {rollup_messages(day)} message(s)")
+        if not loop:
+            return
+        db.session.remove()
+        time.sleep(interval)
@@ -0,0 +1,366 @@
+"""Versioned JSON API (``/api/v1``) for the mobile client.
+
+Read-only endpoints for products, seller storefronts, the inbox and
+conversations. Each one selects just the columns the response needs and
+serializes the row tuples with orjson; no ORM instances are built.
+
+* ``?fields=name,price,cover`` picks the fields of each item (``id`` is
+  always included). Without it every endpoint returns a short default set;
+  an unknown field is a 400 that lists the available ones.
+* Lists are newest first. ``?limit=`` sets the page size (up to
+  ``API_MAX_PAGE_SIZE``) and the response's ``next_cursor`` is passed back
+  as ``?cursor=`` for the next page; it is ``null`` on the last page.
+* ``/products/batch?ids=3,1,2`` fetches up to ``API_BATCH_MAX`` products in
+  one call, in the order asked, and lists the ids that were not found.
+
+Writes stay on the HTML routes (and ``/seller/products/bulk.json``).
+"""
+import orjson
+from flask import Blueprint, Response, abort, current_app, request
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+
+from app import db
+from app.bulk import parse_ids
+from app.message_store import load_conversation
+from app.models import (
+    Category, Message, Product, ProductImage, ProductVariant, SellerProfile, User
+)
+from app.ratelimit import rate_limit
+from app.variants import in_stock_product_ids, parse_size_unit
+
+api = Blueprint("api", __name__, url_prefix="/api/v1")
+
+
+# =========================
+# HELPERS
+# =========================
+def _respond(payload, status=200):
+    # Datetimes are stored as naive UTC; say so in the output
+    return Response(
+        orjson.dumps(payload, option=orjson.OPT_NAIVE_UTC), status=status, mimetype="application/json"
+    )
+
+
+@api.errorhandler(HTTPException)
+def _http_error(exc):
+    response = _respond({"error": exc.description}, exc.code)
+    for name, value in exc.get_headers():
+        if name.lower() != "content-type":
+            response.headers[name] = value  # e.g. Retry-After on 429
+    return response
+
+
+def _require_login():
+    if not current_user.is_authenticated:
+        abort(401, "Log in first.")
+
+
+def _fields(columns, extras, default):
+    """Names of the requested fields, ``id`` first; aborts on unknown ones."""
+    requested = request.args.get("fields")
+    if not requested:
+        return default
+    names = [name.strip() for name in requested.split(",") if name.strip()]
+    unknown = [name for name in names if name not in columns and name not in extras]
+    if unknown:
+        abort(400, f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join([*columns, *extras])}.")
+    return list(dict.fromkeys(["id", *names]))
+
+
+def _page_args():
+    config = current_app.config
+    limit = request.args.get("limit", config["API_PAGE_SIZE"], type=int)
+    return request.args.get("cursor", type=int), max(1, min(limit, config["API_MAX_PAGE_SIZE"]))
+
+
+def _select(columns, names, extras, statement_from):
+    """Run ``statement_from(select of the column fields)`` and build the items.
+
+    ``extras`` fields are loaded afterwards with one query each for all
+    the ids on the page.
+    """
+    column_names = [name for name in names if name in columns]
+    rows = db.session.execute(statement_from(db.select(*(columns[name] for name in column_names)))).all()
+    items = [dict(zip(column_names, row)) for row in rows]
+    ids = [item["id"] for item in items]
+    for name in names:
+        if name in extras and ids:
+            values = extras[name](ids)
+            for item in items:
+                item[name] = values.get(item["id"], [])
+    return items
+
+
+def _paged(items, limit, key="id"):
+    if len(items) > limit:
+        return items[:limit], items[limit - 1][key]
+    return items, None
+
+
+# =========================
+# PRODUCTS
+# =========================
+PRODUCT_COLUMNS = {
+    "id": Product.id,
+    "name": Product.name,
+    "description": Product.description,
+    "price": Product.price,
+    "size_unit": Product.size_unit,
+    "stock_quantity": Product.stock_quantity,
+    "seller_id": Product.seller_id,
+    "category_id": Product.category_id,
+    "created_at": Product.timestamp,
+    "category": (
+        db.select(Category.name).where(Category.id == Product.category_id).scalar_subquery()
+    ),
+    # First image by ix_product_image_product_id
+    "cover": (
+        db.select(ProductImage.image_url)
+        .where(ProductImage.product_id == Product.id)
+        .order_by(ProductImage.id)
+        .limit(1)
+        .scalar_subquery()
+    ),
+}
+
+
+def _product_images(ids):
+    images = {}
+    for product_id, url in db.session.execute(
+        db.select(ProductImage.product_id, ProductImage.image_url)
+        .where(ProductImage.product_id.in_(ids))
+        .order_by(ProductImage.product_id, ProductImage.id)
+    ):
+        images.setdefault(product_id, []).append(url)
+    return images
+
+
+def _product_sizes(ids):
+    sizes = {}
+    for product_id, system, size, stock in db.session.execute(
+        db.select(ProductVariant.product_id, ProductVariant.size_system, ProductVariant.size, ProductVariant.stock)
+        .where(ProductVariant.product_id.in_(ids))
+        .order_by(ProductVariant.product_id, ProductVariant.size_system, ProductVariant.size)
+    ):
+        sizes.setdefault(product_id, []).append({"size": f"{system} {size:g}", "stock": stock})
+    return sizes
+
+
+PRODUCT_EXTRAS = {"images": _product_images, "sizes": _product_sizes}
+PRODUCT_LIST_FIELDS = ["id", "name", "price", "stock_quantity", "cover"]
+PRODUCT_DETAIL_FIELDS = [
+    "id", "name", "description", "price", "stock_quantity", "seller_id",
+    "category", "created_at", "images", "sizes",
+]
+
+
+def _product_page(*criteria):
+    """One page of products matching ``criteria`` and the request's filters."""
+    names = _fields(PRODUCT_COLUMNS, PRODUCT_EXTRAS, PRODUCT_LIST_FIELDS)
+    cursor, limit = _page_args()
+
+    criteria = list(criteria)
+    category_id = request.args.get("category_id", type=int)
+    if category_id is not None:
+        criteria.append(Product.category_id == category_id)
+    if request.args.get("in_stock", type=int) == 1:
+        criteria.append(Product.stock_quantity > 0)
+    # Same "size X in stock under price Y" filter as the storefront page
+    max_price = request.args.get("max_price", type=float)
+    parsed = parse_size_unit(request.args.get("size", "").strip())[:1]
+    if parsed:
+        (size_system, size_value), = parsed
+        criteria.append(Product.id.in_(in_stock_product_ids(size_system, size_value, max_price)))
+    elif max_price is not None:
+        criteria.append(Product.price <= max_price)
+    if cursor is not None:
+        criteria.append(Product.id < cursor)
+
+    items = _select(
+        PRODUCT_COLUMNS, names, PRODUCT_EXTRAS,
+        lambda query: query.where(*criteria).order_by(Product.id.desc()).limit(limit + 1),
+    )
+    items, next_cursor = _paged(items, limit)
+    return {"products": items, "next_cursor": next_cursor}
+
+
+@api.route("/products")
+def products():
+    """Filters: ``seller_id``, ``category_id``, ``in_stock=1``, ``size``, ``max_price``."""
+    seller_id = request.args.get("seller_id", type=int)
+    return _respond(_product_page(*([Product.seller_id == seller_id] if seller_id is not None else [])))
+
+
+@api.route("/products/<int:product_id>")
+def product(product_id):
+    names = _fields(PRODUCT_COLUMNS, PRODUCT_EXTRAS, PRODUCT_DETAIL_FIELDS)
+    items = _select(PRODUCT_COLUMNS, names, PRODUCT_EXTRAS, lambda query: query.where(Product.id == product_id))
+    if not items:
+        abort(404, "No such product.")
+    return _respond({"product": items[0]})
+
+
+@api.route("/products/batch")
+@rate_limit("300/minute", methods=("GET",))
+def products_batch():
+    """``?ids=3,1,2``: the products in that order, plus ``missing`` ids."""
+    try:
+        ids = parse_ids([value for value in request.args.get("ids", "").split(",") if value.strip()])
+    except ValueError as exc:
+        abort(400, str(exc))
+    if len(ids) > current_app.config["API_BATCH_MAX"]:
+        abort(400, f"At most {current_app.config['API_BATCH_MAX']} ids per request.")
+
+    names = _fields(PRODUCT_COLUMNS, PRODUCT_EXTRAS, PRODUCT_LIST_FIELDS)
+    found = {
+        item["id"]: item
+        for item in _select(PRODUCT_COLUMNS, names, PRODUCT_EXTRAS, lambda query: query.where(Product.id.in_(ids)))
+    }
+    return _respond({
+        "products": [found[i] for i in ids if i in found],
+        "missing": [i for i in ids if i not in found],
+    })
+
+
+# =========================
+# SELLERS
+# =========================
+SELLER_COLUMNS = {
+    "id": User.id,
+    "username": User.username,
+    "shop_name": SellerProfile.shop_name,
+    "about": SellerProfile.about,
+    "logo": SellerProfile.shop_logo,
+    "phone_number": SellerProfile.phone_number,
+    "location": SellerProfile.location,
+    "open_hours": SellerProfile.open_hours,
+    "rating": SellerProfile.rating,
+    "latitude": SellerProfile.latitude,
+    "longitude": SellerProfile.longitude,
+    "product_count": (
+        db.select(db.func.count(Product.id)).where(Product.seller_id == User.id).scalar_subquery()
+    ),
+}
+
+
+def _seller_categories(ids):
+    categories = {}
+    for seller_id, category_id, name, parent_id in db.session.execute(
+        db.select(Category.seller_id, Category.id, Category.name, Category.parent_id)
+        .where(Category.seller_id.in_(ids))
+        .order_by(Category.seller_id, Category.name)
+    ):
+        categories.setdefault(seller_id, []).append({"id": category_id, "name": name, "parent_id": parent_id})
+    return categories
+
+
+SELLER_EXTRAS = {"categories": _seller_categories}
+SELLER_FIELDS = ["id", "shop_name", "logo", "location", "rating", "product_count", "categories"]
+
+
+@api.route("/sellers/<int:seller_id>")
+def seller(seller_id):
+    names = _fields(SELLER_COLUMNS, SELLER_EXTRAS, SELLER_FIELDS)
+    items = _select(
+        SELLER_COLUMNS, names, SELLER_EXTRAS,
+        lambda query: query.select_from(User)
+        .outerjoin(SellerProfile, SellerProfile.user_id == User.id)
+        .where(User.id == seller_id, User.role == "seller"),
+    )
+    if not items:
+        abort(404, "No such seller.")
+    return _respond({"seller": items[0]})
+
+
+@api.route("/sellers/<int:seller_id>/products")
+def seller_products(seller_id):
+    """The storefront's products; same filters and fields as ``/products``."""
+    return _respond(_product_page(Product.seller_id == seller_id))
+
+
+# =========================
+# MESSAGING
+# =========================
+MESSAGE_COLUMNS = {
+    "id": Message.id,
+    "sender_id": Message.sender_id,
+    "receiver_id": Message.receiver_id,
+    "content": Message.content,
+    "is_read": Message.is_read,
+    "created_at": Message.timestamp,
+}
+MESSAGE_FIELDS = list(MESSAGE_COLUMNS)
+
+
+@api.route("/inbox")
+def inbox():
+    """The current user's conversations, most recently active first.
+
+    Reads the hot message table only, like the inbox page without
+    ``?older=1``. The cursor is the id of a conversation's last message.
+    """
+    _require_login()
+    cursor, limit = _page_args()
+    me = current_user.id
+    other = db.case((Message.sender_id == me, Message.receiver_id), else_=Message.sender_id)
+    conversations = (
+        db.select(
+            Message.product_id,
+            other.label("user_id"),
+            db.func.max(Message.id).label("last_id"),
+            db.func.sum(db.case(((Message.receiver_id == me) & ~Message.is_read, 1), else_=0)).label("unread"),
+        )
+        .where((Message.sender_id == me) | (Message.receiver_id == me), Message.product_id.isnot(None))
+        .group_by(Message.product_id, other)
+        .subquery()
+    )
+    last = db.aliased(Message)
+    columns = {
+        "id": conversations.c.last_id,
+        "product_id": conversations.c.product_id,
+        "product_name": Product.name,
+        "user_id": conversations.c.user_id,
+        "username": User.username,
+        "unread": conversations.c.unread,
+        "last_message": last.content,
+        "last_sender_id": last.sender_id,
+        "updated_at": last.timestamp,
+    }
+    names = _fields(columns, {}, list(columns))
+
+    def statement(query):
+        query = (
+            query.select_from(conversations)
+            .join(last, last.id == conversations.c.last_id)
+            .join(Product, Product.id == conversations.c.product_id)
+            .join(User, User.id == conversations.c.user_id)
+        )
+        if cursor is not None:
+            query = query.where(conversations.c.last_id < cursor)
+        return query.order_by(conversations.c.last_id.desc()).limit(limit + 1)
+
+    items, next_cursor = _paged(_select(columns, names, {}, statement), limit)
+    return _respond({"conversations": items, "next_cursor": next_cursor})
+
+
+@api.route("/conversations/<int:product_id>/<int:user_id>")
+def conversation(product_id, user_id):
+    """One page of messages with ``user_id`` about a product, oldest first.
+
+    ``next_cursor`` pages back to older messages, into the archive when
+    the hot table runs out. Reading does not mark messages as read.
+    """
+    _require_login()
+    names = _fields(MESSAGE_COLUMNS, {}, MESSAGE_FIELDS)
+    cursor, limit = _page_args()
+    messages, next_cursor = load_conversation(
+        product_id, current_user.id, user_id, before=cursor, limit=limit,
+        columns=[MESSAGE_COLUMNS[name] for name in names],
+    )
+    # Hot rows and archived messages share attribute names
+    keys = {name: MESSAGE_COLUMNS[name].key for name in names}
+    return _respond({
+        "messages": [{name: getattr(message, key) for name, key in keys.items()} for message in messages],
+        "next_cursor": next_cursor,
+    })
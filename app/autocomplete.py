@@ -0,0 +1,352 @@
+"""Typeahead suggestions from an in-process prefix index.
+
+``/autocomplete?q=...`` never touches the database. Each worker keeps a
+sorted list of normalised keys for product names, shop names and category
+names, and a lookup is a binary search plus a short scan. A name is
+indexed from its start and from each of its next few words, so "boot"
+finds "Leather Boot".
+
+The index is built when the app starts, so gunicorn's preloaded master
+shares it with its workers (on first use if ``PRELOAD_INDEXES`` is off),
+and then kept current from ORM writes: names flushed in a transaction are
+applied when it commits. Writes made by other workers, and bulk
+``query.update()`` calls, are picked up by a full rebuild every
+``AUTOCOMPLETE_REFRESH_SECONDS`` on a background thread (app/background.py);
+changes committed while it runs are replayed onto the new index.
+
+Memory is bounded by ``AUTOCOMPLETE_MAX_ENTRIES``. Shops and categories
+are always kept; when the limit is hit, the oldest products are dropped
+first.
+"""
+import sys
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from bisect import bisect_left, bisect_right
+
+from flask import current_app, has_app_context, jsonify, request, url_for
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.background import PeriodicTask, start_with_requests
+from app.models import Category, Product, SellerProfile
+
+PRODUCT, SHOP, CATEGORY = 0, 1, 2
+KIND_NAMES = {PRODUCT: "product", SHOP: "shop", CATEGORY: "category"}
+KIND_RANK = {SHOP: 0, CATEGORY: 1, PRODUCT: 2}
+MAX_KEY_LENGTH = 24  # typeahead queries are short; longer keys only cost memory
+WORD_STARTS = 3  # index a name from its first few word boundaries
+
+
+def _fold(text):
+    text = text or ""
+    if not text.isascii():
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.casefold().split())
+
+
+def normalise(text):
+    return _fold(text)[:MAX_KEY_LENGTH]
+
+
+def name_keys(name):
+    """Keys a name is findable under: the whole name and later word starts."""
+    words = _fold(name).split()
+    return list(dict.fromkeys(
+        " ".join(words[i:])[:MAX_KEY_LENGTH] for i in range(min(len(words), WORD_STARTS))
+    ))
+
+
+class PrefixIndex:
+    """Sorted keys with a parallel array of packed entry ids.
+
+    An entry id is ``target * 4 + kind``; categories, which are shared by
+    name, get a synthetic target. Each slot of ``_ids`` stores
+    ``entry * 2 + 1`` when its key is the start of the name, so ranking
+    whole-name matches first needs no string work at lookup time.
+    """
+
+    def __init__(self, max_entries=100_000):
+        self.max_entries = max_entries
+        self._keys = []  # sorted, interned
+        self._ids = array("q")
+        self._labels = {}  # entry -> display label
+        self._products = OrderedDict()  # product entries, oldest first
+        self._categories = {}  # folded name -> [entry, number of categories]
+        self._category_of = {}  # Category.id -> folded name
+        self._next_category = 0
+        self._lock = threading.Lock()
+        self._pending = None  # (key, slot) pairs while bulk loading
+
+    def __len__(self):
+        return len(self._labels)
+
+    # ----- writes -----
+    def _add(self, entry, label):
+        for position, key in enumerate(name_keys(label)):
+            key = sys.intern(key)
+            slot = entry * 2 + (position == 0)
+            if self._pending is not None:
+                self._pending.append((key, slot))
+            else:
+                i = self._position(key, slot)
+                self._keys.insert(i, key)
+                self._ids.insert(i, slot)
+        self._labels[entry] = label
+
+    def _position(self, key, slot):
+        # Slots are kept sorted within a run of equal keys
+        lo = bisect_left(self._keys, key)
+        hi = bisect_right(self._keys, key, lo)
+        return bisect_left(self._ids, slot, lo, hi)
+
+    def _remove(self, entry):
+        label = self._labels.pop(entry, None)
+        if label is None:
+            return
+        for position, key in enumerate(name_keys(label)):
+            slot = entry * 2 + (position == 0)
+            i = self._position(key, slot)
+            if i < len(self._ids) and self._ids[i] == slot and self._keys[i] == key:
+                del self._keys[i]
+                del self._ids[i]
+
+    def put_product(self, product_id, name):
+        entry = product_id * 4 + PRODUCT
+        with self._lock:
+            self._remove(entry)
+            self._products.pop(entry, None)
+            if not name:
+                return
+            while len(self._labels) >= self.max_entries and self._products:
+                oldest, _ = self._products.popitem(last=False)
+                self._remove(oldest)
+            if len(self._labels) < self.max_entries:
+                self._add(entry, name)
+                self._products[entry] = None
+
+    def put_shop(self, seller_id, shop_name):
+        entry = seller_id * 4 + SHOP
+        with self._lock:
+            self._remove(entry)
+            if shop_name:
+                self._add(entry, shop_name)
+
+    def put_category(self, category_id, name):
+        """Categories are per seller, so equal names share one suggestion."""
+        with self._lock:
+            old = self._category_of.pop(category_id, None)
+            if old is not None:
+                self._categories[old][1] -= 1
+                if not self._categories[old][1]:
+                    self._remove(self._categories.pop(old)[0])
+            if not name:
+                return
+            folded = normalise(name)
+            if folded not in self._categories:
+                entry = self._next_category * 4 + CATEGORY
+                self._next_category += 1
+                self._categories[folded] = [entry, 0]
+                self._add(entry, name)
+            self._categories[folded][1] += 1
+            self._category_of[category_id] = folded
+
+    def remove_product(self, product_id):
+        self.put_product(product_id, None)
+
+    def remove_shop(self, seller_id):
+        self.put_shop(seller_id, None)
+
+    def remove_category(self, category_id):
+        self.put_category(category_id, None)
+
+    def begin_bulk(self):
+        self._pending = []
+
+    def end_bulk(self):
+        pending, self._pending = self._pending, None
+        pending.sort()
+        self._keys = [key for key, _ in pending]
+        self._ids = array("q", (slot for _, slot in pending))
+
+    # ----- reads -----
+    def lookup(self, query, limit=8, scan=64):
+        """Up to ``limit`` ``(kind, label, target)`` suggestions for ``query``."""
+        prefix = normalise(query)
+        if not prefix:
+            return []
+        found = {}  # entry -> matched at the start of the name
+        with self._lock:
+            keys, ids = self._keys, self._ids
+            i = bisect_left(keys, prefix)
+            while i < len(keys) and len(found) < scan and keys[i].startswith(prefix):
+                entry, at_start = divmod(ids[i], 2)
+                found[entry] = found.get(entry, 0) | at_start
+                i += 1
+            labels = [(entry, at_start, self._labels[entry]) for entry, at_start in found.items()]
+
+        labels.sort(key=lambda item: (not item[1], KIND_RANK[item[0] % 4], len(item[2]), item[2]))
+        return [
+            (KIND_NAMES[entry % 4], label, entry // 4 if entry % 4 != CATEGORY else None)
+            for entry, _, label in labels[:limit]
+        ]
+
+
+def build_index(max_entries):
+    index = PrefixIndex(max_entries=max_entries)
+    # Collect keys unsorted and sort once; per-key inserts would be quadratic
+    index.begin_bulk()
+    for seller_id, shop_name in db.session.query(SellerProfile.user_id, SellerProfile.shop_name):
+        index.put_shop(seller_id, shop_name)
+    for category_id, name in db.session.query(Category.id, Category.name):
+        index.put_category(category_id, name)
+    # Newest last, so they are the ones kept if the index fills up
+    remaining = max_entries - len(index)
+    newest = (
+        db.session.query(Product.id, Product.name)
+        .order_by(Product.id.desc())
+        .limit(max(remaining, 0))
+        .all()
+    )
+    for product_id, name in reversed(newest):
+        index.put_product(product_id, name)
+    index.end_bulk()
+    return index
+
+
+def get_index():
+    """This worker's index, built on first use if it was not preloaded."""
+    state = current_app.extensions["autocomplete"]
+    if state["index"] is None:
+        with state["build_lock"]:
+            if state["index"] is None:
+                state["index"] = build_index(current_app.config["AUTOCOMPLETE_MAX_ENTRIES"])
+    return state["index"]
+
+
+def preload(app):
+    """Build the index while the app starts."""
+    with app.app_context():
+        try:
+            get_index()
+        except SQLAlchemyError:
+            # e.g. before `flask db upgrade` has run; build on first use instead
+            app.logger.warning("Autocomplete index not preloaded", exc_info=True)
+
+
+def refresh_index():
+    """Rebuild from the database and swap the new index in."""
+    state = current_app.extensions["autocomplete"]
+    with state["build_lock"]:
+        state["replay"] = []
+    try:
+        index = build_index(current_app.config["AUTOCOMPLETE_MAX_ENTRIES"])
+        with state["build_lock"]:
+            # Commits made while building may not be in what the build read
+            _apply(index, state["replay"])
+            state["index"] = index
+    finally:
+        with state["build_lock"]:
+            state["replay"] = None
+
+
+# =========================
+# INCREMENTAL UPDATES
+# =========================
+def _name_changed(obj, attr):
+    return inspect(obj).attrs[attr].history.has_changes()
+
+
+def _collect_changes(session, flush_context):
+    changes = session.info.setdefault("autocomplete_changes", [])
+    for obj in session.new | session.dirty:
+        if isinstance(obj, Product) and _name_changed(obj, "name"):
+            changes.append((PRODUCT, obj.id, obj.name))
+        elif isinstance(obj, SellerProfile) and _name_changed(obj, "shop_name"):
+            changes.append((SHOP, obj.user_id, obj.shop_name))
+        elif isinstance(obj, Category) and _name_changed(obj, "name"):
+            changes.append((CATEGORY, obj.id, obj.name))
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            changes.append((PRODUCT, obj.id, None))
+        elif isinstance(obj, SellerProfile):
+            changes.append((SHOP, obj.user_id, None))
+        elif isinstance(obj, Category):
+            changes.append((CATEGORY, obj.id, None))
+
+
+def forget_products(session, product_ids):
+    """Drop products removed by a bulk DELETE when ``session`` commits.
+
+    Bulk statements bypass the flush events above, so callers report the
+    ids themselves.
+    """
+    session.info.setdefault("autocomplete_changes", []).extend(
+        (PRODUCT, product_id, None) for product_id in product_ids
+    )
+
+
+def _apply_changes(session):
+    changes = session.info.pop("autocomplete_changes", None)
+    if not changes or not has_app_context():
+        return
+    state = current_app.extensions.get("autocomplete")
+    if state is None:
+        return
+    with state["build_lock"]:
+        if state["replay"] is not None:
+            state["replay"].extend(changes)
+        index = state["index"]
+        if index is not None:  # not built yet; the first build will read these rows
+            _apply(index, changes)
+
+
+def _apply(index, changes):
+    for kind, target, name in changes:
+        if kind == PRODUCT:
+            index.put_product(target, name)
+        elif kind == SHOP:
+            index.put_shop(target, name)
+        else:
+            index.put_category(target, name)
+
+
+def _discard_changes(session):
+    session.info.pop("autocomplete_changes", None)
+
+
+# =========================
+# ENDPOINT
+# =========================
+def autocomplete():
+    query = request.args.get("q", "")
+    limit = max(1, min(request.args.get("limit", 8, type=int), 20))
+    results = []
+    for kind, label, target in get_index().lookup(query, limit=limit):
+        item = {"type": kind, "label": label}
+        if kind == "product":
+            item["url"] = url_for("main.product_detail", product_id=target)
+        elif kind == "shop":
+            item["url"] = url_for("main.view_seller_products", seller_id=target)
+        results.append(item)
+    response = jsonify(query=query, results=results)
+    response.headers["Cache-Control"] = "private, max-age=60"
+    return response
+
+
+def init_app(app, db):
+    app.extensions["autocomplete"] = {"index": None, "replay": None, "build_lock": threading.Lock()}
+    app.add_url_rule("/autocomplete", "autocomplete", autocomplete)
+
+    session_class = db.session.session_factory.class_
+    event.listen(session_class, "after_flush", _collect_changes)
+    event.listen(session_class, "after_commit", _apply_changes)
+    event.listen(session_class, "after_rollback", _discard_changes)
+
+    # Catch up with other workers' writes
+    start_with_requests(app, PeriodicTask(
+        "autocomplete-refresh", app.config["AUTOCOMPLETE_REFRESH_SECONDS"], refresh_index
+    ))
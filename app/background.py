@@ -0,0 +1,51 @@
+"""Periodic jobs on a daemon thread in each worker process.
+
+In-process indexes (autocomplete, facets) are rebuilt from the database
+now and then. Doing that in ``teardown_request`` makes some user's request
+wait for it, because Flask tears down before the server writes the
+response. ``PeriodicTask`` runs the job on its own thread instead, in an
+app context with its own session.
+
+The thread is started by the first request each process serves: threads
+do not survive the fork from gunicorn's preloaded master, and the master
+itself serves nothing.
+"""
+import os
+import threading
+import time
+
+from app import db
+
+
+class PeriodicTask:
+    def __init__(self, name, interval, function):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self, app):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, args=(app,), name=self.name, daemon=True).start()
+
+    def _run(self, app):
+        while True:
+            time.sleep(self.interval)
+            with app.app_context():
+                try:
+                    self.function()
+                except Exception:
+                    app.logger.exception("Background task %s failed", self.name)
+                finally:
+                    db.session.remove()
+
+
+def start_with_requests(app, task):
+    """Start ``task`` in each process on its first request."""
+    app.before_request(lambda: task.ensure_started(app))
@@ -0,0 +1,72 @@
+"""Circuit breaker for calls to an outside service (used for Cloudinary).
+
+* closed: calls go through. ``failure_threshold`` failures in a row open
+  the circuit.
+* open: ``allow()`` refuses every call for ``reset_seconds``, so requests
+  fail at once instead of each waiting for a timeout.
+* half-open: after that, one call at a time is let through as a probe.
+  Its success closes the circuit; its failure opens it again.
+
+State is kept per process. Each gunicorn worker finds out on its own that
+the service is down, and while it is open sends at most one probe per
+``reset_seconds``.
+"""
+import threading
+import time
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_seconds=30, clock=time.monotonic, on_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.on_change = on_change  # called with (breaker, new_state)
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set(self, state):
+        if state != self._state:
+            self._state = state
+            if self.on_change is not None:
+                self.on_change(self, state)
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and self.clock() - self._opened_at >= self.reset_seconds:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """Whether a call may go ahead now; the caller must then record its outcome."""
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN:
+                if self.clock() - self._opened_at < self.reset_seconds:
+                    return False
+                self._set(HALF_OPEN)
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._set(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+                self._set(OPEN)
@@ -0,0 +1,167 @@
+"""Bulk catalog changes for sellers.
+
+Each operation is one set-based statement over ``product`` with the
+seller's id in its WHERE clause, so ids belonging to someone else are
+simply not matched, whatever the caller sends. Rows that hang off the
+deleted products (images, variants, related-product rows, message links)
+are cleared with one statement per table in the same transaction.
+
+Used by the dashboard's multi-select form and by
+``POST /seller/products/bulk.json``.
+"""
+from app import db
+from app.autocomplete import forget_products
+from app.facets import touch_products
+from app.media import schedule_cloudinary_delete
+from app.models import (
+    Category, Message, Product, ProductImage, ProductVariant, RelatedProduct
+)
+from app.trending import credit_restocks
+
+MAX_BULK_IDS = 500
+
+
+def parse_ids(values):
+    """Unique positive ints from form/JSON input; raises ``ValueError``."""
+    if not isinstance(values, (list, tuple)):
+        raise ValueError("Select at least one product.")
+    ids = []
+    for value in values:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid product id: {value!r}.")
+    ids = [i for i in dict.fromkeys(ids) if i > 0]
+    if not ids:
+        raise ValueError("Select at least one product.")
+    if len(ids) > MAX_BULK_IDS:
+        raise ValueError(f"At most {MAX_BULK_IDS} products can be changed at once.")
+    return ids
+
+
+def _number(data, key, kind, low, high=None):
+    value = data.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or (kind is int and value != int(value)):
+        raise ValueError(f"{key} must be a number.")
+    if value < low or (high is not None and value > high):
+        raise ValueError(f"{key} is out of range.")
+    return kind(value)
+
+
+def parse_changes(data):
+    """``update_products`` keyword arguments from a JSON body."""
+    return {
+        "price": _number(data, "price", float, 0),
+        "price_percent": _number(data, "price_percent", float, -90, 1000),
+        "stock_quantity": _number(data, "stock_quantity", int, 0),
+        "category_id": _number(data, "category_id", int, 1),
+    }
+
+
+def update_products(seller_id, ids, price=None, price_percent=None, stock_quantity=None, category_id=None):
+    """Apply the given changes to the seller's products among ``ids``.
+
+    ``price`` sets a price, ``price_percent`` scales the current one
+    (``-10`` is a 10% cut). ``stock_quantity`` is skipped for products
+    with per-size stock, whose total comes from their variants. A
+    ``category_id`` the seller does not own matches nothing. Returns the
+    number of products updated. Products whose stock went up are credited
+    as restocks in the trending scores.
+    """
+    values = {}
+    restocked = set()
+    if price is not None:
+        values[Product.price] = price
+    elif price_percent is not None:
+        values[Product.price] = db.func.round(Product.price * (1 + price_percent / 100.0), 2)
+    if stock_quantity is not None:
+        has_variants = db.select(ProductVariant.id).where(ProductVariant.product_id == Product.id).exists()
+        values[Product.stock_quantity] = db.case((has_variants, Product.stock_quantity), else_=stock_quantity)
+        # Found before the UPDATE, whose RETURNING only sees the new stock
+        restocked = set(db.session.scalars(
+            db.select(Product.id).where(
+                Product.id.in_(ids), Product.seller_id == seller_id, ~has_variants,
+                db.func.coalesce(Product.stock_quantity, 0) < stock_quantity,
+            )
+        ))
+    if category_id is not None:
+        values[Product.category_id] = category_id
+    if not values:
+        raise ValueError("Nothing to change.")
+
+    statement = (
+        db.update(Product)
+        .where(Product.id.in_(ids), Product.seller_id == seller_id)
+        .values(values)
+        .execution_options(synchronize_session=False)
+    )
+    if category_id is not None:
+        statement = statement.where(
+            db.select(Category.id).where(Category.id == category_id, Category.seller_id == seller_id).exists()
+        )
+    updated = [product_id for (product_id,) in db.session.execute(statement.returning(Product.id))]
+    touch_products(db.session, updated)
+    credit_restocks(db.session.connection(), seller_id, sorted(restocked.intersection(updated)))
+
+    if updated and Product.price in values:
+        # Variants carry a copy of the price for the size filter
+        product_price = db.select(Product.price).where(Product.id == ProductVariant.product_id).scalar_subquery()
+        db.session.execute(
+            db.update(ProductVariant)
+            .where(ProductVariant.product_id.in_(updated))
+            .values(price=product_price)
+            .execution_options(synchronize_session=False)
+        )
+    return len(updated)
+
+
+def move_category_products(seller_id, from_category_id, to_category_id):
+    """Re-parent every product in one category to another; returns the count."""
+    moved = [
+        product_id for (product_id,) in db.session.execute(
+            db.update(Product)
+            .where(Product.category_id == from_category_id, Product.seller_id == seller_id)
+            .values(category_id=to_category_id)
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        )
+    ]
+    touch_products(db.session, moved)
+    return len(moved)
+
+
+def delete_products(seller_id, ids):
+    """Delete the seller's products among ``ids``; returns the number deleted.
+
+    References to their Cloudinary images are released (queueing assets
+    nothing else uses), and messages about them are kept with the product
+    link cleared.
+    """
+    owned = db.select(Product.id).where(Product.id.in_(ids), Product.seller_id == seller_id)
+    # Images may share a deduplicated asset, so release references rather than queue blindly
+    schedule_cloudinary_delete(*db.session.scalars(
+        db.select(ProductImage.public_id).where(ProductImage.product_id.in_(owned))
+    ))
+    for statement in (
+        db.delete(ProductImage).where(ProductImage.product_id.in_(owned)),
+        db.delete(ProductVariant).where(ProductVariant.product_id.in_(owned)),
+        db.delete(RelatedProduct).where(
+            RelatedProduct.product_id.in_(owned) | RelatedProduct.related_id.in_(owned)
+        ),
+        db.update(Message).where(Message.product_id.in_(owned)).values(product_id=None),
+    ):
+        db.session.execute(statement.execution_options(synchronize_session=False))
+
+    deleted = [
+        product_id for (product_id,) in db.session.execute(
+            db.delete(Product)
+            .where(Product.id.in_(ids), Product.seller_id == seller_id)
+            .returning(Product.id)
+            .execution_options(synchronize_session=False)
+        )
+    ]
+    forget_products(db.session, deleted)
+    touch_products(db.session, deleted)
+    return len(deleted)
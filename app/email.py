@@ -0,0 +1,193 @@
+"""Transactional email through an outbox table.
+
+Views never talk to SMTP. They add ``EmailOutbox`` rows in the same
+transaction as the change that triggers the email, and ``flask mail send``
+(run by a worker or cron) delivers them over one SMTP connection per batch.
+"You have new messages" notifications are coalesced into a single digest per
+user once the oldest one has waited ``MAIL_DIGEST_DELAY_MINUTES``.
+
+For local runs point ``MAIL_SERVER``/``MAIL_PORT`` at an SMTP sink such as
+``python -m aiosmtpd -n -l localhost:1025``.
+"""
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app, render_template, url_for
+from flask.cli import AppGroup
+from flask_mail import Message as MailMessage
+
+from app import db, mail
+from app.models import EmailOutbox, Message, Product
+
+RESET_PASSWORD = "password_reset"
+NEW_MESSAGE = "new_message"
+
+
+# =========================
+# ENQUEUE (request side)
+# =========================
+def _site_url(endpoint, **values):
+    # Against SITE_URL, never the request's Host header: a forged Host would
+    # otherwise put a valid reset token in a link to someone else's site
+    with current_app.test_request_context(base_url=current_app.config["SITE_URL"]):
+        return url_for(endpoint, _external=True, **values)
+
+
+def queue_password_reset(user):
+    token = user.get_reset_password_token()
+    db.session.add(EmailOutbox(
+        kind=RESET_PASSWORD,
+        user_id=user.id,
+        recipient=user.email,
+        subject="Reset your Afrido password",
+        body=render_template(
+            "email/reset_password.txt",
+            user=user,
+            reset_url=_site_url("main.reset_password", token=token),
+        ),
+    ))
+
+
+def queue_new_message_notification(message, recipient):
+    """Record a pending notification; the body is built when the digest goes out."""
+    if not recipient.email:
+        return
+    db.session.add(EmailOutbox(
+        kind=NEW_MESSAGE,
+        user_id=recipient.id,
+        recipient=recipient.email,
+        message_id=message.id,
+    ))
+
+
+# =========================
+# SENDER (worker side)
+# =========================
+def _mail_message(recipient, subject, body):
+    return MailMessage(subject=subject, recipients=[recipient], body=body)
+
+
+def _build_digests(rows):
+    """Group pending notifications into one (rows, MailMessage) per user."""
+    by_user = defaultdict(list)
+    for row in rows:
+        by_user[row.user_id].append(row)
+
+    message_ids = [row.message_id for row in rows if row.message_id]
+    messages = {
+        m.id: m for m in Message.query.filter(Message.id.in_(message_ids))
+    } if message_ids else {}
+    products = {
+        p.id: p.name for p in Product.query.filter(
+            Product.id.in_({m.product_id for m in messages.values() if m.product_id})
+        )
+    } if messages else {}
+
+    digests = []
+    for user_rows in by_user.values():
+        # Messages read (or archived) since they were queued need no reminder
+        unread = [
+            messages[row.message_id] for row in user_rows
+            if row.message_id in messages and not messages[row.message_id].is_read
+        ]
+        if not unread:
+            digests.append((user_rows, None))
+            continue
+        counts = defaultdict(int)
+        for msg in unread:
+            counts[products.get(msg.product_id, "a product")] += 1
+        body = render_template("email/message_digest.txt", counts=sorted(counts.items()), total=len(unread))
+        subject = f"You have {len(unread)} new message{'s' if len(unread) != 1 else ''} on Afrido"
+        digests.append((user_rows, _mail_message(user_rows[0].recipient, subject, body)))
+    return digests
+
+
+def _due_notifications(now, limit):
+    delay = timedelta(minutes=current_app.config["MAIL_DIGEST_DELAY_MINUTES"])
+    max_attempts = current_app.config["MAIL_MAX_ATTEMPTS"]
+    # Users whose oldest pending notification has waited long enough
+    due_users = (
+        db.session.query(EmailOutbox.user_id)
+        .filter_by(kind=NEW_MESSAGE, sent_at=None)
+        .filter(EmailOutbox.attempts < max_attempts)
+        .group_by(EmailOutbox.user_id)
+        .having(db.func.min(EmailOutbox.created_at) <= now - delay)
+        .limit(limit)
+    )
+    return (
+        EmailOutbox.query
+        .filter_by(kind=NEW_MESSAGE, sent_at=None)
+        .filter(EmailOutbox.user_id.in_(due_users))
+        .filter(EmailOutbox.attempts < max_attempts)
+        .all()
+    )
+
+
+def send_pending(batch_size=50):
+    """Deliver one batch from the outbox; returns the number of emails sent."""
+    now = datetime.utcnow()
+    max_attempts = current_app.config["MAIL_MAX_ATTEMPTS"]
+    direct = (
+        EmailOutbox.query
+        .filter(EmailOutbox.kind != NEW_MESSAGE)
+        .filter_by(sent_at=None)
+        .filter(EmailOutbox.attempts < max_attempts)
+        .order_by(EmailOutbox.id)
+        .limit(batch_size)
+        .all()
+    )
+    jobs = [([row], _mail_message(row.recipient, row.subject, row.body)) for row in direct]
+    # Digest bodies link back to the site, so render them against SITE_URL
+    with current_app.test_request_context(base_url=current_app.config["SITE_URL"]):
+        jobs += _build_digests(_due_notifications(now, batch_size))
+    if not jobs:
+        return 0
+
+    sent = 0
+    try:
+        # One SMTP connection for the whole batch
+        with mail.connect() as conn:
+            for rows, msg in jobs:
+                try:
+                    if msg is not None:
+                        conn.send(msg)
+                        sent += 1
+                except Exception as exc:
+                    for row in rows:
+                        row.attempts += 1
+                        row.last_error = str(exc)[:200]
+                    continue
+                for row in rows:
+                    row.sent_at = now
+    except Exception as exc:
+        # Could not reach the SMTP server at all; retry the batch later
+        for rows, _ in jobs:
+            for row in rows:
+                if row.sent_at is None:
+                    row.attempts += 1
+                    row.last_error = str(exc)[:200]
+    db.session.commit()
+    return sent
+
+
+# =========================
+# CLI
+# =========================
+mail_cli = AppGroup("mail", help="Outgoing email.")
+
+
+@mail_cli.command("send")
+@click.option("--batch-size", type=int, default=50, show_default=True)
+@click.option("--loop", is_flag=True, help="Keep polling the outbox.")
+@click.option("--interval", type=float, default=5.0, show_default=True, help="Seconds between polls with --loop.")
+def send_command(batch_size, loop, interval):
+    """Send queued emails."""
+    while True:
+        sent = send_pending(batch_size=batch_size)
+        click.echo(f"Sent {sent} email(s).")
+        if not loop:
+            return
+        if not sent:
+            time.sleep(interval)
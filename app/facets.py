@@ -0,0 +1,338 @@
+"""Facet counts for storefronts from an in-memory columnar snapshot.
+
+A seller's products page shows how many products match each size, price
+step and category, given the other filters chosen. That would take
+several GROUP BY queries per page view. Instead each worker keeps the
+catalogue as NumPy arrays sorted by seller, then product id:
+
+* per product: id, seller id, category id (-1 for none), price and the
+  offset of its sizes, 20 bytes;
+* per size in stock: the size packed into a uint16 (see ``pack_size``),
+  2 bytes.
+
+A seller's products are one contiguous slice found by binary search, so a
+facet count is a few vectorised masks over that slice and takes
+microseconds whatever the size of the catalogue.
+
+The snapshot is loaded when the app starts (on first use if
+``PRELOAD_INDEXES`` is off). It is never modified in place; changes
+produce a new snapshot that replaces the old one, so readers in other
+threads always see a consistent one. Committing a transaction only notes
+the products it flushed; bulk statements report theirs with
+``touch_products``. A background thread (app/background.py) re-reads the
+noted products every ``FACETS_APPLY_SECONDS`` and patches them in: the
+sorted arrays are shared with the previous snapshot, replaced rows are
+masked out, and the new values are kept in a small per-seller delta, so a
+patch costs the products it touches rather than the catalogue. The same
+thread reloads everything every ``FACETS_REFRESH_SECONDS``, which clears
+the delta and picks up other workers' writes. Counts can lag the page by
+that long; the product list itself always comes from the database.
+"""
+import copy
+import threading
+import time
+
+import numpy as np
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.background import PeriodicTask, start_with_requests
+from app.models import Product, ProductVariant
+
+SIZE_SYSTEMS = ("EU", "UK", "US")
+PRODUCT_DTYPE = [("id", "i4"), ("seller", "i4"), ("category", "i4"), ("price", "f4")]
+SIZE_DTYPE = [("product", "i4"), ("size", "u2")]
+
+
+def pack_size(system, size):
+    """``(system, size)`` as one uint16: the system, then the size in half sizes."""
+    return SIZE_SYSTEMS.index(system) << 8 | int(round(size * 2))
+
+
+def unpack_size(code):
+    return SIZE_SYSTEMS[code >> 8], (code & 0xFF) / 2
+
+
+class CatalogSnapshot:
+    """Immutable columnar copy of products and their in-stock sizes.
+
+    Built from ``products`` (``PRODUCT_DTYPE``) and ``sizes``
+    (``SIZE_DTYPE``) record arrays in any order. The sizes of product row
+    ``i`` are ``size_codes[size_offsets[i]:size_offsets[i + 1]]``.
+
+    ``patched`` adds ``hidden``, a mask of rows that were replaced or
+    deleted, and ``delta``, ``{seller_id: {product_id: (category, price,
+    size codes)}}`` of their current values.
+    """
+
+    def __init__(self, products, sizes):
+        products = products[np.lexsort((products["id"], products["seller"]))]
+        self.ids = products["id"]
+        self.sellers = products["seller"]
+        self.categories = products["category"]
+        self.prices = products["price"]
+
+        # Row of each size's product; sizes of deleted products are dropped
+        by_id = self._by_id = np.argsort(self.ids).astype("i4")
+        found = np.searchsorted(self.ids, sizes["product"], sorter=by_id)
+        found = np.minimum(found, max(len(by_id) - 1, 0))
+        known = (self.ids[by_id[found]] == sizes["product"]) if len(by_id) else np.zeros(len(sizes), bool)
+        rows = by_id[found[known]]
+        order = np.argsort(rows, kind="stable")
+        self.size_codes = sizes["size"][known][order]
+        self.size_offsets = np.zeros(len(self.ids) + 1, dtype="i4")
+        np.cumsum(np.bincount(rows, minlength=len(self.ids)), out=self.size_offsets[1:])
+
+        self.hidden = None
+        self.delta = {}
+        self._delta_seller = {}  # product_id -> its seller in delta
+
+    def __len__(self):
+        hidden = int(self.hidden.sum()) if self.hidden is not None else 0
+        return len(self.ids) - hidden + len(self._delta_seller)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (
+            self.ids, self.sellers, self.categories, self.prices, self.size_offsets, self.size_codes, self._by_id,
+        ))
+
+    def _rows_of(self, product_ids):
+        """Rows of the sorted arrays holding ``product_ids``, for those present."""
+        if not len(self.ids):
+            return np.zeros(0, dtype="i4")
+        found = np.minimum(np.searchsorted(self.ids, product_ids, sorter=self._by_id), len(self.ids) - 1)
+        rows = self._by_id[found]
+        return rows[self.ids[rows] == product_ids]
+
+    def patched(self, product_ids, products, sizes):
+        """A new snapshot with ``product_ids`` replaced by the given records.
+
+        Ids without a record in ``products`` were deleted. The arrays are
+        shared with this snapshot; only the mask and the delta of the
+        sellers involved are copied.
+        """
+        touched = np.unique(np.fromiter(product_ids, dtype="i4"))
+        snapshot = copy.copy(self)
+        snapshot.hidden = np.zeros(len(self.ids), bool) if self.hidden is None else self.hidden.copy()
+        snapshot.hidden[self._rows_of(touched)] = True
+
+        codes = {}
+        for product_id, code in zip(sizes["product"].tolist(), sizes["size"].tolist()):
+            codes.setdefault(product_id, []).append(code)
+        rows = products.tolist()
+        delta_seller = snapshot._delta_seller = dict(self._delta_seller)
+        old = {delta_seller.pop(product_id) for product_id in touched.tolist() if product_id in delta_seller}
+        delta = snapshot.delta = dict(self.delta)
+        for seller in old | {seller for _, seller, _, _ in rows}:
+            delta[seller] = {
+                product_id: row for product_id, row in delta.get(seller, {}).items()
+                if product_id in delta_seller
+            }
+        for product_id, seller, category, price in rows:
+            delta[seller][product_id] = (category, price, np.array(codes.get(product_id, ()), dtype="u2"))
+            delta_seller[product_id] = seller
+        for seller in old:
+            if not delta[seller]:
+                del delta[seller]
+        return snapshot
+
+    def _seller_rows(self, seller_id):
+        """``(prices, categories, size codes, owner)`` for one seller.
+
+        ``owner`` gives the position in ``prices`` of each size code's product.
+        """
+        low, high = np.searchsorted(self.sellers, [seller_id, seller_id + 1])
+        prices, categories = self.prices[low:high], self.categories[low:high]
+        offsets = self.size_offsets[low:high + 1]
+        codes = self.size_codes[offsets[0]:offsets[-1]]
+        owner = np.repeat(np.arange(high - low), np.diff(offsets))
+
+        if self.hidden is not None and self.hidden[low:high].any():
+            keep = ~self.hidden[low:high]
+            position = np.cumsum(keep) - 1
+            code_keep = keep[owner]
+            prices, categories = prices[keep], categories[keep]
+            codes, owner = codes[code_keep], position[owner[code_keep]]
+
+        extra = self.delta.get(seller_id)
+        if extra:
+            rows = list(extra.values())
+            start = len(prices)
+            prices = np.concatenate((prices, np.array([price for _, price, _ in rows], dtype="f4")))
+            categories = np.concatenate((categories, np.array([category for category, _, _ in rows], dtype="i4")))
+            codes = np.concatenate((codes, *(row_codes for _, _, row_codes in rows)))
+            owner = np.concatenate((
+                owner, np.repeat(np.arange(start, len(prices)), [len(row_codes) for _, _, row_codes in rows]),
+            ))
+        return prices, categories, codes, owner
+
+    def facets(self, seller_id, size=None, max_price=None, category_id=None, price_steps=()):
+        """Counts for one seller's products page.
+
+        Each facet is counted with every filter applied except its own,
+        so it says how many products picking that value would show:
+
+        * ``sizes``: ``[((system, size), count)]`` of sizes in stock;
+        * ``prices``: ``[(step, count)]`` of products priced at most ``step``;
+        * ``categories``: ``{category_id: count}``, ``None`` for uncategorised.
+        """
+        prices, categories, codes, owner = self._seller_rows(seller_id)
+        count = len(prices)
+        price_ok = prices <= np.float32(max_price) if max_price is not None else np.ones(count, bool)
+        category_ok = categories == category_id if category_id is not None else np.ones(count, bool)
+        size_ok = np.ones(count, bool)
+        if size is not None:
+            size_ok[:] = False
+            size_ok[owner[codes == pack_size(*size)]] = True
+
+        size_codes, size_counts = np.unique(codes[(price_ok & category_ok)[owner]], return_counts=True)
+        in_prices = np.sort(prices[size_ok & category_ok])
+        price_counts = np.searchsorted(in_prices, np.asarray(price_steps, dtype="f4"), side="right")
+        found, category_counts = np.unique(categories[size_ok & price_ok], return_counts=True)
+        return {
+            "sizes": [(unpack_size(int(code)), int(n)) for code, n in zip(size_codes, size_counts)],
+            "prices": [(step, int(n)) for step, n in zip(price_steps, price_counts)],
+            "categories": {
+                (None if category < 0 else int(category)): int(n)
+                for category, n in zip(found, category_counts)
+            },
+            "total": int((size_ok & price_ok & category_ok).sum()),
+        }
+
+
+# =========================
+# LOADING
+# =========================
+def _records(execute, product_ids=None):
+    """``(products, sizes)`` record arrays, packed by the database."""
+    products = db.select(
+        Product.id, db.func.coalesce(Product.seller_id, 0),
+        db.func.coalesce(Product.category_id, -1), db.func.coalesce(Product.price, 0.0),
+    )
+    packed = db.case(
+        {system: n << 8 for n, system in enumerate(SIZE_SYSTEMS)}, value=ProductVariant.size_system
+    ) + db.cast(ProductVariant.size * 2, db.Integer)
+    sizes = db.select(ProductVariant.product_id, packed).where(
+        ProductVariant.stock > 0, ProductVariant.size_system.in_(SIZE_SYSTEMS)
+    )
+    if product_ids is not None:
+        products = products.where(Product.id.in_(product_ids))
+        sizes = sizes.where(ProductVariant.product_id.in_(product_ids))
+    return (
+        np.array([tuple(row) for row in execute(products)], dtype=PRODUCT_DTYPE),
+        np.array([tuple(row) for row in execute(sizes)], dtype=SIZE_DTYPE),
+    )
+
+
+def load_snapshot():
+    return CatalogSnapshot(*_records(db.session.execute))
+
+
+def get_snapshot():
+    """This worker's snapshot, loaded on first use if it was not preloaded."""
+    state = current_app.extensions["facets"]
+    if state["snapshot"] is None:
+        with state["lock"]:
+            if state["snapshot"] is None:
+                state["snapshot"] = load_snapshot()
+                state["loaded_at"] = time.monotonic()
+    return state["snapshot"]
+
+
+def preload(app):
+    """Load the snapshot while the app starts."""
+    with app.app_context():
+        try:
+            get_snapshot()
+        except SQLAlchemyError:
+            # e.g. before `flask db upgrade` has run; load on first use instead
+            app.logger.warning("Facet snapshot not preloaded", exc_info=True)
+
+
+def seller_facets(seller_id, size=None, max_price=None, category_id=None):
+    return get_snapshot().facets(
+        seller_id, size=size, max_price=max_price, category_id=category_id,
+        price_steps=current_app.config["FACET_PRICE_STEPS"],
+    )
+
+
+# =========================
+# INCREMENTAL UPDATES
+# =========================
+def _collect_changes(session, flush_context):
+    touched = session.info.setdefault("facet_changes", set())
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Product):
+            touched.add(obj.id)
+        elif isinstance(obj, ProductVariant):
+            touched.add(obj.product_id)
+
+
+def touch_products(session, product_ids):
+    """Re-read ``product_ids`` into the snapshot once ``session`` commits.
+
+    Bulk statements bypass the flush events above, so callers report the
+    ids themselves.
+    """
+    session.info.setdefault("facet_changes", set()).update(product_ids)
+
+
+def _apply_changes(session):
+    # Only note the ids; reading and patching is the background thread's job
+    touched = session.info.pop("facet_changes", None)
+    if not touched or not has_app_context():
+        return
+    state = current_app.extensions.get("facets")
+    if state is None:
+        return
+    touched.discard(None)
+    with state["lock"]:
+        state["pending"].update(touched)
+
+
+def _discard_changes(session):
+    session.info.pop("facet_changes", None)
+
+
+def _take_pending(state):
+    with state["lock"]:
+        pending, state["pending"] = state["pending"], set()
+    return pending
+
+
+def sync_snapshot():
+    """Patch in products noted since the last call, or reload when due.
+
+    Run by the background thread, the only writer once the snapshot is
+    loaded, so replacing ``state["snapshot"]`` needs no further locking.
+    """
+    state = current_app.extensions["facets"]
+    snapshot = state["snapshot"]
+    if snapshot is None:
+        _take_pending(state)  # not loaded yet; the first load will read these rows
+        return
+    if time.monotonic() - state["loaded_at"] >= current_app.config["FACETS_REFRESH_SECONDS"]:
+        # Ids noted from here on are re-read on the next call, after this load
+        _take_pending(state)
+        state["snapshot"], state["loaded_at"] = load_snapshot(), time.monotonic()
+        return
+    touched = _take_pending(state)
+    if touched:
+        products, sizes = _records(db.session.execute, touched)
+        state["snapshot"] = snapshot.patched(touched, products, sizes)
+
+
+def init_app(app, db):
+    app.extensions["facets"] = {
+        "snapshot": None, "loaded_at": 0.0, "pending": set(), "lock": threading.Lock(),
+    }
+
+    session_class = db.session.session_factory.class_
+    event.listen(session_class, "after_flush", _collect_changes)
+    event.listen(session_class, "after_commit", _apply_changes)
+    event.listen(session_class, "after_rollback", _discard_changes)
+
+    start_with_requests(app, PeriodicTask("facets-sync", app.config["FACETS_APPLY_SECONDS"], sync_snapshot))
@@ -1,7 +1,8 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, BooleanField, SubmitField,SelectField, RadioField, TextAreaField, FloatField, IntegerField
+from wtforms import StringField, PasswordField, BooleanField, SubmitField,SelectField, RadioField, TextAreaField, FloatField, IntegerField, SelectMultipleField
 from wtforms.validators import DataRequired, Email, ValidationError, Optional,EqualTo, Length, NumberRange, Regexp
 from app.models import User
+from app.variants import parse_variant_lines
 from flask_wtf.file import FileField, FileAllowed, MultipleFileField
 
 
@@ -90,6 +91,11 @@ class ProductForm(FlaskForm):
     category_id = SelectField('Category', coerce=int, validators=[DataRequired()])
     size_unit = StringField('Size/Unit', validators=[Length(max=20)])
     stock_quantity = IntegerField('Stock Quantity', validators=[DataRequired(), NumberRange(min=0)])
+    variants = TextAreaField(
+        'Sizes and stock',
+        validators=[Optional(), Length(max=2000)],
+        description='One size per line, e.g. "EU 42: 3". Overrides Size/Unit and Stock Quantity.'
+    )
 
     # Gallery images (just like seller)
     product_image1 = FileField('Product Image 1', validators=[FileAllowed(['jpg','png','jpeg'],'Images only!')])
@@ -99,6 +105,25 @@ class ProductForm(FlaskForm):
 
     submit = SubmitField('Save Product')
 
+    parsed_variants = ()  # set by validate_variants when sizes were entered
+
+    def validate_variants(self, field):
+        try:
+            self.parsed_variants = parse_variant_lines(field.data)
+        except ValueError as exc:
+            raise ValidationError(str(exc))
+
+
+class BulkProductForm(FlaskForm):
+    # product_ids come from the dashboard's checkboxes; ownership is checked in the UPDATE/DELETE itself
+    product_ids = SelectMultipleField('Products', coerce=int, validate_choice=False)
+    action = SelectField('Action', choices=[('update', 'Update selected'), ('delete', 'Delete selected')])
+    price = FloatField('Set price', validators=[Optional(), NumberRange(min=0)])
+    price_percent = FloatField('Change price by %', validators=[Optional(), NumberRange(min=-90, max=1000)])
+    stock_quantity = IntegerField('Set stock', validators=[Optional(), NumberRange(min=0)])
+    category_id = SelectField('Move to category', coerce=int, choices=[])  # Populate dynamically in route
+    submit = SubmitField('Apply')
+
 
 class DeleteForm(FlaskForm):
     submit = SubmitField('Delete')
@@ -0,0 +1,286 @@
+"""Seller coordinates and "sellers near me".
+
+``SellerProfile.location`` is free text. It is resolved to coordinates with
+an offline gazetteer (``GAZETTEER_PATH``), either a GeoNames dump such as
+``cities15000.txt`` (https://download.geonames.org/export/dump/) or a
+hand-kept TSV of ``name<TAB>lat<TAB>lon[<TAB>country[<TAB>population]]``.
+Nothing is looked up over the network.
+
+Each located profile also stores a geohash. A radius search turns the
+circle's bounding box into a handful of geohash cells and reads each one
+as a range scan on an index of ``(geohash, latitude, longitude, user_id)``. Exact distances are
+then computed for those candidates only, which keeps the query in the
+milliseconds with 100k sellers.
+"""
+import math
+import os
+import unicodedata
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+
+from app import db
+from app.models import Product, SellerProfile, User
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 9  # ~5m cells, far finer than any gazetteer entry
+EARTH_RADIUS_KM = 6371.0088
+MAX_CELLS = 16
+
+
+# =========================
+# GEOHASH
+# =========================
+def encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            value = value * 2 + (lon >= mid)
+            lon_lo, lon_hi = (mid, lon_hi) if lon >= mid else (lon_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            value = value * 2 + (lat >= mid)
+            lat_lo, lat_hi = (mid, lat_hi) if lat >= mid else (lat_lo, mid)
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return "".join(chars)
+
+
+def _cell_size(precision):
+    """(lat, lon) size in degrees of a geohash cell."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def bounding_box(lat, lon, radius_km):
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 1e-6 else min(180.0, dlat / cos_lat)
+    return max(lat - dlat, -90.0), min(lat + dlat, 90.0), lon - dlon, lon + dlon
+
+
+def covering_cells(lat, lon, radius_km, max_cells=MAX_CELLS):
+    """Geohash prefixes that together cover the circle's bounding box.
+
+    Uses the finest precision that needs at most ``max_cells`` cells, so a
+    small radius scans a few small cells and a large one a few big ones.
+    """
+    south, north, west, east = bounding_box(lat, lon, radius_km)
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat, cell_lon = _cell_size(precision)
+        first_row, first_col = math.floor(south / cell_lat), math.floor(west / cell_lon)
+        rows = math.floor(north / cell_lat) - first_row + 1
+        cols = math.floor(east / cell_lon) - first_col + 1
+        if rows * cols <= max_cells:
+            break
+    else:
+        return [""]
+
+    cells = set()
+    for row in range(first_row, first_row + rows):
+        cell_lat_mid = min((row + 0.5) * cell_lat, 90.0 - cell_lat / 2)
+        for col in range(first_col, first_col + cols):
+            cell_lon_mid = ((col + 0.5) * cell_lon + 180.0) % 360.0 - 180.0
+            cells.add(encode(cell_lat_mid, cell_lon_mid, precision))
+    return sorted(cells)
+
+
+def _prefix_end(prefix):
+    """Smallest geohash greater than every hash starting with ``prefix``."""
+    while prefix:
+        last = BASE32.index(prefix[-1])
+        if last + 1 < len(BASE32):
+            return prefix[:-1] + BASE32[last + 1]
+        prefix = prefix[:-1]
+    return None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+# =========================
+# GAZETTEER
+# =========================
+def normalise_place(text):
+    text = unicodedata.normalize("NFKD", text or "")
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().replace(".", " ").replace("-", " ").split())
+
+
+class Gazetteer:
+    """Place name -> (lat, lon), preferring the most populous match."""
+
+    def __init__(self):
+        self._places = {}  # name -> (population, lat, lon)
+
+    def add(self, name, lat, lon, population=0):
+        key = normalise_place(name)
+        if key and population >= self._places.get(key, (-1,))[0]:
+            self._places[key] = (population, lat, lon)
+
+    @classmethod
+    def load(cls, path):
+        gazetteer = cls()
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) >= 15:
+                    # GeoNames: name, asciiname, alternatenames, lat, lon, ..., population
+                    lat, lon = float(cols[4]), float(cols[5])
+                    population = int(cols[14] or 0)
+                    for name in [cols[1], cols[2], *cols[3].split(",")]:
+                        gazetteer.add(name, lat, lon, population)
+                else:
+                    population = int(cols[4]) if len(cols) > 4 and cols[4] else 0
+                    gazetteer.add(cols[0], float(cols[1]), float(cols[2]), population)
+        return gazetteer
+
+    def __len__(self):
+        return len(self._places)
+
+    def lookup(self, text):
+        """Coordinates for free text like "Westlands, Nairobi", or None.
+
+        Tries the whole string, then each comma-separated part in order.
+        """
+        text = normalise_place(text)
+        candidates = [text] + [normalise_place(part) for part in text.split(",")]
+        for candidate in candidates:
+            place = self._places.get(candidate)
+            if place:
+                return place[1], place[2]
+        return None
+
+
+def get_gazetteer():
+    """The gazetteer, loaded once per worker on first use."""
+    gazetteer = current_app.extensions.get("gazetteer")
+    if gazetteer is None:
+        path = current_app.config["GAZETTEER_PATH"]
+        if not os.path.exists(path):
+            current_app.logger.warning("Gazetteer %s not found; seller locations stay unresolved", path)
+            gazetteer = Gazetteer()
+        else:
+            gazetteer = Gazetteer.load(path)
+        current_app.extensions["gazetteer"] = gazetteer
+    return gazetteer
+
+
+def locate_profile(profile):
+    """Set coordinates and geohash from ``profile.location``."""
+    coords = get_gazetteer().lookup(profile.location) if profile.location else None
+    if coords is None:
+        profile.latitude = profile.longitude = profile.geohash = None
+        return False
+    profile.latitude, profile.longitude = coords
+    profile.geohash = encode(*coords)
+    return True
+
+
+# =========================
+# QUERIES
+# =========================
+def nearby_sellers(lat, lon, radius_km, page=1, per_page=20):
+    """Sellers with stock within ``radius_km``, nearest first.
+
+    Returns ``(rows, total)`` where rows are ``(User, SellerProfile,
+    distance_km)`` for the requested page.
+
+    Filtering and ranking use the equirectangular approximation, which is
+    plain arithmetic and so runs inside the database on SQLite as well as
+    Postgres; it is well within a metre per km at these radii. Distances in
+    the result are exact.
+    """
+    ranges = []
+    for cell in covering_cells(lat, lon, radius_km):
+        clause = SellerProfile.geohash >= cell
+        end = _prefix_end(cell)
+        if end is not None:
+            clause = clause & (SellerProfile.geohash < end)
+        ranges.append(clause)
+
+    south, north, _, _ = bounding_box(lat, lon, radius_km)
+    lon_scale = math.cos(math.radians(lat))
+    dlat = SellerProfile.latitude - lat
+    dlon = (SellerProfile.longitude - lon) * lon_scale
+    distance_sq = dlat * dlat + dlon * dlon  # squared degrees of latitude
+    radius_deg = math.degrees(radius_km / EARTH_RADIUS_KM)
+
+    in_stock = (
+        db.session.query(Product.id)
+        .filter(Product.seller_id == SellerProfile.user_id, Product.stock_quantity > 0)
+        .exists()
+    )
+    conditions = (
+        db.or_(*ranges),
+        SellerProfile.latitude.between(south, north),
+        distance_sq <= radius_deg * radius_deg,
+        in_stock,
+    )
+    # Answered from ix_seller_profile_geohash_point plus the product index
+    total = db.session.query(db.func.count(SellerProfile.user_id)).filter(*conditions).scalar()
+    if total <= (page - 1) * per_page:
+        return [], total
+
+    page_rows = (
+        db.session.query(User, SellerProfile)
+        .join(SellerProfile, SellerProfile.user_id == User.id)
+        .filter(*conditions)
+        .order_by(distance_sq, User.id)
+        .limit(per_page)
+        .offset((page - 1) * per_page)
+        .all()
+    )
+    rows = [
+        (user, profile, haversine_km(lat, lon, profile.latitude, profile.longitude))
+        for user, profile in page_rows
+    ]
+    return rows, total
+
+
+# =========================
+# CLI
+# =========================
+geo_cli = AppGroup("geo", help="Seller locations.")
+
+
+@geo_cli.command("backfill")
+@click.option("--all", "redo", is_flag=True, help="Re-resolve profiles that already have coordinates.")
+@click.option("--batch-size", type=int, default=1000, show_default=True)
+def backfill_command(redo, batch_size):
+    """Resolve seller locations to coordinates with the gazetteer."""
+    gazetteer = get_gazetteer()
+    if not len(gazetteer):
+        raise click.ClickException(f"No gazetteer at {current_app.config['GAZETTEER_PATH']}.")
+
+    located = missed = 0
+    last_id = 0
+    while True:
+        query = SellerProfile.query.filter(SellerProfile.id > last_id)
+        if not redo:
+            query = query.filter(SellerProfile.geohash.is_(None))
+        batch = query.order_by(SellerProfile.id).limit(batch_size).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for profile in batch:
+            if locate_profile(profile):
+                located += 1
+            else:
+                missed += 1
+        db.session.commit()
+    click.echo(f"Located {located} seller(s); {missed} location(s) not found in the gazetteer.")
@@ -0,0 +1,533 @@
+"""Cloudinary access, deferred deletion and asset reconciliation.
+
+Routes never delete assets inline. They record the ``public_id`` in the
+``cloudinary_deletion`` outbox in the same transaction as the row change, and
+``flask media drain-deletions`` removes them in bulk (up to 100 ids per
+Admin API call). ``flask media reconcile`` walks the asset listing against
+our own ``public_id`` columns to find assets nothing points at.
+
+Uploads are deduplicated by content. ``media_asset`` maps the SHA-256 of
+each stored file to its ``public_id`` with a reference count; uploading
+bytes that are already stored reuses that asset and adds a reference, and
+``schedule_cloudinary_delete`` only queues an asset once its last
+reference is dropped. Assets uploaded before the index existed have no
+``media_asset`` row and are queued as before.
+
+Every call goes through a circuit breaker (see app/breaker.py) with
+``CLOUDINARY_TIMEOUT``. A call that fails, times out or takes longer than
+``CLOUDINARY_SLOW_SECONDS`` counts as a failure, and after
+``CLOUDINARY_BREAKER_FAILURES`` in a row uploads are refused at once with
+``MediaUnavailable`` for ``CLOUDINARY_BREAKER_RESET_SECONDS``. Routes save
+the text of a form anyway and tell the user to add images later; deletions
+stay in the outbox until Cloudinary answers again.
+
+Set ``CLOUDINARY_BACKEND = "fake"`` to run everything against the in-memory
+``FakeCloudinary`` instead of the real service. Its ``latency`` and
+``error_rate`` (``CLOUDINARY_FAKE_LATENCY``, ``CLOUDINARY_FAKE_ERROR_RATE``)
+simulate a slow or failing Cloudinary.
+"""
+import hashlib
+import itertools
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import click
+import cloudinary.api
+import cloudinary.uploader
+from cloudinary.exceptions import AlreadyExists, BadRequest, NotFound
+from cloudinary.exceptions import Error as CloudinaryError
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.breaker import CircuitBreaker
+from app.metrics import (
+    CLOUDINARY_CIRCUIT, CLOUDINARY_DEDUPED, CLOUDINARY_REJECTED, track_cloudinary
+)
+from app.models import (
+    BuyerProfile, CloudinaryDeletion, MediaAsset, ProductImage, SellerImage,
+    SellerProfile
+)
+
+BULK_DELETE_LIMIT = 100  # Admin API maximum per delete_resources call
+HASH_CHUNK_SIZE = 64 * 1024
+# Answers about the request itself, not signs that Cloudinary is unwell
+CLIENT_ERRORS = (AlreadyExists, BadRequest, NotFound)
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class MediaUnavailable(Exception):
+    """Cloudinary is failing or the circuit is open; the call was not completed."""
+
+
+class CircuitOpen(MediaUnavailable):
+    """Refused by the circuit breaker without calling Cloudinary."""
+
+
+# =========================
+# BACKENDS
+# =========================
+class CloudinaryBackend:
+    """The handful of Cloudinary SDK calls the app uses."""
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout  # seconds per HTTP request; the SDK default is 60
+
+    def upload(self, file, **options):
+        return cloudinary.uploader.upload(file, timeout=self.timeout, **options)
+
+    def destroy(self, public_id):
+        return cloudinary.uploader.destroy(public_id, timeout=self.timeout)
+
+    def delete_resources(self, public_ids):
+        return cloudinary.api.delete_resources(list(public_ids), timeout=self.timeout)
+
+    def resources(self, prefix=None, next_cursor=None, max_results=500):
+        options = {"type": "upload", "max_results": max_results, "timeout": self.timeout}
+        if prefix:
+            options["prefix"] = prefix
+        if next_cursor:
+            options["next_cursor"] = next_cursor
+        return cloudinary.api.resources(**options)
+
+
+class FakeCloudinary:
+    """In-memory stand-in for Cloudinary, for local runs and tests.
+
+    Every call first waits ``latency`` seconds and then fails with
+    probability ``error_rate``. If ``latency`` reaches ``timeout``, the call
+    waits ``timeout`` and fails the way the SDK does when a request times out.
+    """
+
+    def __init__(self, latency=0.0, error_rate=0.0, timeout=None, seed=None):
+        self.assets = {}
+        self.calls = []
+        self.latency = latency
+        self.error_rate = error_rate
+        self.timeout = timeout
+        self._random = random.Random(seed)
+
+    def _network(self, operation):
+        if self.timeout is not None and self.latency >= self.timeout:
+            time.sleep(self.timeout)
+            raise CloudinaryError(f"Socket error: {operation} timed out after {self.timeout}s")
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise CloudinaryError(f"Unexpected error - injected {operation} failure")
+
+    def upload(self, file, folder=None, public_id=None, **options):
+        self.calls.append(("upload", public_id))
+        self._network("upload")
+        public_id = f"{folder}/{public_id}" if folder else public_id
+        data = file.read() if hasattr(file, "read") else bytes(file)
+        self.assets[public_id] = {
+            "bytes": len(data),
+            "created_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        return {
+            "public_id": public_id,
+            "secure_url": f"https://res.cloudinary.local/image/upload/{public_id}",
+        }
+
+    def destroy(self, public_id):
+        self.calls.append(("destroy", public_id))
+        self._network("destroy")
+        if self.assets.pop(public_id, None) is None:
+            return {"result": "not found"}
+        return {"result": "ok"}
+
+    def delete_resources(self, public_ids):
+        public_ids = list(public_ids)
+        if len(public_ids) > BULK_DELETE_LIMIT:
+            raise ValueError(f"delete_resources accepts at most {BULK_DELETE_LIMIT} ids")
+        self.calls.append(("delete_resources", tuple(public_ids)))
+        self._network("delete_resources")
+        return {"deleted": {
+            pid: "deleted" if self.assets.pop(pid, None) is not None else "not_found"
+            for pid in public_ids
+        }}
+
+    def resources(self, prefix=None, next_cursor=None, max_results=500):
+        self.calls.append(("resources", prefix, next_cursor))
+        self._network("resources")
+        ids = sorted(pid for pid in self.assets if not prefix or pid.startswith(prefix))
+        start = int(next_cursor or 0)
+        page = ids[start:start + max_results]
+        result = {"resources": [
+            {"public_id": pid, "created_at": self.assets[pid]["created_at"]} for pid in page
+        ]}
+        if start + max_results < len(ids):
+            result["next_cursor"] = str(start + max_results)
+        return result
+
+
+def _circuit_changed(breaker, state):
+    CLOUDINARY_CIRCUIT.set(CIRCUIT_STATES[state])
+    if state == "open":
+        current_app.logger.warning(
+            "Cloudinary circuit open after %d failures; refusing calls for %ss",
+            breaker.failure_threshold, breaker.reset_seconds
+        )
+    else:
+        current_app.logger.warning("Cloudinary circuit %s", state.replace("_", "-"))
+
+
+def init_app(app):
+    backend = app.config.get("CLOUDINARY_BACKEND", "cloudinary")
+    timeout = app.config["CLOUDINARY_TIMEOUT"]
+    app.extensions["cloudinary_backend"] = (
+        FakeCloudinary(
+            latency=app.config["CLOUDINARY_FAKE_LATENCY"],
+            error_rate=app.config["CLOUDINARY_FAKE_ERROR_RATE"],
+            timeout=timeout,
+        )
+        if backend == "fake" else CloudinaryBackend(timeout=timeout)
+    )
+    app.extensions["cloudinary_breaker"] = CircuitBreaker(
+        "cloudinary",
+        failure_threshold=app.config["CLOUDINARY_BREAKER_FAILURES"],
+        reset_seconds=app.config["CLOUDINARY_BREAKER_RESET_SECONDS"],
+        on_change=_circuit_changed,
+    )
+    CLOUDINARY_CIRCUIT.set(0)
+    app.cli.add_command(media_cli)
+
+
+def get_backend():
+    return current_app.extensions["cloudinary_backend"]
+
+
+def get_breaker():
+    return current_app.extensions["cloudinary_breaker"]
+
+
+def call_cloudinary(operation, *args, **kwargs):
+    """Call backend method ``operation`` through the circuit breaker.
+
+    Raises ``CircuitOpen`` without calling while the circuit is open, and
+    ``MediaUnavailable`` when the call itself fails. Client errors such as
+    ``NotFound`` are passed through and do not count against Cloudinary.
+    """
+    breaker = get_breaker()
+    if not breaker.allow():
+        CLOUDINARY_REJECTED.labels(operation).inc()
+        raise CircuitOpen(f"Cloudinary is unavailable; {operation} refused")
+
+    started = time.perf_counter()
+    try:
+        with track_cloudinary(operation):
+            result = getattr(get_backend(), operation)(*args, **kwargs)
+    except CLIENT_ERRORS:
+        breaker.record_success()
+        raise
+    except Exception as exc:
+        breaker.record_failure()
+        raise MediaUnavailable(f"Cloudinary {operation} failed: {exc}") from exc
+
+    # A call that only just made it still says the service is struggling
+    if time.perf_counter() - started > current_app.config["CLOUDINARY_SLOW_SECONDS"]:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return result
+
+
+# =========================
+# CLOUDINARY HELPERS
+# =========================
+def content_hash(file, chunk_size=HASH_CHUNK_SIZE):
+    """``(sha256 hex, size)`` of a file object, read in chunks and rewound."""
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    while chunk := file.read(chunk_size):
+        digest.update(chunk)
+        size += len(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+def _reuse_asset(sha256):
+    """Add a reference to the stored asset with this hash; None if there is none."""
+    row = db.session.execute(
+        db.select(MediaAsset.id, MediaAsset.public_id, MediaAsset.url).where(MediaAsset.sha256 == sha256)
+    ).first()
+    if row is None:
+        return None
+    # Conditional on the row still existing: the drain removes it before deleting the asset
+    bumped = db.session.execute(
+        db.update(MediaAsset)
+        .where(MediaAsset.id == row.id)
+        .values(ref_count=MediaAsset.ref_count + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    return (row.public_id, row.url) if bumped else None
+
+
+def upload_to_cloudinary(file, folder, public_id):
+    """Upload ``file`` unless identical bytes are already stored.
+
+    Returns ``(public_id, secure_url)``, either of the new asset or of the
+    existing one. The content hash is appended to ``public_id``, so
+    ``overwrite=True`` can only ever replace an asset with the same bytes.
+    """
+    if isinstance(file, str):
+        raise ValueError("Cannot upload a URL string. Must be a file object.")
+    sha256, size = content_hash(file)
+    existing = _reuse_asset(sha256)
+    if existing is not None:
+        CLOUDINARY_DEDUPED.inc()
+        return existing
+
+    result = call_cloudinary(
+        "upload",
+        file,
+        folder=folder,
+        public_id=f"{public_id}_{sha256[:16]}",
+        overwrite=True
+    )
+    try:
+        with db.session.begin_nested():
+            db.session.add(MediaAsset(
+                sha256=sha256, public_id=result['public_id'], url=result['secure_url'], bytes=size
+            ))
+    except IntegrityError:
+        # A concurrent request stored the same bytes first: use theirs, drop ours
+        existing = _reuse_asset(sha256)
+        if existing is None:
+            raise
+        if existing[0] != result['public_id']:
+            _queue_deletions([result['public_id']])
+        CLOUDINARY_DEDUPED.inc()
+        return existing
+    return result['public_id'], result['secure_url']
+
+
+# DELETE IMAGE FROM CLOUDINARY
+def delete_from_cloudinary(public_id):
+    if not public_id:
+        return
+    try:
+        call_cloudinary("destroy", public_id)
+    except NotFound:
+        pass
+
+
+def _queue_deletions(public_ids):
+    if public_ids:
+        db.session.execute(db.insert(CloudinaryDeletion), [{"public_id": pid} for pid in public_ids])
+
+
+def schedule_cloudinary_delete(*public_ids):
+    """Drop one reference to each asset and queue the ones nothing uses now.
+
+    Committed together with the caller's changes. Repeated ids drop one
+    reference each. Ids without a ``media_asset`` row are queued directly.
+    """
+    counts = Counter(pid for pid in public_ids if pid)
+    if not counts:
+        return
+    by_drop = defaultdict(list)
+    for public_id, drop in counts.items():
+        by_drop[drop].append(public_id)
+
+    indexed, released = set(), []
+    for drop, ids in by_drop.items():
+        rows = db.session.execute(
+            db.update(MediaAsset)
+            .where(MediaAsset.public_id.in_(ids))
+            .values(ref_count=MediaAsset.ref_count - drop)
+            .returning(MediaAsset.public_id, MediaAsset.ref_count)
+            .execution_options(synchronize_session=False)
+        )
+        for public_id, remaining in rows:
+            indexed.add(public_id)
+            if remaining <= 0:
+                released.append(public_id)
+    _queue_deletions(released + [pid for pid in counts if pid not in indexed])
+
+
+# =========================
+# OUTBOX DRAIN
+# =========================
+def _public_id_columns():
+    return (
+        ProductImage.public_id,
+        SellerImage.public_id,
+        SellerProfile.shop_logo_public_id,
+        BuyerProfile.profile_image_public_id,
+    )
+
+
+def referenced_public_ids(public_ids):
+    """Subset of ``public_ids`` that some row still points at."""
+    public_ids = list(public_ids)
+    found = set()
+    for column in _public_id_columns():
+        found.update(
+            pid for (pid,) in db.session.query(column).filter(column.in_(public_ids))
+        )
+    return found
+
+
+def drain_deletions(batch_size=BULK_DELETE_LIMIT, max_attempts=5):
+    """Delete queued assets in bulk; returns ``(deleted, failed)`` counts.
+
+    Stops early, leaving the rest queued without using up their attempts,
+    once the circuit breaker refuses calls.
+    """
+    batch_size = min(batch_size, BULK_DELETE_LIMIT)
+    deleted = failed = 0
+    last_id = 0
+
+    while True:
+        pending = (
+            CloudinaryDeletion.query
+            .filter(CloudinaryDeletion.id > last_id)
+            .filter(CloudinaryDeletion.attempts < max_attempts)
+            .order_by(CloudinaryDeletion.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not pending:
+            return deleted, failed
+        last_id = pending[-1].id
+        pending_ids = [row.id for row in pending]
+
+        # An id may have been reused after it was queued; never delete those
+        still_used = referenced_public_ids(row.public_id for row in pending)
+        to_delete = sorted({row.public_id for row in pending} - still_used)
+
+        if to_delete:
+            # Remove index rows before the remote delete, so an identical upload
+            # from here on stores a fresh copy. Rows that gained a reference
+            # since being queued survive, and their assets are kept.
+            db.session.execute(
+                db.delete(MediaAsset)
+                .where(MediaAsset.public_id.in_(to_delete), MediaAsset.ref_count <= 0)
+                .execution_options(synchronize_session=False)
+            )
+            still_used.update(
+                pid for (pid,) in db.session.query(MediaAsset.public_id)
+                .filter(MediaAsset.public_id.in_(to_delete))
+            )
+            to_delete = [pid for pid in to_delete if pid not in still_used]
+            db.session.commit()
+            pending = CloudinaryDeletion.query.filter(CloudinaryDeletion.id.in_(pending_ids)).all()
+
+        try:
+            if to_delete:
+                result = call_cloudinary("delete_resources", to_delete)
+            else:
+                result = {"deleted": {}}
+        except CircuitOpen:
+            return deleted, failed
+        except Exception as exc:
+            for row in pending:
+                row.attempts = (row.attempts or 0) + 1
+                row.last_error = str(exc)[:200]
+            db.session.commit()
+            failed += len(pending)
+            continue
+
+        statuses = result.get("deleted", {})
+        done = []
+        for row in pending:
+            if row.public_id in still_used:
+                done.append(row.id)
+            elif statuses.get(row.public_id) in ("deleted", "not_found"):
+                done.append(row.id)
+                deleted += 1
+            else:
+                row.attempts = (row.attempts or 0) + 1
+                row.last_error = str(statuses.get(row.public_id, "missing from response"))[:200]
+                failed += 1
+        CloudinaryDeletion.query.filter(
+            CloudinaryDeletion.id.in_(done)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+
+# =========================
+# RECONCILIATION
+# =========================
+def iter_remote_assets(prefix=None, page_size=500):
+    """Yield ``(public_id, created_at)`` for every asset, page by page."""
+    cursor = None
+    while True:
+        page = call_cloudinary("resources", prefix=prefix, next_cursor=cursor, max_results=page_size)
+        for asset in page.get("resources", []):
+            yield asset["public_id"], asset.get("created_at")
+        cursor = page.get("next_cursor")
+        if not cursor:
+            return
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _created_before(created_at, cutoff):
+    if not created_at:
+        return True
+    return datetime.strptime(created_at, "%Y-%m-%dT%H:%M:%SZ") < cutoff
+
+
+def find_orphans(prefix=None, grace=timedelta(hours=1), chunk_size=500):
+    """Yield public ids present in Cloudinary but not referenced by any row.
+
+    Assets younger than ``grace`` are skipped so uploads whose row has not
+    been committed yet are not reported. Remote ids are checked against the
+    database in chunks, so memory stays flat however large the account is.
+    """
+    cutoff = datetime.utcnow() - grace
+    for chunk in _chunks(iter_remote_assets(prefix=prefix), chunk_size):
+        candidates = [pid for pid, created_at in chunk if _created_before(created_at, cutoff)]
+        if not candidates:
+            continue
+        used = referenced_public_ids(candidates)
+        queued = {
+            pid for (pid,) in db.session.query(CloudinaryDeletion.public_id)
+            .filter(CloudinaryDeletion.public_id.in_(candidates))
+        }
+        yield from (pid for pid in candidates if pid not in used and pid not in queued)
+
+
+# =========================
+# CLI
+# =========================
+media_cli = AppGroup("media", help="Cloudinary asset maintenance.")
+
+
+@media_cli.command("drain-deletions")
+@click.option("--batch-size", type=int, default=BULK_DELETE_LIMIT, show_default=True)
+def drain_deletions_command(batch_size):
+    """Delete queued assets from Cloudinary in bulk."""
+    deleted, failed = drain_deletions(batch_size=batch_size)
+    click.echo(f"Deleted {deleted} asset(s), {failed} failed.")
+
+
+@media_cli.command("reconcile")
+@click.option("--prefix", default=None, help="Only look at assets under this folder.")
+@click.option("--grace-hours", type=int, default=1, show_default=True)
+@click.option("--purge", is_flag=True, help="Queue orphans for deletion instead of just listing them.")
+def reconcile_command(prefix, grace_hours, purge):
+    """Find Cloudinary assets no row references."""
+    count = 0
+    for public_id in find_orphans(prefix=prefix, grace=timedelta(hours=grace_hours)):
+        count += 1
+        click.echo(public_id)
+        if purge:
+            # Nothing points at it, so any reference count left is stale
+            MediaAsset.query.filter_by(public_id=public_id).update({"ref_count": 0})
+            _queue_deletions([public_id])
+            if count % BULK_DELETE_LIMIT == 0:
+                db.session.commit()
+    db.session.commit()
+    click.echo(f"{count} orphaned asset(s){' queued for deletion' if purge else ''}.")
@@ -0,0 +1,242 @@
+"""Hot/cold message storage.
+
+Recent messages live in the ``message`` table. Conversations that have been
+idle for ``MESSAGE_ARCHIVE_AFTER_DAYS`` are moved into ``message_archive`` as
+compressed chunks by ``flask messages archive``. Views read the hot table
+first and only touch the archive once a user pages back past it.
+"""
+import json
+import zlib
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, text
+
+from app import db
+from app.models import Message, MessageArchive
+
+# Read-only stand-in for Message rows coming back from the archive
+ArchivedMessage = namedtuple(
+    "ArchivedMessage",
+    "id sender_id receiver_id product_id is_read content timestamp"
+)
+
+_known_partitions = set()  # months whose partition creation has committed
+
+
+# =========================
+# HELPERS
+# =========================
+def _pair(user_a, user_b):
+    return min(user_a, user_b), max(user_a, user_b)
+
+
+def _between(user_a, user_b):
+    return (
+        ((Message.sender_id == user_a) & (Message.receiver_id == user_b)) |
+        ((Message.sender_id == user_b) & (Message.receiver_id == user_a))
+    )
+
+
+def _month_of(moment):
+    return date(moment.year, moment.month, 1)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def _archive_query(product_id, user_a, user_b):
+    low, high = _pair(user_a, user_b)
+    return MessageArchive.query.filter_by(
+        product_id=product_id, user_low_id=low, user_high_id=high
+    )
+
+
+def _pack(messages):
+    rows = [
+        [m.id, m.sender_id, m.receiver_id, bool(m.is_read), m.content, m.timestamp.isoformat()]
+        for m in messages
+    ]
+    return zlib.compress(json.dumps(rows, separators=(",", ":")).encode("utf-8"))
+
+
+def _unpack(chunk):
+    rows = json.loads(zlib.decompress(chunk.payload).decode("utf-8"))
+    return [
+        ArchivedMessage(
+            id=row[0], sender_id=row[1], receiver_id=row[2], product_id=chunk.product_id,
+            is_read=row[3], content=row[4], timestamp=datetime.fromisoformat(row[5])
+        )
+        for row in rows
+    ]
+
+
+def ensure_archive_partition(month):
+    """Create the monthly partition for ``month`` on Postgres (no-op elsewhere).
+
+    Part of the session's transaction; the month is only remembered once
+    that commits, since a rollback undoes the CREATE too.
+    """
+    if db.engine.dialect.name != "postgresql" or month in _known_partitions:
+        return
+    pending = db.session.info.setdefault("archive_partitions", set())
+    if month in pending:
+        return
+    db.session.execute(text(
+        f"CREATE TABLE IF NOT EXISTS message_archive_{month:%Y_%m} "
+        f"PARTITION OF message_archive "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+    ))
+    pending.add(month)
+
+
+def _remember_partitions(session):
+    _known_partitions.update(session.info.pop("archive_partitions", ()))
+
+
+def _forget_partitions(session):
+    session.info.pop("archive_partitions", None)
+
+
+# =========================
+# READS
+# =========================
+def archived_messages(product_id, user_a, user_b, before=None, limit=50):
+    """Newest-first archived messages of a conversation older than ``before``."""
+    chunks = _archive_query(product_id, user_a, user_b)
+    if before is not None:
+        chunks = chunks.filter(MessageArchive.id < before)
+
+    found = []
+    for chunk in chunks.order_by(MessageArchive.id.desc()):
+        older = [m for m in _unpack(chunk) if before is None or m.id < before]
+        found.extend(reversed(older))
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+
+def load_conversation(product_id, user_a, user_b, before=None, limit=None, columns=None):
+    """Return one page of a conversation, oldest first, plus a cursor.
+
+    The cursor is the message id to pass as ``before`` to get the previous
+    page, or ``None`` when there is nothing older. With ``columns`` (which
+    must include ``Message.id``) hot messages come back as rows of just
+    those columns instead of ``Message`` objects; either way they share
+    attribute names with archived messages.
+    """
+    limit = limit or current_app.config["CONVERSATION_PAGE_SIZE"]
+
+    query = db.session.query(*columns) if columns else Message.query
+    query = query.filter(_between(user_a, user_b), Message.product_id == product_id)
+    if before is not None:
+        query = query.filter(Message.id < before)
+    newest = query.order_by(Message.id.desc()).limit(limit + 1).all()
+
+    if len(newest) > limit:
+        page = newest[:limit]
+        return page[::-1], page[-1].id
+
+    if newest and before is None:
+        # First page fits in hot storage; just check whether history exists
+        has_archive = _archive_query(product_id, user_a, user_b).first() is not None
+        return newest[::-1], (newest[-1].id if has_archive else None)
+
+    # Scrolled past the hot data: fall back to cold storage
+    start = newest[-1].id if newest else before
+    combined = newest + archived_messages(
+        product_id, user_a, user_b, before=start, limit=limit + 1 - len(newest)
+    )
+    page = combined[:limit]
+    return page[::-1], (page[-1].id if len(combined) > limit else None)
+
+
+def archived_conversations(user_id):
+    """Archive chunks the user takes part in, latest activity first."""
+    return MessageArchive.query.filter(
+        (MessageArchive.user_low_id == user_id) | (MessageArchive.user_high_id == user_id)
+    ).order_by(MessageArchive.last_timestamp.desc()).all()
+
+
+# =========================
+# ARCHIVAL
+# =========================
+def archive_idle_conversations(idle_days=None, batch_size=200):
+    """Move conversations idle for ``idle_days`` into compressed cold storage.
+
+    Works in batches of ``batch_size`` conversations, committing after each
+    one, and returns the number of conversations archived.
+    """
+    if idle_days is None:
+        idle_days = current_app.config["MESSAGE_ARCHIVE_AFTER_DAYS"]
+    cutoff = datetime.utcnow() - timedelta(days=idle_days)
+
+    low = db.case((Message.sender_id < Message.receiver_id, Message.sender_id), else_=Message.receiver_id)
+    high = db.case((Message.sender_id < Message.receiver_id, Message.receiver_id), else_=Message.sender_id)
+
+    archived = 0
+    while True:
+        idle = (
+            db.session.query(Message.product_id, low, high)
+            .filter(Message.product_id.isnot(None))
+            .group_by(Message.product_id, low, high)
+            .having(db.func.max(Message.timestamp) < cutoff)
+            .limit(batch_size)
+            .all()
+        )
+        if not idle:
+            return archived
+
+        for product_id, user_low, user_high in idle:
+            messages = (
+                Message.query
+                .filter(_between(user_low, user_high), Message.product_id == product_id)
+                .order_by(Message.id)
+                .all()
+            )
+            month = _month_of(messages[-1].timestamp)
+            ensure_archive_partition(month)
+            db.session.add(MessageArchive(
+                id=messages[0].id,
+                month=month,
+                product_id=product_id,
+                user_low_id=user_low,
+                user_high_id=user_high,
+                first_timestamp=messages[0].timestamp,
+                last_timestamp=messages[-1].timestamp,
+                message_count=len(messages),
+                preview=messages[-1].content[:200],
+                payload=_pack(messages),
+            ))
+            Message.query.filter(
+                Message.id.in_([m.id for m in messages])
+            ).delete(synchronize_session=False)
+
+        db.session.commit()
+        archived += len(idle)
+
+
+# =========================
+# CLI
+# =========================
+messages_cli = AppGroup("messages", help="Message storage maintenance.")
+
+
+def init_app(app, db):
+    session_class = db.session.session_factory.class_
+    event.listen(session_class, "after_commit", _remember_partitions)
+    event.listen(session_class, "after_rollback", _forget_partitions)
+    app.cli.add_command(messages_cli)
+
+
+@messages_cli.command("archive")
+@click.option("--days", type=int, default=None, help="Idle age in days (defaults to MESSAGE_ARCHIVE_AFTER_DAYS).")
+@click.option("--batch-size", type=int, default=200, show_default=True)
+def archive_command(days, batch_size):
+    """Move idle conversations to cold storage."""
+    count = archive_idle_conversations(idle_days=days, batch_size=batch_size)
+    click.echo(f"Archived {count} conversation(s).")
@@ -0,0 +1,189 @@
+"""Prometheus metrics, served at ``/metrics``.
+
+Exposed series:
+
+* ``http_request_duration_seconds{endpoint,method}`` - latency histogram per
+  Flask endpoint, plus ``http_requests_total{endpoint,method,status}``;
+* ``http_requests_in_flight`` - requests currently being handled;
+* ``db_pool_connections_checked_out{bind}`` / ``db_pool_capacity{bind}``;
+* ``cloudinary_request_duration_seconds{operation}`` and
+  ``cloudinary_errors_total{operation}`` around calls to Cloudinary, and
+  ``cloudinary_uploads_deduplicated_total`` for uploads skipped because
+  the same bytes were already stored;
+* ``cloudinary_circuit_state`` (0 closed, 1 half-open, 2 open; the worst
+  worker wins) and ``cloudinary_calls_rejected_total{operation}`` for
+  calls refused while the circuit was open;
+* ``messages_sent_total`` and ``products_added_total``.
+
+Under gunicorn each worker has its own copy of every metric. Set
+``PROMETHEUS_MULTIPROC_DIR`` (``gunicorn.conf.py`` does) and values are
+kept in files there and summed across workers at scrape time, so any
+worker can answer ``/metrics``. Without it, ``/metrics`` reports the
+current process only, which is right for ``flask run``.
+
+If ``METRICS_TOKEN`` is set, scrapes must send
+``Authorization: Bearer <token>``. Without a token ``/metrics`` only
+answers requests from the machine itself (a local agent, ``flask run``);
+it lists endpoints, traffic and pool usage, which are not for the public.
+"""
+import hmac
+import ipaddress
+import os
+import time
+from contextlib import contextmanager
+
+from flask import Response, abort, current_app, g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+from sqlalchemy import event
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling a request, by Flask endpoint.",
+    ["endpoint", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter(
+    "http_requests_total",
+    "Requests handled, by Flask endpoint and status code.",
+    ["endpoint", "method", "status"],
+)
+IN_FLIGHT = Gauge(
+    "http_requests_in_flight",
+    "Requests currently being handled.",
+    multiprocess_mode="livesum",
+)
+
+DB_CHECKED_OUT = Gauge(
+    "db_pool_connections_checked_out",
+    "Database connections currently checked out of the pool.",
+    ["bind"],
+    multiprocess_mode="livesum",
+)
+DB_CAPACITY = Gauge(
+    "db_pool_capacity",
+    "Pool size plus allowed overflow.",
+    ["bind"],
+    multiprocess_mode="livesum",
+)
+
+CLOUDINARY_LATENCY = Histogram(
+    "cloudinary_request_duration_seconds",
+    "Time spent in Cloudinary API calls.",
+    ["operation"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+CLOUDINARY_ERRORS = Counter(
+    "cloudinary_errors_total",
+    "Cloudinary API calls that raised.",
+    ["operation"],
+)
+CLOUDINARY_CIRCUIT = Gauge(
+    "cloudinary_circuit_state",
+    "Cloudinary circuit breaker: 0 closed, 1 half-open, 2 open.",
+    multiprocess_mode="livemax",
+)
+CLOUDINARY_REJECTED = Counter(
+    "cloudinary_calls_rejected_total",
+    "Cloudinary calls refused by the open circuit breaker.",
+    ["operation"],
+)
+CLOUDINARY_DEDUPED = Counter(
+    "cloudinary_uploads_deduplicated_total",
+    "Uploads answered with an existing asset of identical content.",
+)
+
+MESSAGES_SENT = Counter("messages_sent_total", "Chat messages sent.")
+PRODUCTS_ADDED = Counter("products_added_total", "Products listed by sellers.")
+
+
+@contextmanager
+def track_cloudinary(operation):
+    """Time a Cloudinary call and count it as an error if it raises."""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        CLOUDINARY_ERRORS.labels(operation).inc()
+        raise
+    finally:
+        CLOUDINARY_LATENCY.labels(operation).observe(time.perf_counter() - started)
+
+
+# =========================
+# REQUEST HOOKS
+# =========================
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+    IN_FLIGHT.inc()
+
+
+def _remember_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _observe(exc):
+    started = g.pop("metrics_started", None)
+    if started is None:
+        return
+    IN_FLIGHT.dec()
+    # Unmatched URLs share one label so scanners can't blow up cardinality
+    endpoint = request.endpoint or "unmatched"
+    status = g.pop("metrics_status", 500 if exc is not None else 200)
+    REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - started)
+    REQUESTS.labels(endpoint, request.method, str(status)).inc()
+
+
+def _watch_pool(bind, engine):
+    pool = engine.pool
+    size = getattr(pool, "size", None)
+    if callable(size):
+        DB_CAPACITY.labels(bind).set(size() + max(getattr(pool, "_max_overflow", 0), 0))
+
+    checked_out = DB_CHECKED_OUT.labels(bind)
+    event.listen(engine, "checkout", lambda *args: checked_out.inc())
+    event.listen(engine, "checkin", lambda *args: checked_out.dec())
+
+
+# =========================
+# ENDPOINT
+# =========================
+def _is_local(address):
+    try:
+        return ipaddress.ip_address(address or "").is_loopback
+    except ValueError:
+        return False
+
+
+def metrics_view():
+    token = current_app.config["METRICS_TOKEN"]
+    if token:
+        supplied = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not hmac.compare_digest(supplied, token):
+            abort(404)
+    elif not _is_local(request.remote_addr):
+        abort(404)
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app, db):
+    if not app.config["METRICS_ENABLED"]:
+        return
+
+    app.before_request(_start_timer)
+    app.after_request(_remember_status)
+    app.teardown_request(_observe)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
+
+    with app.app_context():
+        for bind, engine in db.engines.items():
+            _watch_pool(bind or "default", engine)
@@ -70,6 +70,11 @@ class BuyerProfile(db.Model):
 # SELLER PROFILE
 # ----------------------
 class SellerProfile(db.Model):
+    __table_args__ = (
+        # Covers radius searches: geohash range scan, then exact filtering
+        db.Index('ix_seller_profile_geohash_point', 'geohash', 'latitude', 'longitude', 'user_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey("users.id"), unique=True)
 
@@ -83,6 +88,11 @@ class SellerProfile(db.Model):
     open_hours = db.Column(db.String(50))
     rating = db.Column(db.Float, default=0.0)
 
+    # Resolved from ``location`` with the offline gazetteer (see app/geo.py)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    geohash = db.Column(db.String(12))
+
     images = db.relationship('SellerImage', backref='seller_profile', lazy='dynamic')
 
     def __repr__(self):
@@ -121,6 +131,12 @@ class Category(db.Model):
 # PRODUCT
 # ----------------------
 class Product(db.Model):
+    __table_args__ = (
+        # "does this seller have anything in stock" without touching the table
+        db.Index('ix_product_seller_stock', 'seller_id', 'stock_quantity'),
+        db.Index('ix_product_category_id', 'category_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(140), nullable=False)
     description = db.Column(db.Text)
@@ -134,39 +150,271 @@ class Product(db.Model):
 
     images = db.relationship('ProductImage', backref='product', lazy='dynamic')
     messages = db.relationship('Message', backref='product', lazy='dynamic')
+    variants = db.relationship(
+        'ProductVariant', backref='product', lazy='dynamic',
+        order_by='(ProductVariant.size_system, ProductVariant.size)'
+    )
 
     def __repr__(self):
         return f'<Product {self.name}>'
 
+# ----------------------
+# PRODUCT VARIANTS
+# ----------------------
+class ProductVariant(db.Model):
+    """One size of a product with its own stock.
+
+    ``price`` is a copy of the product's price so that "size X in stock
+    under price Y" is a single range scan of ``ix_product_variant_in_stock``.
+    """
+    __tablename__ = "product_variant"
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'size_system', 'size', name='uq_product_variant_size'),
+        db.Index(
+            'ix_product_variant_in_stock', 'size_system', 'size', 'price', 'product_id',
+            postgresql_where=db.text('stock > 0'), sqlite_where=db.text('stock > 0')
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False)
+    size_system = db.Column(db.String(4), nullable=False)  # EU, UK, US
+    size = db.Column(db.Float, nullable=False)
+    stock = db.Column(db.Integer, nullable=False, default=0)
+    price = db.Column(db.Float, nullable=False)
+
+    @property
+    def label(self):
+        return f"{self.size_system} {self.size:g}"
+
+    def __repr__(self):
+        return f'<ProductVariant {self.product_id} {self.label}>'
+
 # ----------------------
 # PRODUCT IMAGES
 # ----------------------
 class ProductImage(db.Model):
+    __table_args__ = (
+        # a product's images in upload order; the first one is its cover
+        db.Index('ix_product_image_product_id', 'product_id', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
     public_id = db.Column(db.String(200))   # Cloudinary public_id
     image_url = db.Column(db.String(200))
     description = db.Column(db.String(200))
 
+# ----------------------
+# CLOUDINARY DELETION OUTBOX
+# ----------------------
+class CloudinaryDeletion(db.Model):
+    """An asset waiting to be removed by ``flask media drain-deletions``."""
+    __tablename__ = "cloudinary_deletion"
+    id = db.Column(db.Integer, primary_key=True)
+    public_id = db.Column(db.String(200), nullable=False, index=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.String(200))
+
+    def __repr__(self):
+        return f'<CloudinaryDeletion {self.public_id}>'
+
+# ----------------------
+# UPLOADED ASSETS BY CONTENT (see app/media.py)
+# ----------------------
+class MediaAsset(db.Model):
+    """A Cloudinary asset keyed by the SHA-256 of its bytes.
+
+    ``ref_count`` is the number of rows pointing at ``public_id``; an
+    identical upload reuses the asset and adds a reference instead.
+    """
+    __tablename__ = "media_asset"
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    public_id = db.Column(db.String(200), nullable=False, unique=True)
+    url = db.Column(db.String(200), nullable=False)
+    bytes = db.Column(db.Integer)
+    ref_count = db.Column(db.Integer, default=1, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<MediaAsset {self.public_id} x{self.ref_count}>'
+
+# ----------------------
+# MIGRATION BACKFILL PROGRESS (see app/online_migrations.py)
+# ----------------------
+class OnlineBackfillProgress(db.Model):
+    __tablename__ = "online_backfill_progress"
+    name = db.Column(db.String(100), primary_key=True)
+    last_id = db.Column(db.BigInteger, nullable=False, default=0)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# ----------------------
+# EMAIL OUTBOX
+# ----------------------
+class EmailOutbox(db.Model):
+    """An email waiting for ``flask mail send``.
+
+    ``new_message`` rows carry no subject/body; they are merged into one
+    digest per user when sent.
+    """
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        db.Index('ix_email_outbox_pending', 'sent_at', 'kind', 'user_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    recipient = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(200))
+    body = db.Column(db.Text)
+    message_id = db.Column(db.Integer)  # for new_message notifications
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    last_error = db.Column(db.String(200))
+
+    def __repr__(self):
+        return f'<EmailOutbox {self.kind} to {self.recipient}>'
+
+# ----------------------
+# RATE LIMIT COUNTERS
+# ----------------------
+class RateLimitCounter(db.Model):
+    """Per-key request count for one fixed window (shared rate limit storage)."""
+    __tablename__ = "rate_limit_counter"
+    key = db.Column(db.String(200), primary_key=True)
+    window_start = db.Column(db.BigInteger, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+# ----------------------
+# RELATED PRODUCTS (built by `flask related build`)
+# ----------------------
+class RelatedProduct(db.Model):
+    __tablename__ = "related_products"
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    related_id = db.Column(db.Integer, db.ForeignKey('product.id', ondelete='CASCADE'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+
+
+class RelatedProductState(db.Model):
+    """Fingerprint of the text each product was last indexed with."""
+    __tablename__ = "related_product_state"
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    fingerprint = db.Column(db.BigInteger, nullable=False)
+
+# ----------------------
+# ANALYTICS ROLLUPS (see app/analytics.py)
+# ----------------------
+class ProductDailyStats(db.Model):
+    __tablename__ = "product_daily_stats"
+    __table_args__ = (
+        db.Index('ix_product_daily_stats_seller_day', 'seller_id', 'day'),
+    )
+    # no foreign keys: history outlives deleted products
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    seller_id = db.Column(db.Integer, nullable=False)
+    views = db.Column(db.Integer, default=0, nullable=False)
+    messages = db.Column(db.Integer, default=0, nullable=False)
+
+
+class SellerDailyStats(db.Model):
+    __tablename__ = "seller_daily_stats"
+    seller_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    views = db.Column(db.Integer, default=0, nullable=False)
+    messages = db.Column(db.Integer, default=0, nullable=False)
+
+# ----------------------
+# TRENDING SCORES (see app/trending.py)
+# ----------------------
+class TrendingScore(db.Model):
+    """Time-decayed activity score of one product or seller."""
+    __tablename__ = "trending_score"
+    __table_args__ = (
+        # the feed: one kind, highest scores first
+        db.Index('ix_trending_score_kind_score', 'kind', 'score'),
+    )
+    kind = db.Column(db.String(10), primary_key=True)  # product, seller
+    subject_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    score = db.Column(db.Float, default=0.0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 # ----------------------
 # MESSAGES
 # ----------------------
 class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_product_timestamp', 'product_id', 'timestamp'),
+        db.Index('ix_message_receiver_read', 'receiver_id', 'is_read'),
+        # one conversation, newest first (message_store.load_conversation)
+        db.Index('ix_message_conversation', 'product_id', 'sender_id', 'receiver_id', 'id'),
+        # never reuse ids once rows move to the archive; paging relies on them
+        {'sqlite_autoincrement': True},
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     
-    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=True)
     is_read = db.Column(db.Boolean, default=False) 
     content = db.Column(db.Text, nullable=False)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, index=True)
 
     def __repr__(self):
         return f'<Message {self.id}>'
 
+# ----------------------
+# MESSAGE ARCHIVE (cold storage)
+# ----------------------
+class MessageArchive(db.Model):
+    """One idle conversation (or a chunk of one) moved out of the hot table.
+
+    The messages are stored as zlib-compressed JSON in ``payload``. On
+    Postgres the table is range-partitioned by ``month``; partitions are
+    created on demand by ``app.message_store``. Other databases keep it as a
+    plain table indexed on ``month``.
+    """
+    __tablename__ = "message_archive"
+    __table_args__ = (
+        db.Index('ix_message_archive_conversation', 'product_id', 'user_low_id', 'user_high_id'),
+        db.Index('ix_message_archive_month', 'month'),
+        {'postgresql_partition_by': 'RANGE (month)'},
+    )
+
+    # id is the smallest message id in the chunk, so it is unique and keeps
+    # archive rows in the same order as the messages they hold
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    month = db.Column(db.Date, primary_key=True)
+
+    # plain ints: archived rows must never block deletes upstream
+    product_id = db.Column(db.Integer)
+    user_low_id = db.Column(db.Integer, nullable=False)
+    user_high_id = db.Column(db.Integer, nullable=False)
+
+    first_timestamp = db.Column(db.DateTime)
+    last_timestamp = db.Column(db.DateTime)
+    message_count = db.Column(db.Integer, default=0)
+    preview = db.Column(db.String(200))  # last message, for inbox listings
+    payload = db.Column(db.LargeBinary, nullable=False)
+
+    def __repr__(self):
+        return f'<MessageArchive {self.id} ({self.message_count} messages)>'
+
 # ----------------------
 # LOGIN LOADER
 # ----------------------
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    # base.html shows the profile picture on every page, so load it with the user
+    return (
+        User.query
+        .options(db.joinedload(User.seller_profile), db.joinedload(User.buyer_profile))
+        .get(int(id))
+    )
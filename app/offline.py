@@ -0,0 +1,57 @@
+"""Service worker for buyers browsing on mobile data.
+
+``/service-worker.js`` serves ``static/js/service-worker.js`` from the
+site root, so it controls every page. It caches Cloudinary images and the
+static bundle cache-first, and storefront pages stale-while-revalidate
+(see the script's header).
+
+Pages register it with a URL that carries a version. The version is a
+hash of the static files and templates, or ``SERVICE_WORKER_VERSION`` if
+set. A deploy that changes either gives a new URL. Browsers then install
+the new worker, which drops the old static and page caches. The image
+cache is kept, up to ``SERVICE_WORKER_IMAGE_CACHE_MB``.
+"""
+import hashlib
+import os
+
+from flask import current_app, has_request_context, send_from_directory, url_for
+
+
+def content_version(*folders):
+    """Short hash of every file under ``folders``."""
+    digest = hashlib.sha1()
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, folder).encode())
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+def service_worker():
+    response = send_from_directory(current_app.static_folder, "js/service-worker.js", max_age=0)
+    # Browsers check for a new worker on navigation; never let a cache answer that
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def init_app(app):
+    if not app.config["SERVICE_WORKER_ENABLED"]:
+        return
+    version = app.config.get("SERVICE_WORKER_VERSION") or content_version(
+        app.static_folder, os.path.join(app.root_path, app.template_folder)
+    )
+    app.add_url_rule("/service-worker.js", "service_worker", service_worker)
+
+    @app.context_processor
+    def service_worker_url():
+        if not has_request_context():
+            return {}  # emails
+        return {"service_worker_url": url_for(
+            "service_worker", v=version,
+            image_mb=app.config["SERVICE_WORKER_IMAGE_CACHE_MB"],
+            pages=app.config["SERVICE_WORKER_PAGE_CACHE_ENTRIES"],
+        )}
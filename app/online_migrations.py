@@ -0,0 +1,184 @@
+"""Helpers for migrations that run while the site is serving traffic.
+
+``flask db upgrade`` runs on every deploy (see the Procfile), against
+tables that are being read and written. On Postgres:
+
+* ``migrations/env.py`` sets ``lock_timeout`` and ``statement_timeout``
+  (``MIGRATION_LOCK_TIMEOUT``, ``MIGRATION_STATEMENT_TIMEOUT``) and runs
+  each revision in its own transaction. A DDL statement that cannot get
+  its lock soon gives up, instead of waiting behind a long transaction
+  while every other query waits behind it.
+* ``create_index_online`` builds indexes with ``CREATE INDEX
+  CONCURRENTLY`` outside the migration's transaction. A build that fails
+  leaves an INVALID index, which is dropped and retried.
+* ``batched_backfill`` updates a table in primary-key ranges, one
+  autocommitted batch at a time, with a pause between batches. Progress
+  is stored in ``online_backfill_progress``, so a deploy that dies part
+  way resumes where it stopped.
+
+On SQLite (development) the same calls fall back to plain statements.
+"""
+import logging
+import time
+from datetime import datetime
+
+import sqlalchemy as sa
+from alembic import op
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+LOCK_NOT_AVAILABLE = "55P03"  # SQLSTATE raised when lock_timeout expires
+
+
+def _is_postgres(bind):
+    return bind.dialect.name == "postgresql"
+
+
+def _lock_timed_out(exc):
+    orig = getattr(exc, "orig", None)
+    # psycopg2 calls it pgcode, psycopg 3 sqlstate
+    return LOCK_NOT_AVAILABLE in (getattr(orig, "pgcode", None), getattr(orig, "sqlstate", None))
+
+
+def configure_session(connection, lock_timeout, statement_timeout):
+    """Session-wide timeouts for a migration connection (Postgres only)."""
+    if not _is_postgres(connection):
+        return
+    connection.exec_driver_sql(f"SET lock_timeout = '{lock_timeout}'")
+    connection.exec_driver_sql(f"SET statement_timeout = '{statement_timeout}'")
+    connection.commit()
+
+
+def index_exists(bind, table, name):
+    return name in {i["name"] for i in sa.inspect(bind).get_indexes(table)}
+
+
+def _invalid_index(bind, name):
+    return bind.exec_driver_sql(
+        "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = %(name)s AND NOT i.indisvalid",
+        {"name": name},
+    ).first() is not None
+
+
+def create_index_online(name, table, columns, unique=False, where=None, retries=5, backoff=2.0):
+    """Create an index without blocking writes to ``table``.
+
+    ``columns`` are column names; ``where`` is an optional SQL predicate
+    for a partial index. Does nothing if the index already exists.
+    """
+    bind = op.get_bind()
+    if not _is_postgres(bind):
+        if not index_exists(bind, table, name):
+            predicate = {"sqlite_where": sa.text(where)} if where else {}
+            op.create_index(name, table, columns, unique=unique, **predicate)
+        return
+
+    preparer = bind.dialect.identifier_preparer
+    statement = "CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({columns}){where}".format(
+        unique="UNIQUE " if unique else "",
+        name=preparer.quote(name),
+        table=preparer.quote(table),
+        columns=", ".join(preparer.quote(c) for c in columns),
+        where=f" WHERE {where}" if where else "",
+    )
+    with op.get_context().autocommit_block():
+        # The build itself may take minutes; only the lock wait is bounded.
+        # RESET would restore the server default rather than the timeout
+        # configure_session set, leaving later revisions unbounded.
+        previous_timeout = bind.exec_driver_sql("SHOW statement_timeout").scalar()
+        bind.exec_driver_sql("SET statement_timeout = 0")
+        try:
+            for attempt in range(1, retries + 1):
+                if _invalid_index(bind, name):
+                    bind.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {preparer.quote(name)}")
+                try:
+                    bind.exec_driver_sql(statement)
+                    return
+                except sa.exc.OperationalError as exc:
+                    if not _lock_timed_out(exc) or attempt == retries:
+                        raise
+                    logger.warning("Lock timeout building %s (attempt %d); retrying", name, attempt)
+                    time.sleep(backoff * attempt)
+        finally:
+            bind.exec_driver_sql(f"SET statement_timeout = '{previous_timeout}'")
+
+
+def drop_index_online(name, table):
+    bind = op.get_bind()
+    if not _is_postgres(bind):
+        if index_exists(bind, table, name):
+            op.drop_index(name, table_name=table)
+        return
+    with op.get_context().autocommit_block():
+        bind.exec_driver_sql(f"DROP INDEX CONCURRENTLY IF EXISTS {bind.dialect.identifier_preparer.quote(name)}")
+
+
+# =========================
+# BACKFILLS
+# =========================
+_progress = sa.table(
+    "online_backfill_progress",
+    sa.column("name", sa.String),
+    sa.column("last_id", sa.BigInteger),
+    sa.column("finished_at", sa.DateTime),
+    sa.column("updated_at", sa.DateTime),
+)
+
+
+def _save_progress(bind, name, last_id, finished=False):
+    now = datetime.utcnow()
+    values = {"last_id": last_id, "updated_at": now, "finished_at": now if finished else None}
+    updated = bind.execute(_progress.update().where(_progress.c.name == name).values(**values)).rowcount
+    if not updated:
+        bind.execute(_progress.insert().values(name=name, **values))
+
+
+def batched_backfill(name, table, step, batch_size=5000, pause=0.1, target_seconds=1.0, key="id"):
+    """Run ``step(bind, start, end)`` over ``table`` in key ranges ``[start, end)``.
+
+    ``step`` issues the UPDATE/INSERT for one range and must be idempotent
+    (e.g. ``WHERE new_col IS NULL``): a batch may run again after a crash,
+    because the batch and its progress row are committed separately.
+    Ranges whose batch took longer than ``target_seconds`` halve the batch
+    size, and quick ones double it back, so busy tables get smaller bites.
+    Rows added after the backfill starts are the application's job.
+    ``name`` identifies the backfill for resuming; a finished one is skipped.
+    """
+    bind = op.get_bind()
+    with op.get_context().autocommit_block():
+        done = bind.execute(
+            sa.select(_progress.c.last_id, _progress.c.finished_at).where(_progress.c.name == name)
+        ).first()
+        if done is not None and done.finished_at is not None:
+            logger.info("Backfill %s already finished", name)
+            return
+
+        column = sa.column(key)
+        low, high = bind.execute(
+            sa.select(sa.func.min(column), sa.func.max(column)).select_from(sa.table(table))
+        ).one()
+        if low is None:
+            _save_progress(bind, name, 0, finished=True)
+            return
+
+        start = max(low, done.last_id + 1) if done is not None else low
+        size, batches = batch_size, 0
+        while start <= high:
+            end = start + size
+            started = time.perf_counter()
+            step(bind, start, end)
+            elapsed = time.perf_counter() - started
+            _save_progress(bind, name, end - 1)
+            batches += 1
+            if batches % 50 == 0:
+                logger.info("Backfill %s: up to %s %s of %s", name, key, end - 1, high)
+
+            if elapsed > target_seconds:
+                size = max(size // 2, 100)
+            elif elapsed < target_seconds / 4:
+                size = min(size * 2, batch_size)
+            start = end
+            time.sleep(pause)
+        _save_progress(bind, name, high, finished=True)
+        logger.info("Backfill %s finished in %d batch(es)", name, batches)
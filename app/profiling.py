@@ -0,0 +1,273 @@
+"""On-demand request profiling.
+
+With ``PROFILER_ENABLED`` set, a request is profiled when it carries an
+``X-Profile`` header from an admin (``ADMIN_EMAILS``) or with the value of
+``PROFILER_TOKEN``, or at random with probability ``PROFILER_SAMPLE_RATE``.
+With the profiler disabled no hooks are installed at all.
+
+A profiled request is sampled by a background thread that snapshots the
+request thread's stack every ``PROFILER_INTERVAL`` seconds, so the stacks
+cover view code, ORM calls and Jinja rendering alike. SQL and template
+render time are measured separately. Each capture is written to
+``PROFILER_DIR`` as:
+
+* ``<id>.collapsed`` - collapsed stacks for flamegraph.pl / speedscope;
+* ``<id>.speedscope.json`` - a sampled profile for https://www.speedscope.app;
+* ``<id>.json`` - request summary shown on ``/admin/profiles``.
+"""
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from functools import wraps
+
+from flask import (
+    Blueprint, abort, current_app, g, render_template, request, send_from_directory
+)
+from flask import before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+
+profiling = Blueprint("profiling", __name__, url_prefix="/admin/profiles")
+
+
+# =========================
+# SAMPLER
+# =========================
+class StackSampler:
+    """Samples one thread's Python stack from a helper thread."""
+
+    def __init__(self, thread_id, interval=0.001):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, frame.f_lineno))
+                frame = frame.f_back
+            if stack:
+                self.stacks[tuple(reversed(stack))] += 1
+
+
+def _frame_label(frame):
+    name, filename, line = frame
+    if filename.startswith(os.getcwd()):
+        filename = os.path.relpath(filename)
+    return f"{name} ({filename}:{line})"
+
+
+def write_capture(directory, capture_id, summary, sampler):
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, capture_id)
+
+    with open(base + ".collapsed", "w") as fh:
+        for stack, count in sampler.stacks.most_common():
+            fh.write(";".join(_frame_label(f).replace(";", ":") for f in stack) + f" {count}\n")
+
+    frames, frame_index, samples, weights = [], {}, [], []
+    for stack, count in sampler.stacks.items():
+        sample = []
+        for frame in stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            sample.append(frame_index[frame])
+        samples.append(sample)
+        weights.append(count * sampler.interval * 1000)
+    with open(base + ".speedscope.json", "w") as fh:
+        json.dump({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "afrido-profiler",
+            "name": f"{summary['method']} {summary['path']}",
+            "shared": {"frames": frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": summary["endpoint"] or summary["path"],
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": summary["duration_ms"],
+                "samples": samples,
+                "weights": weights,
+            }],
+        }, fh)
+
+    with open(base + ".json", "w") as fh:
+        json.dump(summary, fh)
+
+
+def _prune(directory, keep):
+    try:
+        summaries = sorted(f for f in os.listdir(directory) if f.endswith(".json") and f.count(".") == 1)
+    except FileNotFoundError:
+        return
+    for name in summaries[:-keep] if keep else []:
+        capture_id = name[:-len(".json")]
+        for suffix in (".json", ".collapsed", ".speedscope.json"):
+            try:
+                os.remove(os.path.join(directory, capture_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_captures(directory):
+    captures = []
+    try:
+        names = sorted(os.listdir(directory), reverse=True)
+    except FileNotFoundError:
+        return captures
+    for name in names:
+        if name.endswith(".json") and name.count(".") == 1:
+            with open(os.path.join(directory, name)) as fh:
+                captures.append(json.load(fh))
+    return captures
+
+
+# =========================
+# REQUEST HOOKS
+# =========================
+def is_admin():
+    admins = current_app.config["ADMIN_EMAILS"]
+    return (
+        current_user.is_authenticated
+        and bool(current_user.email)
+        and current_user.email.lower() in admins
+    )
+
+
+def _wants_profile():
+    header = request.headers.get("X-Profile")
+    if header is not None:
+        token = current_app.config["PROFILER_TOKEN"]
+        if token and hmac.compare_digest(header, token):
+            return True
+        if is_admin():
+            return True
+    rate = current_app.config["PROFILER_SAMPLE_RATE"]
+    return rate > 0 and random.random() < rate
+
+
+def _start_profile():
+    if request.blueprint == profiling.name or not _wants_profile():
+        return
+    g.profile = {"sql_ms": 0.0, "sql_count": 0, "render_ms": 0.0, "render_started": None}
+    g.profile_sampler = StackSampler(threading.get_ident(), current_app.config["PROFILER_INTERVAL"])
+    g.profile_started = time.perf_counter()
+    g.profile_sampler.start()
+
+
+def _finish_profile(response):
+    sampler = g.pop("profile_sampler", None)
+    if sampler is None:
+        return response
+    sampler.stop()
+    duration_ms = (time.perf_counter() - g.profile_started) * 1000
+    stats = g.pop("profile")
+
+    capture_id = f"{datetime.utcnow():%Y%m%dT%H%M%S%f}-{os.getpid()}"
+    summary = {
+        "id": capture_id,
+        "captured_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "method": request.method,
+        "path": request.full_path.rstrip("?"),
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "duration_ms": round(duration_ms, 2),
+        "sql_count": stats["sql_count"],
+        "sql_ms": round(stats["sql_ms"], 2),
+        "render_ms": round(stats["render_ms"], 2),
+        "samples": sum(sampler.stacks.values()),
+    }
+    directory = current_app.config["PROFILER_DIR"]
+    try:
+        write_capture(directory, capture_id, summary, sampler)
+        _prune(directory, current_app.config["PROFILER_KEEP"])
+    except OSError:
+        current_app.logger.exception("Could not save request profile")
+    response.headers["X-Profile-Id"] = capture_id
+    return response
+
+
+def _on_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if "profile" in g:
+        conn.info.setdefault("profile_query_start", []).append(time.perf_counter())
+
+
+def _on_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get("profile_query_start")
+    if "profile" in g and starts:
+        g.profile["sql_ms"] += (time.perf_counter() - starts.pop()) * 1000
+        g.profile["sql_count"] += 1
+
+
+def _on_before_render(sender, template, context, **extra):
+    if "profile" in g:
+        g.profile["render_started"] = time.perf_counter()
+
+
+def _on_rendered(sender, template, context, **extra):
+    if "profile" in g and g.profile["render_started"] is not None:
+        g.profile["render_ms"] += (time.perf_counter() - g.profile["render_started"]) * 1000
+        g.profile["render_started"] = None
+
+
+def init_app(app, db):
+    if not app.config["PROFILER_ENABLED"]:
+        return  # nothing installed, nothing to pay for
+
+    app.config.setdefault("PROFILER_DIR", os.path.join(app.instance_path, "profiles"))
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.register_blueprint(profiling)
+    before_render_template.connect(_on_before_render, app)
+    template_rendered.connect(_on_rendered, app)
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, "before_cursor_execute", _on_before_cursor_execute)
+            event.listen(engine, "after_cursor_execute", _on_after_cursor_execute)
+
+
+# =========================
+# ADMIN PAGES
+# =========================
+def admin_required(view):
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not is_admin():
+            abort(404)
+        return view(*args, **kwargs)
+    return wrapped
+
+
+@profiling.route("/")
+@admin_required
+def list_profiles():
+    captures = list_captures(current_app.config["PROFILER_DIR"])
+    return render_template("admin_profiles.html", captures=captures)
+
+
+@profiling.route("/<capture_id>.<any(collapsed, 'speedscope.json'):kind>")
+@admin_required
+def download_profile(capture_id, kind):
+    return send_from_directory(
+        current_app.config["PROFILER_DIR"], f"{capture_id}.{kind}", as_attachment=True
+    )
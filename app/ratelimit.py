@@ -0,0 +1,203 @@
+"""Request throttling and admission control.
+
+``rate_limit`` applies a sliding-window limit keyed by user (or client IP
+when anonymous) and endpoint. Counters live in a pluggable backend:
+
+* ``MemoryBackend`` keeps them in-process. It is the default and the stand-in
+  used in tests (pass ``clock`` to control time).
+* ``DatabaseBackend`` keeps them in the ``rate_limit_counter`` table so every
+  gunicorn worker sees the same counts. A background thread deletes old
+  windows every ``RATELIMIT_PRUNE_SECONDS``.
+
+``concurrency_limit`` caps how many requests may run an endpoint at once in
+a worker; extra requests get a 429 straight away instead of queueing.
+
+Both reply with ``429 Too Many Requests`` and a ``Retry-After`` header.
+"""
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, request
+from flask_login import current_user
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import TooManyRequests
+
+from app import db
+from app.background import PeriodicTask, start_with_requests
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+# A window is read as the "previous" one until two of its periods have
+# passed; older rows matter to no limit, whatever its period
+PRUNE_AFTER = 2 * max(PERIODS.values())
+
+
+def parse_limit(spec):
+    """``"5/minute"`` -> ``(5, 60)``."""
+    count, _, period = spec.partition("/")
+    return int(count), PERIODS[period.strip().rstrip("s")]
+
+
+# =========================
+# BACKENDS
+# =========================
+class RateLimitBackend:
+    """Fixed-window counters; ``incr`` returns (current, previous) window counts."""
+
+    def incr(self, key, window_start, period):
+        raise NotImplementedError
+
+
+class MemoryBackend(RateLimitBackend):
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def incr(self, key, window_start, period):
+        with self._lock:
+            start, current, previous = self._counters.get(key, (window_start, 0, 0))
+            if start != window_start:
+                previous = current if start == window_start - period else 0
+                current = 0
+            current += 1
+            self._counters[key] = (window_start, current, previous)
+            if len(self._counters) > self.max_keys:
+                self._prune(window_start - period)
+            return current, previous
+
+    def _prune(self, oldest):
+        for key in [k for k, (start, _, _) in self._counters.items() if start < oldest]:
+            del self._counters[key]
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+class DatabaseBackend(RateLimitBackend):
+    """Counters shared by all workers through the application database.
+
+    ``incr`` drops old windows of the key it counts. Keys that never come
+    back, such as one-off anonymous IPs, are left to ``prune``.
+    """
+
+    def incr(self, key, window_start, period):
+        from app.models import RateLimitCounter
+        table = RateLimitCounter.__table__
+        match = (table.c.key == key) & (table.c.window_start == window_start)
+
+        # Own short transaction so the caller's session is left untouched
+        with db.engine.begin() as conn:
+            bumped = conn.execute(
+                table.update().where(match).values(count=table.c.count + 1)
+            ).rowcount
+            if not bumped:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(table.insert().values(key=key, window_start=window_start, count=1))
+                    conn.execute(table.delete().where(
+                        (table.c.key == key) & (table.c.window_start < window_start - period)
+                    ))
+                except IntegrityError:
+                    conn.execute(table.update().where(match).values(count=table.c.count + 1))
+            rows = dict(conn.execute(
+                db.select(table.c.window_start, table.c.count).where(
+                    (table.c.key == key) & (table.c.window_start >= window_start - period)
+                )
+            ).all())
+        return rows.get(window_start, 1), rows.get(window_start - period, 0)
+
+    def prune(self, now):
+        """Delete every key's windows that started before ``now - PRUNE_AFTER``."""
+        from app.models import RateLimitCounter
+        table = RateLimitCounter.__table__
+        with db.engine.begin() as conn:
+            return conn.execute(table.delete().where(table.c.window_start < now - PRUNE_AFTER)).rowcount
+
+
+# =========================
+# LIMITER
+# =========================
+class RateLimiter:
+    def __init__(self, backend=None, clock=time.time):
+        self.backend = backend or MemoryBackend()
+        self.clock = clock
+
+    def hit(self, key, limit, period):
+        """Count one hit; returns ``(allowed, retry_after_seconds)``.
+
+        Uses the sliding-window estimate: the previous window's count weighted
+        by how much of it still overlaps the last ``period`` seconds, plus
+        the current window's count.
+        """
+        now = self.clock()
+        window_start = int(now // period) * period
+        elapsed = now - window_start
+        current, previous = self.backend.incr(key, window_start, period)
+
+        estimate = previous * (period - elapsed) / period + current
+        if estimate <= limit:
+            return True, 0
+        if current > limit or not previous:
+            return False, max(1, math.ceil(period - elapsed))
+        # Wait until enough of the previous window has slid out
+        free_at = period * (1 - (limit - current) / previous)
+        return False, max(1, math.ceil(free_at - elapsed))
+
+
+def init_app(app):
+    storage = app.config.get("RATELIMIT_STORAGE", "memory")
+    backend = DatabaseBackend() if storage == "database" else MemoryBackend()
+    limiter = app.extensions["rate_limiter"] = RateLimiter(backend)
+    if storage == "database":
+        start_with_requests(app, PeriodicTask(
+            "ratelimit-prune", app.config["RATELIMIT_PRUNE_SECONDS"], lambda: backend.prune(limiter.clock())
+        ))
+
+
+def _client_key(by):
+    if by == "user" and current_user.is_authenticated:
+        return f"user:{current_user.id}"
+    return f"ip:{request.remote_addr}"
+
+
+def rate_limit(spec, by="user", methods=("POST",)):
+    """Limit an endpoint to ``spec`` (e.g. ``"10/minute"``) per client.
+
+    Only requests whose method is in ``methods`` are counted, so rendering a
+    form stays free while submitting it is throttled.
+    """
+    limit, period = parse_limit(spec)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method in methods and current_app.config.get("RATELIMIT_ENABLED", True):
+                key = f"{request.endpoint}:{_client_key(by)}"
+                allowed, retry_after = current_app.extensions["rate_limiter"].hit(key, limit, period)
+                if not allowed:
+                    raise TooManyRequests(retry_after=retry_after)
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+def concurrency_limit(max_active, methods=("POST",), retry_after=1):
+    """Allow at most ``max_active`` concurrent requests to an endpoint per worker."""
+    slots = threading.BoundedSemaphore(max_active)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if request.method not in methods:
+                return view(*args, **kwargs)
+            if not slots.acquire(blocking=False):
+                raise TooManyRequests(retry_after=retry_after)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                slots.release()
+        return wrapped
+    return decorator
@@ -0,0 +1,128 @@
+"""Lightweight rows for list pages.
+
+List pages show a few columns of many rows. Loaded as ORM entities, each
+row also gets instance state, an identity-map entry and relationship
+proxies, and brings every column along, Text ones such as
+``description`` and ``about`` included. The named tuples here hold only
+what the templates show and are filled from column-only ``select()``
+queries. They have no ``__dict__`` and nothing to lazy-load, and the
+session never tracks them.
+
+They are read-only: views that change rows still load entities.
+"""
+from collections import namedtuple
+
+from app import db
+from app.models import Category, Message, Product, SellerProfile, User
+
+ProductCard = namedtuple("ProductCard", "id name price stock_quantity seller_id")
+SellerCard = namedtuple("SellerCard", "id username shop_logo")
+CategoryOption = namedtuple("CategoryOption", "id name parent_id")
+BuyerRef = namedtuple("BuyerRef", "id username")
+# Inbox rows: a seller sees who wrote about each product, a buyer the
+# latest message about each product
+SellerThread = namedtuple("SellerThread", "product buyers unread_messages_count")
+BuyerThread = namedtuple("BuyerThread", "product last_message timestamp")
+
+# Columns behind each row type, in field order
+PRODUCT_CARD = (Product.id, Product.name, Product.price, Product.stock_quantity, Product.seller_id)
+SELLER_CARD = (User.id, User.username, SellerProfile.shop_logo)
+CATEGORY_OPTION = (Category.id, Category.name, Category.parent_id)
+
+
+def fetch(row_type, statement):
+    """``[row_type]`` from the rows of ``statement``."""
+    return list(map(row_type._make, db.session.execute(statement)))
+
+
+def product_cards(*criteria):
+    """``[ProductCard]`` matching ``criteria``, in id order."""
+    return fetch(ProductCard, db.select(*PRODUCT_CARD).where(*criteria).order_by(Product.id))
+
+
+def category_options(seller_id):
+    return fetch(
+        CategoryOption,
+        db.select(*CATEGORY_OPTION).where(Category.seller_id == seller_id).order_by(Category.id)
+    )
+
+
+def seller_cards():
+    """Select of ``SellerCard`` columns; add filters and ordering, then ``fetch``."""
+    return db.select(*SELLER_CARD).outerjoin(SellerProfile, SellerProfile.user_id == User.id)
+
+
+def seller_card(user_id):
+    """The ``SellerCard`` of ``user_id``, or ``None``."""
+    rows = fetch(SellerCard, seller_cards().where(User.id == user_id))
+    return rows[0] if rows else None
+
+
+def usernames(user_ids):
+    """``{user_id: username}``."""
+    if not user_ids:
+        return {}
+    return dict(db.session.execute(db.select(User.id, User.username).where(User.id.in_(user_ids))).all())
+
+
+# =========================
+# INBOX
+# =========================
+def seller_threads(seller_id):
+    """``[SellerThread]`` of the seller's products that buyers wrote about.
+
+    Buyers are listed latest message first. Three queries whatever the
+    number of products or messages.
+    """
+    writers = db.session.execute(
+        db.select(Message.product_id, User.id, User.username)
+        .join(User, User.id == Message.sender_id)
+        .join(Product, Product.id == Message.product_id)
+        .where(Product.seller_id == seller_id, Message.sender_id != seller_id)
+        .group_by(Message.product_id, User.id, User.username)
+        .order_by(db.func.max(Message.timestamp).desc())
+    )
+    buyers = {}
+    for product_id, user_id, username in writers:
+        buyers.setdefault(product_id, []).append(BuyerRef(user_id, username))
+    if not buyers:
+        return []
+
+    unread = dict(db.session.execute(
+        db.select(Message.product_id, db.func.count(Message.id))
+        .where(
+            Message.receiver_id == seller_id, Message.is_read.is_(False),
+            Message.product_id.in_(buyers),
+        )
+        .group_by(Message.product_id)
+    ).all())
+    return [
+        SellerThread(product, buyers[product.id], unread.get(product.id, 0))
+        for product in product_cards(Product.id.in_(buyers))
+    ]
+
+
+def buyer_threads(user_id):
+    """``[BuyerThread]``, one per product the user has messages about, latest first."""
+    ranked = (
+        db.select(
+            Message.id,
+            db.func.row_number().over(
+                partition_by=Message.product_id,
+                order_by=(Message.timestamp.desc(), Message.id.desc()),
+            ).label("rank"),
+        )
+        .where((Message.sender_id == user_id) | (Message.receiver_id == user_id))
+        .where(Message.product_id.isnot(None))
+        .subquery()
+    )
+    rows = db.session.execute(
+        db.select(*PRODUCT_CARD, Message.content, Message.timestamp)
+        .select_from(Message)
+        .join(ranked, ranked.c.id == Message.id)
+        .join(Product, Product.id == Message.product_id)
+        .where(ranked.c.rank == 1)
+        .order_by(Message.timestamp.desc())
+    )
+    width = len(PRODUCT_CARD)
+    return [BuyerThread(ProductCard._make(row[:width]), *row[width:]) for row in rows]
@@ -0,0 +1,251 @@
+"""Precomputed "related products".
+
+``flask related build`` turns every product into a TF-IDF vector over its
+name, description, size and category. It stores each product's top-k
+cosine neighbours in ``related_products``, so ``product_detail`` needs one
+indexed lookup.
+
+Runs are incremental. A fingerprint of each product's text is kept in
+``related_product_state``, and only these products are recomputed:
+
+* products whose text changed, and new products;
+* products whose stored list mentions a changed or deleted product;
+* products that a changed product now beats their weakest neighbour.
+
+IDF weights are refreshed on every run, but unchanged lists are not
+re-scored for that drift; use ``--full`` to rebuild everything.
+"""
+import re
+import time
+import zlib
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from scipy import sparse
+
+from app import db
+from app.models import Category, Product, RelatedProduct, RelatedProductState
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+MIN_DOCS_FOR_MAX_DF = 100
+
+
+# =========================
+# VECTORISING
+# =========================
+def document_tokens(name, description, size_unit, category):
+    """Tokens for one product; the name counts twice, size and category are tagged."""
+    name_tokens = TOKEN_RE.findall((name or "").lower())
+    tokens = name_tokens + name_tokens + TOKEN_RE.findall((description or "").lower())
+    tokens += ["size:" + t for t in TOKEN_RE.findall((size_unit or "").lower())]
+    if category:
+        tokens.append("cat:" + "_".join(TOKEN_RE.findall(category.lower())))
+    return tokens
+
+
+def build_matrix(token_lists, max_df=0.3):
+    """L2-normalised TF-IDF matrix (CSR, float32), one row per token list.
+
+    Terms found in more than ``max_df`` of the documents carry little signal
+    and make the similarity product dense, so they are dropped once the
+    catalogue has at least ``MIN_DOCS_FOR_MAX_DF`` products.
+    """
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    for tokens in token_lists:
+        indices.extend(vocabulary.setdefault(t, len(vocabulary)) for t in tokens)
+        indptr.append(len(indices))
+
+    n_docs = len(indptr) - 1
+    indices = np.asarray(indices, dtype=np.int32)
+    counts = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), indices, np.asarray(indptr, dtype=np.int64)),
+        shape=(n_docs, max(len(vocabulary), 1)),
+    )
+    counts.sum_duplicates()
+
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = (np.log((1 + n_docs) / (1 + df)) + 1).astype(np.float32)
+    if n_docs >= MIN_DOCS_FOR_MAX_DF:
+        idf[df > max_df * n_docs] = 0
+
+    matrix = counts.multiply(idf).tocsr()
+    matrix.eliminate_zeros()
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms).dot(matrix).astype(np.float32).tocsr()
+
+
+def candidate_index(matrix, max_postings=1000):
+    """Term -> product postings (CSR, terms x products), keeping only the
+    ``max_postings`` heaviest entries of each term.
+
+    Without the cap a term shared by most of the catalogue makes every
+    product a candidate for every other one, which is quadratic. With it,
+    each product is scored against at most ``terms x max_postings`` others.
+    """
+    postings = matrix.T.tocsr()
+    lengths = np.diff(postings.indptr)
+    for term in np.flatnonzero(lengths > max_postings):
+        lo, hi = postings.indptr[term], postings.indptr[term + 1]
+        weights = postings.data[lo:hi]
+        weights[np.argpartition(-weights, max_postings)[max_postings:]] = 0
+    postings.eliminate_zeros()
+    return postings
+
+
+def top_k(matrix, rows, k, batch_size=512, postings=None):
+    """Yield ``(row, neighbour_rows, scores)`` for each requested row.
+
+    Similarities are computed a batch of rows at a time as one sparse
+    product against ``postings`` (see ``candidate_index``); only non-zero
+    scores are ever materialised.
+    """
+    transposed = postings if postings is not None else candidate_index(matrix)
+    rows = np.asarray(rows, dtype=np.int64)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        scores = (matrix[batch] @ transposed).tocsr()
+        for offset, row in enumerate(batch):
+            lo, hi = scores.indptr[offset], scores.indptr[offset + 1]
+            cols, vals = scores.indices[lo:hi], scores.data[lo:hi]
+            keep = cols != row
+            cols, vals = cols[keep], vals[keep]
+            if len(vals) > k:
+                best = np.argpartition(-vals, k)[:k]
+                cols, vals = cols[best], vals[best]
+            order = np.argsort(-vals, kind="stable")
+            yield row, cols[order], vals[order]
+
+
+# =========================
+# BUILD
+# =========================
+def _load_catalogue():
+    rows = (
+        db.session.query(
+            Product.id, Product.name, Product.description, Product.size_unit, Category.name
+        )
+        .outerjoin(Category, Category.id == Product.category_id)
+        .order_by(Product.id)
+        .yield_per(5000)
+    )
+    ids, token_lists, fingerprints = [], [], []
+    for product_id, name, description, size_unit, category in rows:
+        tokens = document_tokens(name, description, size_unit, category)
+        ids.append(product_id)
+        token_lists.append(tokens)
+        fingerprints.append(zlib.crc32(" ".join(tokens).encode("utf-8")))
+    return np.asarray(ids, dtype=np.int64), token_lists, fingerprints
+
+
+def _affected_rows(matrix, postings, ids, fingerprints, k, batch_size):
+    """Rows needing a new neighbour list, plus the ids of deleted products."""
+    stored = dict(db.session.query(RelatedProductState.product_id, RelatedProductState.fingerprint))
+    row_of = {int(pid): row for row, pid in enumerate(ids)}
+    changed = [
+        row for row, (pid, fp) in enumerate(zip(ids, fingerprints))
+        if stored.get(int(pid)) != fp
+    ]
+    deleted = set(stored) - set(row_of)
+    if not changed and not deleted:
+        return set(), deleted
+
+    affected = set(changed)
+
+    # Lists that mention a changed or deleted product
+    stale = [int(ids[row]) for row in changed] + list(deleted)
+    for start in range(0, len(stale), 1000):
+        affected.update(
+            row_of[pid] for (pid,) in db.session.query(RelatedProduct.product_id)
+            .filter(RelatedProduct.related_id.in_(stale[start:start + 1000]))
+            .distinct()
+            if pid in row_of
+        )
+
+    # Lists a changed product would now break into
+    list_size = np.zeros(len(ids), dtype=np.int32)
+    weakest = np.full(len(ids), np.inf, dtype=np.float32)
+    for pid, count, low in db.session.query(
+        RelatedProduct.product_id, db.func.count(), db.func.min(RelatedProduct.score)
+    ).group_by(RelatedProduct.product_id):
+        if pid in row_of:
+            list_size[row_of[pid]], weakest[row_of[pid]] = count, low
+
+    changed_rows = np.asarray(changed, dtype=np.int64)
+    for start in range(0, len(changed_rows), batch_size):
+        scores = (matrix[changed_rows[start:start + batch_size]] @ postings).tocoo()
+        beats = (list_size[scores.col] < k) | (scores.data > weakest[scores.col])
+        affected.update(scores.col[beats].tolist())
+    return affected, deleted
+
+
+def build_related(k=None, full=False, batch_size=512, max_df=0.3):
+    """Refresh ``related_products``; returns how many products were recomputed."""
+    k = k or current_app.config["RELATED_PRODUCTS_K"]
+    ids, token_lists, fingerprints = _load_catalogue()
+    matrix = build_matrix(token_lists, max_df=max_df)
+    postings = candidate_index(matrix)
+    del token_lists
+
+    if full:
+        affected = set(range(len(ids)))
+        deleted = {pid for (pid,) in db.session.query(RelatedProductState.product_id)} - set(ids.tolist())
+    else:
+        affected, deleted = _affected_rows(matrix, postings, ids, fingerprints, k, batch_size)
+
+    if deleted:
+        deleted = list(deleted)
+        RelatedProduct.query.filter(
+            RelatedProduct.product_id.in_(deleted) | RelatedProduct.related_id.in_(deleted)
+        ).delete(synchronize_session=False)
+        RelatedProductState.query.filter(
+            RelatedProductState.product_id.in_(deleted)
+        ).delete(synchronize_session=False)
+
+    rows = sorted(affected)
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        batch_ids = [int(ids[row]) for row in batch]
+        RelatedProduct.query.filter(
+            RelatedProduct.product_id.in_(batch_ids)
+        ).delete(synchronize_session=False)
+        RelatedProductState.query.filter(
+            RelatedProductState.product_id.in_(batch_ids)
+        ).delete(synchronize_session=False)
+
+        related = []
+        for row, neighbours, scores in top_k(matrix, batch, k, batch_size=batch_size, postings=postings):
+            related.extend(
+                {"product_id": int(ids[row]), "related_id": int(ids[n]), "rank": rank, "score": float(s)}
+                for rank, (n, s) in enumerate(zip(neighbours, scores))
+            )
+        if related:
+            db.session.execute(RelatedProduct.__table__.insert(), related)
+        db.session.execute(RelatedProductState.__table__.insert(), [
+            {"product_id": int(ids[row]), "fingerprint": fingerprints[row]} for row in batch
+        ])
+        db.session.commit()
+
+    db.session.commit()
+    return len(rows)
+
+
+# =========================
+# CLI
+# =========================
+related_cli = AppGroup("related", help="Related products index.")
+
+
+@related_cli.command("build")
+@click.option("--full", is_flag=True, help="Recompute every product, not just changed ones.")
+@click.option("--k", type=int, default=None, help="Neighbours per product (defaults to RELATED_PRODUCTS_K).")
+@click.option("--batch-size", type=int, default=512, show_default=True)
+def build_command(full, k, batch_size):
+    """Build or incrementally refresh the related products index."""
+    started = time.perf_counter()
+    count = build_related(k=k, full=full, batch_size=batch_size)
+    click.echo(f"Recomputed {count} product(s) in {time.perf_counter() - started:.1f}s.")
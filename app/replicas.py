@@ -0,0 +1,148 @@
+"""Read-replica routing for the default database.
+
+Replica URLs come from ``SQLALCHEMY_REPLICA_URIS`` and are registered as
+extra binds (``replica_0``, ``replica_1``, ...). ``RoutingSession`` sends
+SELECTs made during a GET/HEAD request to a healthy replica and everything
+else to the primary:
+
+* a request reads from one replica throughout, picked on its first read,
+  so a page never mixes rows from replicas with different lag; if that
+  replica fails, the rest of the request reads from the primary;
+
+* any flush or INSERT/UPDATE/DELETE pins the rest of the request to the
+  primary;
+* after a request that wrote, the client reads from the primary for
+  ``READ_YOUR_WRITES_SECONDS`` so it sees its own changes;
+* replicas are pinged at most every ``REPLICA_HEALTH_INTERVAL`` seconds and
+  skipped for ``REPLICA_RETRY_SECONDS`` after a failure. With no healthy
+  replica, reads fall back to the primary.
+
+Without replicas configured the session behaves exactly like the stock one.
+"""
+import random
+import threading
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+
+REPLICA_PREFIX = "replica_"
+READ_METHODS = ("GET", "HEAD")
+
+
+def replica_binds(uris):
+    return {f"{REPLICA_PREFIX}{i}": uri for i, uri in enumerate(uris)}
+
+
+# =========================
+# HEALTH
+# =========================
+class ReplicaPool:
+    def __init__(self, engines, health_interval=10, retry_after=30):
+        self.engines = engines  # {bind_key: engine}
+        self.health_interval = health_interval
+        self.retry_after = retry_after
+        self._checked_at = {}
+        self._down_until = {}
+        self._lock = threading.Lock()
+        for key, engine in engines.items():
+            event.listen(engine, "handle_error", self._on_error(key))
+
+    def _on_error(self, key):
+        def handle_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.mark_down(key)
+        return handle_error
+
+    def mark_down(self, key):
+        with self._lock:
+            self._down_until[key] = time.monotonic() + self.retry_after
+
+    def _ping(self, key):
+        try:
+            with self.engines[key].connect() as conn:
+                conn.execute(text("SELECT 1"))
+        except Exception:
+            self.mark_down(key)
+            return False
+        return True
+
+    def is_down(self, key):
+        return self._down_until.get(key, 0) > time.monotonic()
+
+    def is_healthy(self, key):
+        now = time.monotonic()
+        if self._down_until.get(key, 0) > now:
+            return False
+        if now - self._checked_at.get(key, float("-inf")) >= self.health_interval:
+            self._checked_at[key] = now
+            return self._ping(key)
+        return True
+
+    def choose(self):
+        """Bind key of a healthy replica, or ``None``."""
+        healthy = [key for key in self.engines if self.is_healthy(key)]
+        return random.choice(healthy) if healthy else None
+
+    def status(self):
+        now = time.monotonic()
+        return {key: self._down_until.get(key, 0) <= now for key in self.engines}
+
+
+# =========================
+# SESSION
+# =========================
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or not has_request_context():
+            return engine
+
+        if self._flushing or (clause is not None and not getattr(clause, "is_select", False)):
+            g.db_wrote = True
+            return engine
+        if clause is None:
+            return engine
+
+        pool = current_app.extensions.get("replica_pool")
+        if (
+            pool is None
+            or not g.get("read_replica", False)
+            or g.get("db_wrote", False)
+            or engine is not self._db.engines[None]
+        ):
+            return engine
+        if "replica" not in g:
+            g.replica = pool.choose()
+        if g.replica is None or pool.is_down(g.replica):
+            return engine
+        return pool.engines[g.replica]
+
+
+def init_app(app, db):
+    """Wire up replica routing; call after ``db.init_app``."""
+    uris = app.config.get("SQLALCHEMY_REPLICA_URIS") or []
+    if not uris:
+        return
+
+    with app.app_context():
+        engines = {key: db.engines[key] for key in replica_binds(uris)}
+    app.extensions["replica_pool"] = ReplicaPool(
+        engines,
+        health_interval=app.config["REPLICA_HEALTH_INTERVAL"],
+        retry_after=app.config["REPLICA_RETRY_SECONDS"],
+    )
+
+    @app.before_request
+    def choose_read_target():
+        g.read_replica = (
+            request.method in READ_METHODS
+            and session.get("primary_until", 0) < time.time()
+        )
+
+    @app.after_request
+    def remember_write(response):
+        if g.get("db_wrote", False):
+            session["primary_until"] = time.time() + app.config["READ_YOUR_WRITES_SECONDS"]
+        return response
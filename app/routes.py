@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, abort
 from flask_login import current_user, login_user, logout_user, login_required
 from werkzeug.datastructures import FileStorage
 
@@ -8,43 +8,79 @@ from app import db
 from app.forms import (
     ForgotPasswordForm, BuyerProfileForm, ResetPasswordForm,
     LoginForm, RegisterForm, SellerProfileForm, ProductForm,
-    CategoryForm, MessageForm
+    CategoryForm, MessageForm, BulkProductForm
 )
 from app.models import (
     User, SellerProfile, BuyerProfile, SellerImage,
-    Category, Product, ProductImage, Message
+    Category, Product, ProductImage, Message, RelatedProduct, TrendingScore
+)
+from app.message_store import load_conversation, archived_conversations
+from app.media import MediaUnavailable, upload_to_cloudinary, schedule_cloudinary_delete
+from app.ratelimit import rate_limit, concurrency_limit
+from app.email import queue_password_reset, queue_new_message_notification
+from app.analytics import record_product_view, seller_summary
+from app.metrics import MESSAGES_SENT, PRODUCTS_ADDED
+from app.geo import get_gazetteer, locate_profile, nearby_sellers
+from app.trending import seller_score, trending_products
+from app.facets import seller_facets
+from app.read_models import (
+    SellerCard, SellerThread, BuyerRef, BuyerThread, fetch, product_cards, category_options,
+    seller_cards, seller_card, usernames, seller_threads, buyer_threads
+)
+from app.bulk import (
+    parse_ids, parse_changes, update_products, delete_products, move_category_products
+)
+from app.variants import (
+    format_variants, in_stock_product_ids, parse_size_unit, replace_variants
 )
 from urllib.parse import urlparse
 from datetime import datetime, timedelta
-import cloudinary.uploader
-
 main = Blueprint("main", __name__)
 
+# Shown when Cloudinary is down (see app/media.py); the rest of the form is still saved
+IMAGES_NOT_SAVED = "Images could not be uploaded right now. Your other changes were saved; please add the images again later."
+
+
 # =========================
-# CLOUDINARY HELPERS
+# VIEW DATA
 # =========================
-from cloudinary.exceptions import NotFound
-
-def upload_to_cloudinary(file, folder, public_id):
-    if isinstance(file, str):
-        raise ValueError("Cannot upload a URL string. Must be a file object.")
-    result = cloudinary.uploader.upload(
-        file,
-        folder=folder,
-        public_id=public_id,
-        overwrite=True
+# Templates never query (see TEMPLATE_STRICT_QUERIES); list pages load
+# what they show with these, one query per page.
+def _cover_images(product_ids):
+    """``{product_id: url}`` of each product's first image."""
+    if not product_ids:
+        return {}
+    first = (
+        db.session.query(db.func.min(ProductImage.id))
+        .filter(ProductImage.product_id.in_(product_ids))
+        .group_by(ProductImage.product_id)
+    )
+    return dict(
+        db.session.query(ProductImage.product_id, ProductImage.image_url)
+        .filter(ProductImage.id.in_(first))
     )
-    return result['public_id'], result['secure_url']
 
 
-# DELETE IMAGE FROM CLOUDINARY
-def delete_from_cloudinary(public_id):
-    if not public_id:
-        return
-    try:
-        cloudinary.uploader.destroy(public_id)
-    except NotFound:
-        pass
+def _render_and_commit(template, **context):
+    """Render, then commit writes made while preparing the page.
+
+    Committing first would expire every loaded row, current_user
+    included, and the template would reload them one query at a time.
+    """
+    html = render_template(template, **context)
+    db.session.commit()
+    return html
+
+
+def _product_counts(seller_ids):
+    """``{seller_id: number of products}``."""
+    if not seller_ids:
+        return {}
+    return dict(
+        db.session.query(Product.seller_id, db.func.count(Product.id))
+        .filter(Product.seller_id.in_(seller_ids))
+        .group_by(Product.seller_id)
+    )
 
 # =========================
 # AUTH / PUBLIC
@@ -62,6 +98,8 @@ def index():
     return render_template("index.html")
 
 @main.route("/login", methods=["GET", "POST"])
+@rate_limit("10/minute", by="ip")
+@concurrency_limit(4)
 def login():
     if current_user.is_authenticated:
         return redirect(url_for("main.index"))
@@ -86,6 +124,8 @@ def login():
     return render_template("login.html", form=form)
 
 @main.route("/register", methods=["GET", "POST"])
+@rate_limit("10/hour", by="ip")
+@concurrency_limit(4)
 def register():
     if current_user.is_authenticated:
         return redirect(url_for("main.index"))
@@ -127,27 +167,112 @@ def seller_dashboard():
         flash("Access denied", "danger")
         return redirect(url_for("main.index"))
 
-    products = Product.query.filter_by(seller_id=current_user.id).all()
-    categories = Category.query.filter_by(seller_id=current_user.id).all()
+    products = product_cards(Product.seller_id == current_user.id)
+    categories = category_options(current_user.id)
 
     form = CategoryForm()
     form.parent_id.choices = [(0, "No parent")] + [(c.id, c.name) for c in categories]
 
+    bulk_form = BulkProductForm()
+    bulk_form.category_id.choices = [(0, "Keep category")] + [(c.id, c.name) for c in categories]
+
     return render_template(
         "seller_dashboard.html",
         products=products,
         categories=categories,
+        stats=seller_summary(current_user.id),
         form=form,
-        category_form=form
+        category_form=form,
+        bulk_form=bulk_form,
+        covers=_cover_images([p.id for p in products])
     )
 
 
+# ------------------------- BULK PRODUCT CHANGES -------------------------
+def _bulk_change(action, ids, **changes):
+    """Run one bulk action on the current seller's products; returns the count."""
+    if action == "delete":
+        return delete_products(current_user.id, ids)
+    if action == "update":
+        return update_products(current_user.id, ids, **changes)
+    raise ValueError("Unknown action.")
+
+
+@main.route("/seller/products/bulk", methods=["POST"])
+@login_required
+@rate_limit("60/hour")
+def bulk_products():
+    if current_user.role != "seller":
+        flash("Access denied", "danger")
+        return redirect(url_for("main.index"))
+
+    form = BulkProductForm()
+    form.category_id.choices = [(0, "Keep category")] + [
+        (c.id, c.name) for c in Category.query.filter_by(seller_id=current_user.id)
+    ]
+    if not form.validate_on_submit():
+        for errors in form.errors.values():
+            flash(errors[0], "danger")
+        return redirect(url_for("main.seller_dashboard"))
+
+    try:
+        count = _bulk_change(
+            form.action.data,
+            parse_ids(form.product_ids.data),
+            price=form.price.data,
+            price_percent=form.price_percent.data,
+            stock_quantity=form.stock_quantity.data,
+            category_id=form.category_id.data or None,
+        )
+    except ValueError as exc:
+        db.session.rollback()
+        flash(str(exc), "danger")
+        return redirect(url_for("main.seller_dashboard"))
+
+    db.session.commit()
+    verb = "deleted" if form.action.data == "delete" else "updated"
+    flash(f"{count} product{'s' if count != 1 else ''} {verb}.", "success")
+    return redirect(url_for("main.seller_dashboard"))
+
+
+@main.route("/seller/products/bulk.json", methods=["POST"])
+@login_required
+@rate_limit("60/hour")
+def bulk_products_api():
+    """``{"action": "update"|"delete", "ids": [...], "price": ..., ...}``
+
+    Update fields: ``price``, ``price_percent``, ``stock_quantity``,
+    ``category_id``. Responds with how many of the ids were changed; ids
+    the seller does not own are not counted.
+    """
+    if current_user.role != "seller":
+        return jsonify(error="Access denied."), 403
+    # Requiring a JSON body keeps plain cross-site form posts out
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify(error="Expected a JSON object."), 400
+
+    action = data.get("action")
+    try:
+        ids = parse_ids(data.get("ids"))
+        changes = parse_changes(data) if action == "update" else {}
+        count = _bulk_change(action, ids, **changes)
+    except ValueError as exc:
+        db.session.rollback()
+        return jsonify(error=str(exc)), 400
+
+    db.session.commit()
+    return jsonify(action=action, requested=len(ids), affected=count)
+
+
 
 # =========================
 # PRODUCT (CLOUDINARY)
 # =========================
 @main.route("/seller/product/add", methods=["GET", "POST"])
 @login_required
+@rate_limit("30/hour")
+@concurrency_limit(4)
 def add_product():
     if current_user.role != "seller":
         flash("Access denied", "danger")
@@ -160,7 +285,7 @@ def add_product():
     if not categories:
         uncategorized = Category(name="Uncategorized", seller_id=current_user.id)
         db.session.add(uncategorized)
-        db.session.commit()
+        db.session.flush()
         categories = [uncategorized]
 
     form.category_id.choices = [(c.id, c.name) for c in categories]
@@ -183,35 +308,42 @@ def add_product():
             category_id=form.category_id.data
         )
         db.session.add(product)
-        db.session.commit()  # Commit to get product.id
+        db.session.flush()  # Get product.id
+        if form.parsed_variants:
+            replace_variants(product, form.parsed_variants)
+        db.session.commit()
 
         # Upload images to Cloudinary
-        for i, field in enumerate(image_fields):
-            file = field.data
-            if isinstance(file, FileStorage) and file.filename:
-                # Create a unique public_id per image
-                public_id = f"product_{product.id}_{i+1}"
-
-                pid, url = upload_to_cloudinary(
-                    file=file,
-                    folder=f"products/{product.id}",
-                    public_id=public_id
-                )
+        try:
+            for i, field in enumerate(image_fields):
+                file = field.data
+                if isinstance(file, FileStorage) and file.filename:
+                    # Create a unique public_id per image
+                    public_id = f"product_{product.id}_{i+1}"
+
+                    pid, url = upload_to_cloudinary(
+                        file=file,
+                        folder=f"products/{product.id}",
+                        public_id=public_id
+                    )
 
-                # Save image record in DB
-                db.session.add(
-                    ProductImage(
-                        product_id=product.id,
-                        image_url=url,
-                        public_id=pid
+                    # Save image record in DB
+                    db.session.add(
+                        ProductImage(
+                            product_id=product.id,
+                            image_url=url,
+                            public_id=pid
+                        )
                     )
-                )
+        except MediaUnavailable:
+            flash(IMAGES_NOT_SAVED, "warning")
 
         db.session.commit()
+        PRODUCTS_ADDED.inc()
         flash("Product added successfully", "success")
         return redirect(url_for("main.seller_dashboard"))
 
-    return render_template(
+    return _render_and_commit(
         "add_product.html",
         form=form,
         product_image_fields=image_fields
@@ -221,6 +353,8 @@ def add_product():
 @main.route("/seller/profile/", defaults={"user_id": None}, methods=["GET", "POST"])
 @main.route("/seller/profile/<int:user_id>", methods=["GET", "POST"])
 @login_required
+@rate_limit("30/hour")
+@concurrency_limit(4)
 def seller_profile(user_id):
     # If no user_id is provided, assume current seller wants their own profile
     if user_id is None:
@@ -251,37 +385,44 @@ def seller_profile(user_id):
         profile.shop_name = form.shop_name.data
         profile.about = form.about.data
         profile.phone_number = form.phone_number.data
-        profile.location = form.location.data
+        if form.location.data != profile.location or profile.geohash is None:
+            profile.location = form.location.data
+            locate_profile(profile)
         profile.open_hours = form.open_hours.data
 
-        # --- SHOP LOGO ---
-        file = request.files.get('shop_logo')
-        if file and file.filename:
-            public_id = f"sellers/logos/{uuid.uuid4().hex}"
-            pid, url = upload_to_cloudinary(file, folder="sellers/logos", public_id=public_id)
-            profile.shop_logo = url
-            profile.shop_logo_public_id = pid
-
-        # --- GALLERY IMAGES (4 slots) ---
-        for idx in range(4):
-            file_key = f'gallery_{idx}'
-            file = request.files.get(file_key)
+        try:
+            # --- SHOP LOGO ---
+            file = request.files.get('shop_logo')
             if file and file.filename:
-                public_id = f"sellers/gallery/{uuid.uuid4().hex}"
-                pid, url = upload_to_cloudinary(file, folder="sellers/gallery", public_id=public_id)
-
-                if gallery_images[idx]:
-                    # update existing image
-                    gallery_images[idx].image_url = url
-                    gallery_images[idx].public_id = pid
-                else:
-                    # create new image
-                    new_image = SellerImage(
-                        seller_profile_id=profile.id,
-                        image_url=url,
-                        public_id=pid
-                    )
-                    db.session.add(new_image)
+                public_id = f"sellers/logos/{uuid.uuid4().hex}"
+                pid, url = upload_to_cloudinary(file, folder="sellers/logos", public_id=public_id)
+                schedule_cloudinary_delete(profile.shop_logo_public_id)
+                profile.shop_logo = url
+                profile.shop_logo_public_id = pid
+
+            # --- GALLERY IMAGES (4 slots) ---
+            for idx in range(4):
+                file_key = f'gallery_{idx}'
+                file = request.files.get(file_key)
+                if file and file.filename:
+                    public_id = f"sellers/gallery/{uuid.uuid4().hex}"
+                    pid, url = upload_to_cloudinary(file, folder="sellers/gallery", public_id=public_id)
+
+                    if gallery_images[idx]:
+                        # update existing image; the old asset goes to the deletion outbox
+                        schedule_cloudinary_delete(gallery_images[idx].public_id)
+                        gallery_images[idx].image_url = url
+                        gallery_images[idx].public_id = pid
+                    else:
+                        # create new image
+                        new_image = SellerImage(
+                            seller_profile_id=profile.id,
+                            image_url=url,
+                            public_id=pid
+                        )
+                        db.session.add(new_image)
+        except MediaUnavailable:
+            flash(IMAGES_NOT_SAVED, "warning")
 
         db.session.commit()
         flash("Profile updated successfully", "success")
@@ -302,20 +443,57 @@ def seller_profile(user_id):
 @main.route('/buyers/sellers')
 @login_required
 def select_seller():
-    # Get sellers who have products in stock along with their profile (if exists)
-    sellers = (
-        db.session.query(User, SellerProfile)
-        .join(Product, Product.seller_id == User.id)
-        .outerjoin(SellerProfile, SellerProfile.user_id == User.id)
-        .filter(User.role == "seller")
-        .filter(Product.stock_quantity > 0)
-        .distinct(User.id)  # avoid duplicates if multiple products
-        .all()
+    near = request.args.get('near', '').strip()
+    if near:
+        coords = get_gazetteer().lookup(near)
+        if coords is None:
+            flash(f"Couldn't find '{near}'. Showing all sellers.", "warning")
+        else:
+            radius = min(
+                request.args.get('km', current_app.config['NEARBY_DEFAULT_KM'], type=float),
+                current_app.config['NEARBY_MAX_KM']
+            )
+            page = max(request.args.get('page', 1, type=int), 1)
+            per_page = current_app.config['NEARBY_PAGE_SIZE']
+            rows, total = nearby_sellers(*coords, radius, page=page, per_page=per_page)
+            return render_template(
+                'buyers_sellers.html',
+                sellers=[
+                    SellerCard(user.id, user.username, profile.shop_logo)
+                    for user, profile, _ in rows
+                ],
+                product_counts=_product_counts([user.id for user, _, _ in rows]),
+                distances={user.id: distance for user, _, distance in rows},
+                near=near, radius=radius, page=page, total=total,
+                has_next=page * per_page < total
+            )
+
+    # Get sellers who have products in stock along with their profile (if exists),
+    # most active first
+    in_stock = (
+        db.select(Product.id)
+        .where(Product.seller_id == User.id, Product.stock_quantity > 0)
+        .exists()
+    )
+    trending_join, trending_score = seller_score()
+    sellers = fetch(
+        SellerCard,
+        seller_cards()
+        .outerjoin(TrendingScore, trending_join)
+        .where(User.role == "seller", in_stock)
+        .order_by(trending_score.desc(), User.id)
+    )
+    trending = [product for product, _ in trending_products(current_app.config['TRENDING_FEED_SIZE'])]
+    return render_template(
+        'buyers_sellers.html', sellers=sellers,
+        product_counts=_product_counts([seller.id for seller in sellers]),
+        trending=trending, covers=_cover_images([p.id for p in trending])
     )
-    return render_template('buyers_sellers.html', sellers=sellers)
 
 @main.route("/buyer/profile", methods=["GET", "POST"])
 @login_required
+@rate_limit("30/hour")
+@concurrency_limit(4)
 def buyer_profile():
     if current_user.role != "buyer":
         flash("Access denied", "danger")
@@ -326,36 +504,43 @@ def buyer_profile():
     if not profile:
         profile = BuyerProfile(user_id=current_user.id)
         db.session.add(profile)
-        db.session.commit()
+        db.session.flush()
 
     form = BuyerProfileForm(obj=profile)
 
     if form.validate_on_submit():
-        # Update profile fields
+        # Update profile fields; populate_obj also copies the uploaded file
+        # object onto profile_image, so keep the stored URL until it is replaced
+        image_url = profile.profile_image
         form.populate_obj(profile)
+        profile.profile_image = image_url
 
         # Handle profile image upload
         if form.profile_image.data:
-            # Delete old image if exists
-            if profile.profile_image_public_id:
-                delete_from_cloudinary(profile.profile_image_public_id)
-
-            # Upload new image
-            pid, url = upload_to_cloudinary(
-                file=form.profile_image.data,
-                folder=f"buyers/{current_user.id}/profile",
-                public_id=f"profile_{current_user.id}"
-            )
+            old_public_id = profile.profile_image_public_id
+
+            try:
+                # Upload new image
+                pid, url = upload_to_cloudinary(
+                    file=form.profile_image.data,
+                    folder=f"buyers/{current_user.id}/profile",
+                    public_id=f"profile_{current_user.id}"
+                )
+            except MediaUnavailable:
+                flash(IMAGES_NOT_SAVED, "warning")
+            else:
+                # Drop the old image's reference; a re-upload of the same photo keeps it
+                schedule_cloudinary_delete(old_public_id)
 
-            profile.profile_image = url
-            profile.profile_image_public_id = pid
+                profile.profile_image = url
+                profile.profile_image_public_id = pid
 
         profile.user.last_seen = datetime.utcnow()
         db.session.commit()
         flash("Profile updated successfully ✅", "success")
         return redirect(url_for("main.buyer_profile"))
 
-    return render_template("buyer_profile.html", form=form, profile=profile)
+    return _render_and_commit("buyer_profile.html", form=form, profile=profile)
 
     
 @main.route('/cart')
@@ -373,34 +558,71 @@ def payment_method():
     
 @main.route('/buyers/seller/<int:seller_id>/products')
 def view_seller_products(seller_id):
-    seller = User.query.get_or_404(seller_id)
-    products = Product.query.filter_by(seller_id=seller_id).all()
-    categories = Category.query.filter_by(seller_id=seller_id).all()
-    return render_template('buyers_product.html', seller=seller, products=products, categories= categories)
+    seller = seller_card(seller_id)
+    if seller is None:
+        abort(404)
+    criteria = [Product.seller_id == seller_id]
+
+    # Optional "size X in stock under price Y" filter, answered from product_variant
+    size = request.args.get('size', '').strip()
+    max_price = request.args.get('max_price', type=float)
+    category_id = request.args.get('category', type=int)
+    parsed = parse_size_unit(size)[:1]
+    if parsed:
+        (size_system, size_value), = parsed
+        criteria.append(Product.id.in_(in_stock_product_ids(size_system, size_value, max_price)))
+    elif max_price is not None:
+        criteria.append(Product.price <= max_price)
+    if category_id is not None:
+        criteria.append(Product.category_id == category_id)
+
+    products = product_cards(*criteria)
+    categories = category_options(seller_id)
+    # Counts next to each filter value, from this worker's catalogue snapshot
+    facets = seller_facets(seller_id, size=parsed[0] if parsed else None, max_price=max_price, category_id=category_id)
+    return render_template(
+        'buyers_product.html', seller=seller, products=products, categories= categories,
+        covers=_cover_images([p.id for p in products]), facets=facets,
+        sizes=[pair for pair, _ in facets['sizes']], size=size, max_price=max_price, category_id=category_id
+    )
 
 
 @main.route('/product/<int:product_id>')
 def product_detail(product_id):
-    product = Product.query.get_or_404(product_id)
-    seller = User.query.get(product.seller_id)
+    product = Product.query.options(db.joinedload(Product.category)).get_or_404(product_id)
+    seller = User.query.options(db.joinedload(User.seller_profile)).get(product.seller_id)
     images = product.images.all()
 
     is_seller_view = (
         current_user.is_authenticated and 
         current_user.id == product.seller_id
     )
+    if not is_seller_view:
+        record_product_view(product)
+
+    # Precomputed neighbours: a single lookup on related_products' primary key
+    related = (
+        db.session.query(Product.id, Product.name, Product.price)
+        .join(RelatedProduct, RelatedProduct.related_id == Product.id)
+        .filter(RelatedProduct.product_id == product.id)
+        .filter(Product.stock_quantity > 0)
+        .order_by(RelatedProduct.rank)
+        .all()
+    )
 
     return render_template(
         'product_detail.html',
         product=product,
         seller=seller,
         images=images,
+        related=related,
         is_seller_view=is_seller_view
     )
 
 
 @main.route('/product/<int:product_id>/message', methods=['GET', 'POST'])
 @login_required
+@rate_limit("20/minute")
 def message_seller(product_id):
     product = Product.query.get_or_404(product_id)
 
@@ -421,7 +643,10 @@ def message_seller(product_id):
             content=form.content.data
         )
         db.session.add(msg)
+        db.session.flush()
+        queue_new_message_notification(msg, seller)
         db.session.commit()
+        MESSAGES_SENT.inc()
         flash("Message sent to seller!", "success")
         return redirect(url_for('main.product_detail', product_id=product.id))
 
@@ -430,69 +655,52 @@ def message_seller(product_id):
 @main.route('/inbox')
 @login_required
 def inbox():
-    products_info = []
-
     if current_user.role == 'seller':
-        # Seller view
-        products = Product.query.filter_by(seller_id=current_user.id).all()
-        for product in products:
-            # get all messages for this product
-            messages = Message.query.filter_by(product_id=product.id).order_by(Message.timestamp.desc()).all()
-
-            buyers_dict = {}
-
-            for msg in messages:
-                # skip messages sent by seller or invalid product
-                if msg.sender_id == current_user.id or not msg.product:
-                    continue
-
-                buyer_id = msg.sender_id
-                if buyer_id not in buyers_dict:
-                    buyers_dict[buyer_id] = {
-                        "id": buyer_id,
-                        "username": msg.sender.username
-                    }
-
-            buyers = list(buyers_dict.values())
-
-            # count only unread messages from buyers
-            unread_count = Message.query.filter_by(
-                product_id=product.id,
-                receiver_id=current_user.id,
-                is_read=False
-            ).count()
-
-            if buyers:
-                products_info.append({
-                    "product": product,
-                    "buyers": buyers,
-                    "unread_messages_count": unread_count
-                })
-
+        products_info = seller_threads(current_user.id)
     else:
-        # Buyer view
-        messages = Message.query.filter(
-            (Message.sender_id == current_user.id) |
-            (Message.receiver_id == current_user.id)
-        ).order_by(Message.timestamp.desc()).all()
-
-        products_dict = {}
-        for msg in messages:
-            if not msg.product:
-                continue
-            pid = msg.product.id
-            if pid not in products_dict:
-                products_dict[pid] = {
-                    "product": msg.product,
-                    "last_message": msg.content,
-                    "timestamp": msg.timestamp
-                }
-        products_info = list(products_dict.values())
+        products_info = buyer_threads(current_user.id)
+
+    # Older conversations live in the archive; only read it when asked for
+    show_older = request.args.get('older', type=int) == 1
+    if show_older:
+        products_info = _merge_archived_conversations(products_info)
+
+    return render_template('inbox.html', products_info=products_info, show_older=show_older)
+
+
+def _merge_archived_conversations(products_info):
+    chunks = archived_conversations(current_user.id)
+    products = {p.id: p for p in product_cards(Product.id.in_({c.product_id for c in chunks}))}
+    by_product = {info.product.id: info for info in products_info}
+
+    def other_id(chunk):
+        return chunk.user_high_id if chunk.user_low_id == current_user.id else chunk.user_low_id
+
+    names = usernames({other_id(c) for c in chunks}) if current_user.role == 'seller' else {}
+    for chunk in chunks:
+        product = products.get(chunk.product_id)
+        if not product:
+            continue
 
-    return render_template('inbox.html', products_info=products_info)
+        if current_user.role == 'seller':
+            if product.seller_id != current_user.id:
+                continue
+            info = by_product.get(product.id)
+            if info is None:
+                info = by_product[product.id] = SellerThread(product, [], 0)
+                products_info.append(info)
+            buyer_id = other_id(chunk)
+            if buyer_id in names and all(b.id != buyer_id for b in info.buyers):
+                info.buyers.append(BuyerRef(buyer_id, names[buyer_id]))
+        elif product.id not in by_product:
+            by_product[product.id] = BuyerThread(product, chunk.preview, chunk.last_timestamp)
+            products_info.append(by_product[product.id])
+
+    return products_info
 
 @main.route('/messages/<int:product_id>/<int:user_id>', methods=['GET', 'POST'])
 @login_required
+@rate_limit("30/minute")
 def conversation(product_id, user_id):
     product = Product.query.get_or_404(product_id)
     other_user = User.query.get_or_404(user_id)
@@ -507,36 +715,76 @@ def conversation(product_id, user_id):
             is_read=False  # mark new messages as unread
         )
         db.session.add(msg)
+        db.session.flush()
+        queue_new_message_notification(msg, other_user)
         db.session.commit()
+        MESSAGES_SENT.inc()
         return redirect(url_for('main.conversation', product_id=product.id, user_id=other_user.id))
 
-    # Fetch conversation messages
-    msgs = Message.query.filter(
-        ((Message.sender_id == current_user.id) & (Message.receiver_id == other_user.id)) |
-        ((Message.sender_id == other_user.id) & (Message.receiver_id == current_user.id))
-    ).filter_by(product_id=product.id).order_by(Message.timestamp).all()
+    # Fetch one page of the conversation (hot table first, archive when paging back)
+    msgs, older_cursor = load_conversation(
+        product.id, current_user.id, other_user.id,
+        before=request.args.get('before', type=int)
+    )
 
     # MARK MESSAGES AS READ for seller
     if current_user.role == 'seller':
-        for msg in msgs:
-            if msg.receiver_id == current_user.id and not msg.is_read:
-                msg.is_read = True
-        db.session.commit()
-
-    return render_template('conversation.html', messages=msgs, form=form, product=product, other_user=other_user)
+        Message.query.filter_by(
+            product_id=product.id,
+            sender_id=other_user.id,
+            receiver_id=current_user.id,
+            is_read=False
+        ).update({'is_read': True}, synchronize_session=False)
+
+    return _render_and_commit(
+        'conversation.html',
+        messages=msgs,
+        older_cursor=older_cursor,
+        form=form,
+        product=product,
+        other_user=other_user
+    )
 
 
-@main.route('/forgot-password')
+@main.route('/forgot-password', methods=['GET', 'POST'])
+@rate_limit("5/hour", by="ip")
 def forgot_password():
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+
     form = ForgotPasswordForm()
+    if form.validate_on_submit():
+        user = User.query.filter_by(email=form.email.data).first()
+        if user:
+            # Sent by the mail worker; the request never waits on SMTP
+            queue_password_reset(user)
+            db.session.commit()
+        # Same answer either way so emails can't be probed
+        flash("If that email is registered, a reset link is on its way.", "info")
+        return redirect(url_for('main.login'))
+
     return render_template('forgot_password.html', title='Forgot Password', form=form)
 
 # -------------------------
 # RESET PASSWORD PAGE
 # -------------------------
-@main.route('/reset-password')
-def reset_password():
+@main.route('/reset-password/<token>', methods=['GET', 'POST'])
+def reset_password(token):
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+
+    user = User.verify_reset_password_token(token)
+    if not user:
+        flash("That reset link is invalid or has expired.", "danger")
+        return redirect(url_for('main.forgot_password'))
+
     form = ResetPasswordForm()
+    if form.validate_on_submit():
+        user.set_password(form.password.data)
+        db.session.commit()
+        flash("Your password has been reset. Please log in.", "success")
+        return redirect(url_for('main.login'))
+
     return render_template('reset_password.html', title='Reset Password', form=form)
 
 
@@ -616,8 +864,7 @@ def delete_category(id):
         db.session.commit()
 
     # Move products to Uncategorized
-    for product in category.products:
-        product.category_id = uncategorized.id
+    move_category_products(current_user.id, category.id, uncategorized.id)
 
     db.session.delete(category)
     db.session.commit()
@@ -632,6 +879,8 @@ from werkzeug.utils import secure_filename
 # ------------------------- EDIT PRODUCT -------------------------
 @main.route('/seller/product/<int:id>/edit', methods=['GET', 'POST'])
 @login_required
+@rate_limit("30/hour")
+@concurrency_limit(4)
 def edit_product(id):
     product = Product.query.get_or_404(id)
 
@@ -645,7 +894,7 @@ def edit_product(id):
     if not categories:
         default_category = Category(name="Uncategorized", seller_id=current_user.id)
         db.session.add(default_category)
-        db.session.commit()
+        db.session.flush()
         categories = [default_category]
     form.category_id.choices = [(c.id, c.name) for c in categories]
 
@@ -661,6 +910,7 @@ def edit_product(id):
         form.size_unit.data = product.size_unit
         form.stock_quantity.data = product.stock_quantity
         form.category_id.data = product.category_id if product.category_id else 0
+        form.variants.data = format_variants(product.variants)
 
     if form.validate_on_submit():
         # Update basic fields
@@ -670,31 +920,40 @@ def edit_product(id):
         product.size_unit = form.size_unit.data
         product.stock_quantity = form.stock_quantity.data
         product.category_id = form.category_id.data if form.category_id.data != 0 else None
+        # The whole size list is resubmitted, so replace it in one go
+        replace_variants(product, form.parsed_variants)
 
         # Handle Cloudinary uploads
-        for idx, field in enumerate(product_image_fields):
-            file = field.data
-            if file:
-                pid, url = upload_to_cloudinary(file, f"products/{product.id}")
-
-                if idx < len(existing_images):
-                    # Replace existing
-                    old_image = existing_images[idx]
-                    delete_from_cloudinary(old_image.public_id)
-                    old_image.image_url = url
-                    old_image.public_id = pid
-                else:
-                    # Add new image if less than 4
-                    if len(existing_images) < 4:
-                        new_img = ProductImage(product_id=product.id, image_url=url, public_id=pid)
-                        db.session.add(new_img)
+        try:
+            for idx, field in enumerate(product_image_fields):
+                file = field.data
+                if isinstance(file, FileStorage) and file.filename:
+                    pid, url = upload_to_cloudinary(
+                        file,
+                        folder=f"products/{product.id}",
+                        public_id=f"product_{product.id}_{uuid.uuid4().hex}"
+                    )
+
+                    if idx < len(existing_images):
+                        # Replace existing
+                        old_image = existing_images[idx]
+                        schedule_cloudinary_delete(old_image.public_id)
+                        old_image.image_url = url
+                        old_image.public_id = pid
+                    else:
+                        # Add new image if less than 4
+                        if len(existing_images) < 4:
+                            new_img = ProductImage(product_id=product.id, image_url=url, public_id=pid)
+                            db.session.add(new_img)
+        except MediaUnavailable:
+            flash(IMAGES_NOT_SAVED, "warning")
 
         db.session.commit()
         flash(f'Product "{product.name}" updated successfully!', 'success')
         return redirect(url_for('main.seller_dashboard'))
 
 
-    return render_template(
+    return _render_and_commit(
         'edit_product.html',
         title=f"Edit Product - {product.name}",
         form=form,
@@ -713,12 +972,8 @@ def delete_product(id):
         flash("Access Denied.", "danger")
         return redirect(url_for('main.seller_dashboard'))
 
-    # Delete Cloudinary images first
-    for img in product.images:
-        delete_from_cloudinary(img.public_id)
-        db.session.delete(img)
-
-    db.session.delete(product)
+    # Same statements as a bulk delete: images queued for Cloudinary, rows dropped in bulk
+    delete_products(current_user.id, [product.id])
     db.session.commit()
     flash('Product deleted!', 'success')
     return redirect(url_for('main.seller_dashboard'))
@@ -735,7 +990,7 @@ def delete_product_image(id):
         flash("Access Denied.", "danger")
         return redirect(url_for('main.seller_dashboard'))
 
-    delete_from_cloudinary(image.public_id)
+    schedule_cloudinary_delete(image.public_id)
     db.session.delete(image)
     db.session.commit()
     flash("Image deleted!", "success")
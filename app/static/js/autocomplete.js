@@ -0,0 +1,48 @@
+document.addEventListener("DOMContentLoaded", function () {
+    // =========================
+    // Typeahead search (/autocomplete)
+    // =========================
+    document.querySelectorAll('input[data-autocomplete]').forEach(input => {
+        const list = document.createElement('div');
+        list.className = 'list-group position-absolute w-100 shadow-sm';
+        list.style.zIndex = 1000;
+        input.parentElement.classList.add('position-relative');
+        input.after(list);
+
+        let timer = null;
+        let latest = '';
+
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            const q = input.value.trim();
+            if (!q) {
+                list.innerHTML = '';
+                return;
+            }
+            timer = setTimeout(() => {
+                latest = q;
+                fetch(`${input.dataset.autocomplete}?q=${encodeURIComponent(q)}`)
+                    .then(r => r.json())
+                    .then(data => {
+                        if (data.query !== latest) return;  // a newer request is on its way
+                        list.innerHTML = '';
+                        data.results.forEach(item => {
+                            const link = document.createElement(item.url ? 'a' : 'span');
+                            link.className = 'list-group-item list-group-item-action d-flex justify-content-between';
+                            if (item.url) link.href = item.url;
+                            link.textContent = item.label;
+                            const badge = document.createElement('small');
+                            badge.className = 'text-muted';
+                            badge.textContent = item.type;
+                            link.appendChild(badge);
+                            list.appendChild(link);
+                        });
+                    });
+            }, 120);
+        });
+
+        document.addEventListener('click', e => {
+            if (!list.contains(e.target) && e.target !== input) list.innerHTML = '';
+        });
+    });
+});
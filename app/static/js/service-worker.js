@@ -0,0 +1,229 @@
+// Offline-capable browsing for buyers (served at /service-worker.js, see app/offline.py).
+//
+// * Static bundle (our CSS/JS, Bootstrap, Font Awesome): precached on install, cache-first.
+// * Cloudinary images: cache-first. Their URLs never change content, so this cache
+//   outlives deploys; it is capped in bytes and evicts the least recently used.
+// * Storefront pages (sellers, a seller's products, product pages): stale-while-revalidate.
+//   A cached copy is shown at once and refreshed in the background. Copies older than
+//   PAGE_MAX_AGE are fetched first (their forms' CSRF tokens may have expired) and only
+//   shown when the network fails. Capped in entries, least recently used go first.
+//
+// The registration URL carries the deploy version and the limits. A new version
+// installs a new worker, which drops the previous version's static and page caches.
+const params = new URL(self.location).searchParams;
+const VERSION = params.get('v') || 'dev';
+const IMAGE_CACHE_BYTES = Number(params.get('image_mb') || 50) * 1024 * 1024;
+const PAGE_CACHE_ENTRIES = Number(params.get('pages') || 50);
+const PAGE_MAX_AGE = 10 * 60 * 1000;
+
+const STATIC_CACHE = `static-${VERSION}`;
+const PAGE_CACHE = `pages-${VERSION}`;
+const IMAGE_CACHE = 'images-v1';
+
+// Keep in step with base.html and the templates' script blocks
+const PRECACHE = [
+    '/static/css/styles.css',
+    '/static/js/product-images.js',
+    '/static/js/autocomplete.js',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/css/bootstrap.min.css',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.2/dist/js/bootstrap.bundle.min.js',
+    'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.5.1/css/all.min.css',
+];
+const STATIC_HOSTS = ['cdn.jsdelivr.net', 'cdnjs.cloudflare.com'];
+const IMAGE_HOST = 'res.cloudinary.com';
+const PAGE_PATHS = [/^\/buyers\/sellers$/, /^\/buyers\/seller\/\d+\/products$/, /^\/product\/\d+$/];
+// Pages show who is logged in, so a different user must not see them
+const SESSION_PATHS = ['/login', '/logout'];
+
+
+// =========================
+// LRU bookkeeping (IndexedDB: one record per cached URL)
+// =========================
+let database = null;
+
+function openDatabase() {
+    if (database) return database;
+    database = new Promise((resolve, reject) => {
+        const request = indexedDB.open('afrido-sw', 1);
+        request.onupgradeneeded = () => {
+            const store = request.result.createObjectStore('entries', { keyPath: ['cache', 'url'] });
+            store.createIndex('byUse', ['cache', 'usedAt']);
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+    return database;
+}
+
+function done(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function entries(mode) {
+    return (await openDatabase()).transaction('entries', mode).objectStore('entries');
+}
+
+async function getEntry(cache, url) {
+    return done((await entries('readonly')).get([cache, url]));
+}
+
+async function putEntry(entry) {
+    return done((await entries('readwrite')).put(entry));
+}
+
+async function touch(cache, url) {
+    const entry = await getEntry(cache, url);
+    if (entry) {
+        entry.usedAt = Date.now();
+        await putEntry(entry);
+    }
+}
+
+async function evict(cacheName, maxBytes, maxEntries) {
+    const store = await entries('readonly');
+    const range = IDBKeyRange.bound([cacheName, 0], [cacheName, Infinity]);
+    const all = await done(store.index('byUse').getAll(range));  // least recently used first
+    let bytes = all.reduce((sum, entry) => sum + entry.size, 0);
+    let count = all.length;
+    const cache = await caches.open(cacheName);
+    for (const entry of all) {
+        if (bytes <= maxBytes && count <= maxEntries) break;
+        await cache.delete(entry.url);
+        await done((await entries('readwrite')).delete([cacheName, entry.url]));
+        bytes -= entry.size;
+        count -= 1;
+    }
+}
+
+async function store(cacheName, url, response, limits) {
+    const body = await response.clone().blob();
+    const cache = await caches.open(cacheName);
+    await cache.put(url, response);
+    const now = Date.now();
+    await putEntry({ cache: cacheName, url, size: body.size, storedAt: now, usedAt: now });
+    await evict(cacheName, limits.bytes, limits.entries);
+}
+
+async function forgetCache(cacheName) {
+    await caches.delete(cacheName);
+    // Arrays sort after strings, so this range holds every URL of the cache
+    const range = IDBKeyRange.bound([cacheName, ''], [cacheName, []]);
+    await done((await entries('readwrite')).delete(range));
+}
+
+
+// =========================
+// Install / activate
+// =========================
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(STATIC_CACHE)
+            .then(cache => cache.addAll(PRECACHE.map(url => new Request(url, { mode: 'cors', credentials: 'omit' }))))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    const keep = [STATIC_CACHE, PAGE_CACHE, IMAGE_CACHE];
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names.filter(name => !keep.includes(name)).map(forgetCache)))
+            .then(() => self.clients.claim())
+    );
+});
+
+
+// =========================
+// Strategies
+// =========================
+async function cacheFirstStatic(request) {
+    const cached = await caches.match(request, { cacheName: STATIC_CACHE });
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(STATIC_CACHE);
+        await cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function cacheFirstImage(event) {
+    const url = event.request.url;
+    const cache = await caches.open(IMAGE_CACHE);
+    const cached = await cache.match(url);
+    if (cached) {
+        event.waitUntil(touch(IMAGE_CACHE, url));
+        return cached;
+    }
+    let response;
+    try {
+        // CORS, so the size is known; opaque responses would count as megabytes against the quota
+        response = await fetch(url, { mode: 'cors', credentials: 'omit' });
+    } catch (error) {
+        return fetch(event.request);
+    }
+    if (response.ok) {
+        event.waitUntil(store(IMAGE_CACHE, url, response.clone(), { bytes: IMAGE_CACHE_BYTES, entries: Infinity }));
+    }
+    return response;
+}
+
+function cacheable(response) {
+    return response.ok && response.type === 'basic' && !response.redirected;
+}
+
+async function staleWhileRevalidate(event) {
+    const url = event.request.url;
+    const limits = { bytes: Infinity, entries: PAGE_CACHE_ENTRIES };
+    const cache = await caches.open(PAGE_CACHE);
+    const [cached, entry] = await Promise.all([cache.match(url), getEntry(PAGE_CACHE, url)]);
+    const network = fetch(event.request).then(response => {
+        if (cacheable(response)) {
+            event.waitUntil(store(PAGE_CACHE, url, response.clone(), limits));
+        }
+        return response;
+    });
+
+    if (cached && entry && Date.now() - entry.storedAt < PAGE_MAX_AGE) {
+        event.waitUntil(network.catch(() => null));
+        event.waitUntil(touch(PAGE_CACHE, url));
+        return cached;
+    }
+    try {
+        return await network;
+    } catch (error) {
+        if (cached) return cached;  // offline: an old copy beats no page
+        throw error;
+    }
+}
+
+
+// =========================
+// Routing
+// =========================
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+
+    if (url.origin === self.location.origin) {
+        if (SESSION_PATHS.includes(url.pathname)) {
+            event.waitUntil(forgetCache(PAGE_CACHE));
+            return;
+        }
+        if (url.pathname.startsWith('/static/')) {
+            event.respondWith(cacheFirstStatic(request));
+        } else if (request.mode === 'navigate' && PAGE_PATHS.some(pattern => pattern.test(url.pathname))) {
+            event.respondWith(staleWhileRevalidate(event));
+        }
+        return;
+    }
+    if (url.hostname === IMAGE_HOST && request.destination === 'image') {
+        event.respondWith(cacheFirstImage(event));
+    } else if (STATIC_HOSTS.includes(url.hostname)) {
+        event.respondWith(cacheFirstStatic(request));
+    }
+});
@@ -0,0 +1,86 @@
+"""Template compilation and render-time guards.
+
+* Compiled templates are kept in a Jinja ``FileSystemBytecodeCache``
+  (``TEMPLATE_CACHE_DIR``), shared by every worker on the machine, so a
+  fresh worker loads bytecode instead of parsing and compiling source.
+* Every template is loaded once when the app is created. Under gunicorn
+  with ``preload_app`` that happens in the master, before forking.
+* With ``TEMPLATE_STRICT_QUERIES`` on, a database query issued while a
+  template renders (a lazy relationship, ``.count()``, ``.all()``...)
+  raises ``TemplateQueryError``, naming the template and the statement.
+  Views are expected to load everything a page shows.
+* Renders slower than ``TEMPLATE_RENDER_BUDGET_MS`` are logged.
+"""
+import contextvars
+import os
+import time
+
+from flask import current_app, has_app_context
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import event
+
+_rendering = contextvars.ContextVar("rendering_template", default=None)
+
+
+class TemplateQueryError(RuntimeError):
+    """A template ran a database query while rendering."""
+
+
+def _guarded_template_class(base):
+    class GuardedTemplate(base):
+        def render(self, *args, **kwargs):
+            token = _rendering.set(self.name)
+            started = time.perf_counter()
+            try:
+                return super().render(*args, **kwargs)
+            finally:
+                _rendering.reset(token)
+                _check_budget(self.name, time.perf_counter() - started)
+
+    return GuardedTemplate
+
+
+def _check_budget(name, elapsed):
+    if not has_app_context():
+        return
+    budget_ms = current_app.config["TEMPLATE_RENDER_BUDGET_MS"]
+    if budget_ms and elapsed * 1000 > budget_ms:
+        current_app.logger.warning("Rendering %s took %.1fms (budget %sms)", name, elapsed * 1000, budget_ms)
+
+
+def _on_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    name = _rendering.get()
+    if name is not None:
+        raise TemplateQueryError(
+            f"{name} ran a query while rendering; load it in the view instead: {statement[:200]}"
+        )
+
+
+def precompile_templates(app):
+    """Load (and so compile or fetch from the bytecode cache) every template."""
+    env = app.jinja_env
+    names = env.list_templates()
+    for name in names:
+        env.get_template(name)
+    return len(names)
+
+
+def init_app(app, db):
+    """Call after all blueprints are registered, so their templates are found."""
+    env = app.jinja_env
+    if app.config["TEMPLATE_BYTECODE_CACHE"]:
+        directory = app.config.get("TEMPLATE_CACHE_DIR")
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    env.template_class = _guarded_template_class(env.template_class)
+    if app.config["TEMPLATE_STRICT_QUERIES"]:
+        with app.app_context():
+            for engine in db.engines.values():
+                event.listen(engine, "before_cursor_execute", _on_before_cursor_execute)
+
+    if app.config["TEMPLATE_PRECOMPILE"]:
+        started = time.perf_counter()
+        count = precompile_templates(app)
+        app.logger.info("Precompiled %d templates in %.0fms", count, (time.perf_counter() - started) * 1000)
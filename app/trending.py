@@ -0,0 +1,232 @@
+"""Trending products and sellers.
+
+``trending_score`` keeps one time-decayed score per product and per seller.
+Activity adds points in the same transaction as the write that caused
+it, from an ``after_flush`` hook on the session:
+
+* a buyer's message about a product: ``MESSAGE_POINTS``;
+* a new listing: ``LISTING_POINTS``;
+* a restock, i.e. ``stock_quantity`` going up: ``RESTOCK_POINTS``.
+
+The product and its seller both get the points. Bulk stock changes
+(app/bulk.py) bypass the hook and report their restocks through
+``credit_restocks`` instead.
+
+``flask trending decay`` multiplies every score by
+``0.5 ** (hours since the last pass / TRENDING_HALF_LIFE_HOURS)`` in one
+UPDATE. It then drops scores below ``TRENDING_MIN_SCORE`` and rows whose
+product or seller is gone. The time of the last pass is stored in the
+table itself (kind ``decay``), so passes can run at any interval and a
+late pass catches up. Points added between passes are decayed as if they
+were as old as the previous pass, so scores are accurate to about one
+pass interval.
+
+The feed is a top-N read of ``ix_trending_score_kind_score``. After
+first deploying, ``flask trending rebuild`` seeds the scores from message
+history and listing dates.
+"""
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import event, inspect
+
+from app import db
+from app.analytics import upsert
+from app.models import Message, Product, TrendingScore, User
+from app.read_models import PRODUCT_CARD, ProductCard
+
+PRODUCT, SELLER, DECAY = "product", "seller", "decay"
+MESSAGE_POINTS = 3.0
+LISTING_POINTS = 5.0
+RESTOCK_POINTS = 2.0
+
+
+# =========================
+# SCORING ON WRITE
+# =========================
+def add_points(connection, points, now=None):
+    """Add ``{(kind, subject_id): points}`` to the scores in one upsert."""
+    if not points:
+        return
+    now = now or datetime.utcnow()
+    # Sorted, so concurrent upserts lock rows in the same order
+    upsert(connection, TrendingScore, ("kind", "subject_id"), [
+        {"kind": kind, "subject_id": subject_id, "score": value, "updated_at": now}
+        for (kind, subject_id), value in sorted(points.items())
+    ], increment=("score",), overwrite=("updated_at",))
+
+
+def _credit(points, product_id, seller_id, value):
+    points[(PRODUCT, product_id)] += value
+    if seller_id is not None:
+        points[(SELLER, seller_id)] += value
+
+
+def credit_restocks(connection, seller_id, product_ids):
+    """Add ``RESTOCK_POINTS`` for products restocked by a bulk statement."""
+    points = Counter()
+    for product_id in product_ids:
+        _credit(points, product_id, seller_id, RESTOCK_POINTS)
+    add_points(connection, points)
+
+
+def _stock_went_up(product):
+    history = inspect(product).attrs.stock_quantity.history
+    if not history.added or not history.deleted:
+        return False
+    return (history.added[0] or 0) > (history.deleted[0] or 0)
+
+
+def _collect_activity(session, flush_context):
+    # new/dirty and attribute history still show the pre-flush state here
+    points = Counter()
+    messages = []
+    for obj in session.new:
+        if isinstance(obj, Product):
+            _credit(points, obj.id, obj.seller_id, LISTING_POINTS)
+        elif isinstance(obj, Message) and obj.product_id is not None:
+            messages.append(obj)
+    for obj in session.dirty:
+        if isinstance(obj, Product) and _stock_went_up(obj):
+            _credit(points, obj.id, obj.seller_id, RESTOCK_POINTS)
+
+    connection = session.connection()
+    if messages:
+        sellers = dict(connection.execute(
+            db.select(Product.id, Product.seller_id)
+            .where(Product.id.in_({m.product_id for m in messages}))
+        ).all())
+        for message in messages:
+            # Only buyers writing to the seller count, not the seller's replies
+            if sellers.get(message.product_id) == message.receiver_id:
+                _credit(points, message.product_id, message.receiver_id, MESSAGE_POINTS)
+    add_points(connection, points)
+
+
+# =========================
+# DECAY
+# =========================
+def decay(now=None):
+    """Decay every score for the time since the last pass; returns ``(factor, removed)``."""
+    now = now or datetime.utcnow()
+    config = current_app.config
+    clock = db.session.execute(
+        db.select(TrendingScore)
+        .where(TrendingScore.kind == DECAY, TrendingScore.subject_id == 0)
+        .with_for_update()
+    ).scalar_one_or_none()
+    if clock is None:
+        # First pass only starts the clock
+        db.session.add(TrendingScore(kind=DECAY, subject_id=0, score=0.0, updated_at=now))
+        db.session.commit()
+        return 1.0, 0
+
+    hours = max((now - clock.updated_at).total_seconds(), 0) / 3600
+    factor = 0.5 ** (hours / config["TRENDING_HALF_LIFE_HOURS"])
+    scores = db.update(TrendingScore).where(TrendingScore.kind != DECAY)
+    db.session.execute(scores.values(score=TrendingScore.score * factor).execution_options(synchronize_session=False))
+
+    removed = 0
+    for statement in (
+        db.delete(TrendingScore).where(TrendingScore.kind != DECAY, TrendingScore.score < config["TRENDING_MIN_SCORE"]),
+        db.delete(TrendingScore).where(
+            TrendingScore.kind == PRODUCT, ~db.select(Product.id).where(Product.id == TrendingScore.subject_id).exists()
+        ),
+        db.delete(TrendingScore).where(
+            TrendingScore.kind == SELLER, ~db.select(User.id).where(User.id == TrendingScore.subject_id).exists()
+        ),
+    ):
+        removed += db.session.execute(statement.execution_options(synchronize_session=False)).rowcount
+    clock.updated_at = now
+    db.session.commit()
+    return factor, removed
+
+
+def rebuild(days=14, now=None, batch_size=5000):
+    """Recompute every score from the last ``days`` of messages and listings."""
+    now = now or datetime.utcnow()
+    since = now - timedelta(days=days)
+    half_life = current_app.config["TRENDING_HALF_LIFE_HOURS"] * 3600
+
+    def decayed(value, moment):
+        return value * 0.5 ** (max((now - moment).total_seconds(), 0) / half_life)
+
+    points = Counter()
+    buyer_messages = (
+        db.select(Message.product_id, Product.seller_id, Message.timestamp)
+        .join(Product, Product.id == Message.product_id)
+        .where(Message.receiver_id == Product.seller_id, Message.timestamp >= since)
+        .execution_options(yield_per=batch_size)
+    )
+    for product_id, seller_id, timestamp in db.session.execute(buyer_messages):
+        _credit(points, product_id, seller_id, decayed(MESSAGE_POINTS, timestamp))
+    listings = (
+        db.select(Product.id, Product.seller_id, Product.timestamp)
+        .where(Product.timestamp >= since)
+        .execution_options(yield_per=batch_size)
+    )
+    for product_id, seller_id, timestamp in db.session.execute(listings):
+        _credit(points, product_id, seller_id, decayed(LISTING_POINTS, timestamp))
+
+    db.session.execute(db.delete(TrendingScore))
+    db.session.add(TrendingScore(kind=DECAY, subject_id=0, score=0.0, updated_at=now))
+    db.session.flush()
+    add_points(db.session.connection(), points, now=now)
+    db.session.commit()
+    return len(points)
+
+
+# =========================
+# FEED
+# =========================
+def trending_products(limit):
+    """``[(ProductCard, score)]``, best first, in-stock products only."""
+    rows = db.session.execute(
+        db.select(*PRODUCT_CARD, TrendingScore.score)
+        .join(TrendingScore, (TrendingScore.kind == PRODUCT) & (TrendingScore.subject_id == Product.id))
+        .where(Product.stock_quantity > 0)
+        .order_by(TrendingScore.score.desc())
+        .limit(limit)
+    )
+    return [(ProductCard._make(row[:-1]), row[-1]) for row in rows]
+
+
+def seller_score():
+    """``(onclause, score)`` for outer-joining sellers (``User``) to their score."""
+    onclause = (TrendingScore.kind == SELLER) & (TrendingScore.subject_id == User.id)
+    return onclause, db.func.coalesce(TrendingScore.score, 0.0)
+
+
+# =========================
+# CLI
+# =========================
+trending_cli = AppGroup("trending", help="Trending products and sellers.")
+
+
+@trending_cli.command("decay")
+@click.option("--loop", is_flag=True, help="Keep decaying every --interval seconds.")
+@click.option("--interval", type=float, default=3600.0, show_default=True, help="Seconds between passes with --loop.")
+def decay_command(loop, interval):
+    """Apply time decay to every score."""
+    while True:
+        factor, removed = decay()
+        click.echo(f"Scores x{factor:.4f}, {removed} removed.")
+        if not loop:
+            return
+        time.sleep(interval)
+
+
+@trending_cli.command("rebuild")
+@click.option("--days", type=int, default=14, show_default=True, help="How much history to score.")
+def rebuild_command(days):
+    """Recompute all scores from message history and listing dates."""
+    click.echo(f"Scored {rebuild(days=days)} product(s) and seller(s).")
+
+
+def init_app(app, db):
+    event.listen(db.session.session_factory.class_, "after_flush", _collect_activity)
+    app.cli.add_command(trending_cli)
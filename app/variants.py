@@ -0,0 +1,199 @@
+"""Per-size product variants.
+
+``Product.size_unit`` is free text ("EU 40-44", "42", "UK 9/10"). Each
+product can instead carry ``ProductVariant`` rows, one per size, each
+with its own stock. Sellers edit them in bulk as text, one size per line:
+
+    EU 42: 3
+    EU 43: 0
+    UK 9.5: 1
+
+``Product.stock_quantity`` is kept as the sum of its variants' stock.
+``flask variants backfill`` creates variants from the old ``size_unit``
+text for products that have none.
+"""
+import re
+
+import click
+from flask.cli import AppGroup
+
+from app import db
+from app.facets import touch_products
+from app.models import Product, ProductVariant
+
+SYSTEM_ALIASES = {"EU": "EU", "EUR": "EU", "UK": "UK", "US": "US", "USA": "US"}
+SIZE_RANGES = {"EU": (15, 52), "UK": (0, 16), "US": (0, 18)}
+MAX_RANGE_SPAN = 15
+
+SYSTEM_RE = re.compile(r"\b(EUR?|UK|USA?)\b")
+RANGE_RE = re.compile(r"(\d+(?:\.5)?)\s*(?:-|–|TO)\s*(\d+(?:\.5)?)")
+NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+LINE_RE = re.compile(
+    r"^\s*(?:(EUR?|UK|USA?)\s*)?(\d+(?:\.5)?)\s*(?:[:=]\s*|\s+)(\d+)\s*$", re.IGNORECASE
+)
+
+
+# =========================
+# PARSING
+# =========================
+def _guess_system(sizes):
+    # Bare numbers are only unambiguous in the EU range
+    return "EU" if sizes and min(sizes) >= 30 else None
+
+
+def _plausible(system, size):
+    low, high = SIZE_RANGES[system]
+    return low <= size <= high and (size * 2).is_integer()
+
+
+def parse_size_unit(text):
+    """``[(system, size), ...]`` for free text like "EU 40-42"; [] if unclear."""
+    text = (text or "").upper()
+    match = SYSTEM_RE.search(text)
+    system = SYSTEM_ALIASES[match.group(1)] if match else None
+
+    sizes = []
+    for low, high in RANGE_RE.findall(text):
+        low, high = float(low), float(high)
+        if low < high <= low + MAX_RANGE_SPAN:
+            sizes.extend(float(s) for s in range(int(low), int(high) + 1))
+    text = RANGE_RE.sub(" ", text)
+    sizes.extend(float(n) for n in NUMBER_RE.findall(text))
+
+    system = system or _guess_system(sizes)
+    if system is None:
+        return []
+    return list(dict.fromkeys((system, s) for s in sizes if _plausible(system, s)))
+
+
+def parse_variant_lines(text):
+    """``[(system, size, stock), ...]`` from the bulk editor.
+
+    A line without a system uses the previous line's. Raises ``ValueError``
+    naming the first bad line.
+    """
+    variants = {}
+    system = None
+    for number, line in enumerate((text or "").splitlines(), start=1):
+        if not line.strip():
+            continue
+        match = LINE_RE.match(line)
+        if not match:
+            raise ValueError(f'Line {number}: expected something like "EU 42: 3".')
+        size, stock = float(match.group(2)), int(match.group(3))
+        if match.group(1):
+            system = SYSTEM_ALIASES[match.group(1).upper()]
+        system = system or _guess_system([size])
+        if system is None or not _plausible(system, size):
+            raise ValueError(f"Line {number}: {line.strip()} is not a size we recognise.")
+        variants[(system, size)] = stock
+    return [(system, size, stock) for (system, size), stock in variants.items()]
+
+
+def format_variants(variants):
+    return "\n".join(f"{v.size_system} {v.size:g}: {v.stock}" for v in variants)
+
+
+def size_summary(sizes):
+    """Short ``size_unit`` text for a list of ``(system, size)`` pairs."""
+    if not sizes:
+        return None
+    systems = sorted({system for system, _ in sizes})
+    values = sorted(size for _, size in sizes)
+    if len(systems) > 1:
+        return ", ".join(systems)[:20]
+    if len(values) == 1:
+        return f"{systems[0]} {values[0]:g}"
+    return f"{systems[0]} {values[0]:g}-{values[-1]:g}"[:20]
+
+
+# =========================
+# WRITES
+# =========================
+def replace_variants(product, variants):
+    """Swap a product's variants for ``variants`` in two statements."""
+    table = ProductVariant.__table__
+    db.session.execute(table.delete().where(table.c.product_id == product.id))
+    touch_products(db.session, [product.id])
+    if variants:
+        db.session.execute(table.insert(), [
+            {"product_id": product.id, "size_system": system, "size": size,
+             "stock": stock, "price": product.price}
+            for system, size, stock in variants
+        ])
+        product.stock_quantity = sum(stock for _, _, stock in variants)
+        product.size_unit = size_summary([(system, size) for system, size, _ in variants])
+
+
+def _split_stock(total, parts):
+    """Spread ``total`` over ``parts`` sizes, earlier sizes taking the remainder."""
+    share, extra = divmod(max(total or 0, 0), parts)
+    return [share + (1 if i < extra else 0) for i in range(parts)]
+
+
+def backfill_variants(execute, batch_size=1000, after_id=0):
+    """Create variants from ``size_unit`` for products that have none.
+
+    ``execute`` runs a statement (``db.session.execute``). Walks products
+    in id order, ``batch_size`` at a time, and yields the last id of each
+    batch so callers can commit and report progress. Safe to re-run: products that already have
+    variants are skipped. Sizes parsed from a range share the product's
+    stock evenly, so totals are unchanged.
+    """
+    product, variant = Product.__table__, ProductVariant.__table__
+    has_variants = db.select(variant.c.id).where(variant.c.product_id == product.c.id).exists()
+    while True:
+        rows = execute(
+            db.select(product.c.id, product.c.size_unit, product.c.stock_quantity, product.c.price)
+            .where(product.c.id > after_id, product.c.size_unit.isnot(None), ~has_variants)
+            .order_by(product.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        inserts = []
+        for product_id, size_unit, stock, price in rows:
+            sizes = parse_size_unit(size_unit)
+            for (system, size), share in zip(sizes, _split_stock(stock, len(sizes) or 1)):
+                inserts.append({
+                    "product_id": product_id, "size_system": system, "size": size,
+                    "stock": share, "price": price,
+                })
+        if inserts:
+            execute(variant.insert(), inserts)
+        after_id = rows[-1][0]
+        yield after_id
+
+
+# =========================
+# QUERIES
+# =========================
+def in_stock_product_ids(size_system, size, max_price=None):
+    """Select of product ids with ``size`` in stock, optionally under a price."""
+    query = db.select(ProductVariant.product_id).where(
+        ProductVariant.size_system == size_system,
+        ProductVariant.size == size,
+        ProductVariant.stock > 0,
+    )
+    if max_price is not None:
+        query = query.where(ProductVariant.price <= max_price)
+    return query
+
+
+# =========================
+# CLI
+# =========================
+variants_cli = AppGroup("variants", help="Per-size product variants.")
+
+
+@variants_cli.command("backfill")
+@click.option("--batch-size", type=int, default=1000, show_default=True)
+def backfill_command(batch_size):
+    """Create variants from size_unit for products that have none."""
+    batches = 0
+    for last_id in backfill_variants(db.session.execute, batch_size=batch_size):
+        db.session.commit()
+        batches += 1
+        click.echo(f"Up to product {last_id}")
+    db.session.commit()
+    click.echo(f"Done in {batches} batch(es).")
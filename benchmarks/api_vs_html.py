@@ -0,0 +1,142 @@
+"""Compare the JSON API with the HTML pages it replaces for the mobile client.
+
+Fills a temporary SQLite database with sellers, products, images and sizes,
+then times requests through the Flask test client and reports response
+sizes:
+
+* a storefront: ``/buyers/seller/<id>/products`` against
+  ``/api/v1/sellers/<id>/products`` (default and sparse fields);
+* ``--batch`` products: one ``/product/<id>`` page each against a single
+  ``/api/v1/products/batch`` call;
+* encoding the batch payload with the standard library against orjson.
+
+    python benchmarks/api_vs_html.py --sellers 200 --products-per-seller 48
+"""
+import argparse
+import atexit
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def populate(db, sellers, per_seller, seed=0):
+    from app.models import Category, Product, ProductImage, ProductVariant, SellerProfile, User
+
+    rng = random.Random(seed)
+    users, profiles, categories, products, images, variants = [], [], [], [], [], []
+    product_id = 0
+    for seller_id in range(1, sellers + 1):
+        users.append({"id": seller_id, "username": f"seller{seller_id}", "email": f"seller{seller_id}@example.com", "role": "seller"})
+        profiles.append({"user_id": seller_id, "shop_name": f"Shop {seller_id}", "location": "Nairobi", "rating": 4.5})
+        categories.append({"id": seller_id, "name": "Sneakers", "seller_id": seller_id})
+        for _ in range(per_seller):
+            product_id += 1
+            price = round(rng.uniform(10, 200), 2)
+            products.append({
+                "id": product_id, "name": f"Shoe {product_id}", "description": "Handmade leather shoe. " * 8,
+                "price": price, "size_unit": "EU 40-44", "stock_quantity": 10,
+                "seller_id": seller_id, "category_id": seller_id,
+            })
+            for n in range(3):
+                images.append({
+                    "product_id": product_id, "public_id": f"p{product_id}_{n}",
+                    "image_url": f"https://res.cloudinary.com/demo/image/upload/p{product_id}_{n}.jpg",
+                })
+            for size in range(40, 45):
+                variants.append({"product_id": product_id, "size_system": "EU", "size": size, "stock": 2, "price": price})
+    for model, rows in (
+        (User, users), (SellerProfile, profiles), (Category, categories),
+        (Product, products), (ProductImage, images), (ProductVariant, variants),
+    ):
+        for start in range(0, len(rows), 10000):
+            db.session.execute(model.__table__.insert(), rows[start:start + 10000])
+    db.session.commit()
+    return product_id
+
+
+def timed(client, urls, repeat):
+    """Milliseconds per round of ``urls`` (p50, p95) and bytes per round."""
+    timings, size = [], 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = 0
+        for url in urls:
+            response = client.get(url, headers={"Referer": "/"})
+            assert response.status_code == 200, (url, response.status_code)
+            size += len(response.data)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)], size
+
+
+def report(label, result):
+    p50, p95, size = result
+    print(f"{label:<44} p50 {p50:8.2f}ms  p95 {p95:8.2f}ms  {size / 1024:9.1f} KiB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sellers", type=int, default=200)
+    parser.add_argument("--products-per-seller", type=int, default=48)
+    parser.add_argument("--batch", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    path = tempfile.mktemp(suffix=".db")
+    # Registered before the app's own exit hook, so it runs after product views are flushed
+    atexit.register(os.remove, path)
+    os.environ["DATABASE_URL"] = "sqlite:///" + path
+    os.environ.setdefault("CLOUDINARY_BACKEND", "fake")
+    import orjson
+    from app import create_app, db
+
+    app = create_app()
+    app.config["RATELIMIT_ENABLED"] = False
+    with app.app_context():
+        started = time.perf_counter()
+        total = populate(db, args.sellers, args.products_per_seller)
+        print(f"products            {total:,} (loaded in {time.perf_counter() - started:.1f}s)")
+
+    client = app.test_client()
+    rng = random.Random(1)
+    seller = rng.randint(1, args.sellers)
+    page = min(args.products_per_seller, app.config["API_MAX_PAGE_SIZE"])
+
+    print(f"\nstorefront of one seller ({args.products_per_seller} products)")
+    report("HTML /buyers/seller/<id>/products", timed(client, [f"/buyers/seller/{seller}/products"], args.repeat))
+    report("API  /sellers/<id>/products", timed(client, [f"/api/v1/sellers/{seller}/products?limit={page}"], args.repeat))
+    report(
+        "API  ...?fields=name,price",
+        timed(client, [f"/api/v1/sellers/{seller}/products?limit={page}&fields=name,price"], args.repeat),
+    )
+
+    ids = rng.sample(range(1, total + 1), args.batch)
+    print(f"\n{args.batch} products by id")
+    report(f"HTML /product/<id> x {args.batch}", timed(client, [f"/product/{i}" for i in ids], max(args.repeat // 5, 3)))
+    batch = "/api/v1/products/batch?ids=" + ",".join(map(str, ids))
+    report("API  /products/batch", timed(client, [batch], args.repeat))
+    report(
+        "API  /products/batch + images,sizes",
+        timed(client, [batch + "&fields=name,price,description,category,images,sizes"], args.repeat),
+    )
+
+    payload = json.loads(client.get(batch + "&fields=name,price,description,category,created_at,images,sizes").data)
+    rounds = 2000
+    print(f"\nencoding that batch x {rounds}")
+    for label, encode in (
+        ("json.dumps", lambda: json.dumps(payload, separators=(",", ":")).encode()),
+        ("orjson.dumps", lambda: orjson.dumps(payload)),
+    ):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            encode()
+        print(f"{label:<44} {(time.perf_counter() - started) * 1e6 / rounds:8.1f}us per payload")
+
+
+if __name__ == "__main__":
+    main()
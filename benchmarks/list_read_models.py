@@ -0,0 +1,184 @@
+"""List pages: ORM entities against the named-tuple read models.
+
+Fills a temporary SQLite database with sellers, products and messages,
+then loads the rows behind each list page two ways:
+
+* full ORM entities, as the views did before app/read_models.py;
+* column-only selects into named tuples (app/read_models.py).
+
+For each page it reports the time per load, the peak memory it allocated
+(tracemalloc) and the garbage collections it triggered. Every load starts
+from an empty session, as a request does.
+
+    python benchmarks/list_read_models.py --sellers 200 --products-per-seller 500
+"""
+import argparse
+import atexit
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_vs_html import populate  # noqa: E402
+
+
+def add_messages(db, sellers, per_seller, buyers, per_product, seed=0):
+    """``buyers`` buyers (ids after the sellers) write ``per_product`` messages on each product."""
+    from app.models import Message, User
+
+    rng = random.Random(seed)
+    first_buyer = sellers + 1
+    db.session.execute(User.__table__.insert(), [
+        {"id": first_buyer + n, "username": f"buyer{n}", "email": f"buyer{n}@example.com", "role": "buyer"}
+        for n in range(buyers)
+    ])
+    rows = []
+    for product_id in range(1, sellers * per_seller + 1):
+        seller_id = (product_id - 1) // per_seller + 1
+        for _ in range(per_product):
+            rows.append({
+                "sender_id": first_buyer + rng.randrange(buyers), "receiver_id": seller_id,
+                "product_id": product_id, "content": "Is this still available in my size? " * 4,
+                "is_read": rng.random() < 0.5,
+            })
+    for start in range(0, len(rows), 10000):
+        db.session.execute(Message.__table__.insert(), rows[start:start + 10000])
+    db.session.commit()
+    return first_buyer
+
+
+# =========================
+# ORM PATHS (before app/read_models.py)
+# =========================
+def orm_dashboard(db, seller_id):
+    from app.models import Category, Product
+
+    return Product.query.filter_by(seller_id=seller_id).all(), Category.query.filter_by(seller_id=seller_id).all()
+
+
+def orm_sellers(db):
+    from app.models import Product, SellerProfile, User
+
+    in_stock = db.select(Product.id).where(Product.seller_id == User.id, Product.stock_quantity > 0).exists()
+    return (
+        db.session.query(User, SellerProfile)
+        .outerjoin(SellerProfile, SellerProfile.user_id == User.id)
+        .filter(User.role == "seller", in_stock)
+        .order_by(User.id)
+        .all()
+    )
+
+
+def orm_seller_inbox(db, seller_id):
+    from app.models import Message, Product
+
+    products_info = []
+    for product in Product.query.filter_by(seller_id=seller_id).all():
+        messages = Message.query.filter_by(product_id=product.id).order_by(Message.timestamp.desc()).all()
+        buyers = {}
+        for msg in messages:
+            if msg.sender_id == seller_id or not msg.product:
+                continue
+            buyers.setdefault(msg.sender_id, {"id": msg.sender_id, "username": msg.sender.username})
+        unread = Message.query.filter_by(product_id=product.id, receiver_id=seller_id, is_read=False).count()
+        if buyers:
+            products_info.append({"product": product, "buyers": list(buyers.values()), "unread_messages_count": unread})
+    return products_info
+
+
+def orm_buyer_inbox(db, user_id):
+    from app.models import Message
+
+    messages = Message.query.filter(
+        (Message.sender_id == user_id) | (Message.receiver_id == user_id)
+    ).order_by(Message.timestamp.desc()).all()
+    products = {}
+    for msg in messages:
+        if msg.product and msg.product.id not in products:
+            products[msg.product.id] = {"product": msg.product, "last_message": msg.content, "timestamp": msg.timestamp}
+    return list(products.values())
+
+
+# =========================
+# MEASURING
+# =========================
+def measure(db, function, repeat):
+    """``(p50 ms, peak KiB, gen-0 collections per call)``, each call on a fresh session."""
+    timings = []
+    collections = sum(stat["collections"] for stat in gc.get_stats())
+    for _ in range(repeat):
+        db.session.remove()
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1e3)
+    collections = sum(stat["collections"] for stat in gc.get_stats()) - collections
+    timings.sort()
+
+    db.session.remove()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings[len(timings) // 2], peak / 1024, collections / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sellers", type=int, default=200)
+    parser.add_argument("--products-per-seller", type=int, default=500)
+    parser.add_argument("--buyers", type=int, default=50)
+    parser.add_argument("--messages-per-product", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    path = tempfile.mktemp(suffix=".db")
+    atexit.register(os.remove, path)
+    os.environ["DATABASE_URL"] = "sqlite:///" + path
+    os.environ.setdefault("CLOUDINARY_BACKEND", "fake")
+    from app import create_app, db
+    from app.models import Product, User
+    from app import read_models
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        total = populate(db, args.sellers, args.products_per_seller)
+        buyer = add_messages(db, args.sellers, args.products_per_seller, args.buyers, args.messages_per_product)
+        db.session.execute(db.text("ANALYZE"))
+        db.session.commit()
+        print(f"products {total:,}, messages {total * args.messages_per_product:,} "
+              f"(loaded in {time.perf_counter() - started:.1f}s)\n")
+
+        seller = 1
+        in_stock = db.select(Product.id).where(Product.seller_id == User.id, Product.stock_quantity > 0).exists()
+        pages = (
+            (f"seller dashboard ({args.products_per_seller} products)",
+             lambda: orm_dashboard(db, seller),
+             lambda: (read_models.product_cards(Product.seller_id == seller), read_models.category_options(seller))),
+            (f"seller list ({args.sellers} sellers)",
+             lambda: orm_sellers(db),
+             lambda: read_models.fetch(
+                 read_models.SellerCard,
+                 read_models.seller_cards().where(User.role == "seller", in_stock).order_by(User.id))),
+            ("seller inbox",
+             lambda: orm_seller_inbox(db, seller),
+             lambda: read_models.seller_threads(seller)),
+            ("buyer inbox",
+             lambda: orm_buyer_inbox(db, buyer),
+             lambda: read_models.buyer_threads(buyer)),
+        )
+        print(f"{'':<34} {'p50 ms':>9} {'peak KiB':>10} {'GCs/call':>9}")
+        for label, orm, rows in pages:
+            print(label)
+            for name, function in (("ORM entities", orm), ("read models", rows)):
+                p50, peak, collections = measure(db, function, args.repeat)
+                print(f"  {name:<32} {p50:9.2f} {peak:10,.0f} {collections:9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark the "sellers near me" query on a synthetic SQLite database.
+
+Creates sellers clustered around a few cities, gives most of them a product
+in stock, and times ``nearby_sellers`` for random origins and radii.
+
+    python benchmarks/nearby_sellers.py --sellers 100000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CITIES = [
+    (-1.2833, 36.8167), (-4.0547, 39.6636), (6.5244, 3.3792), (5.6037, -0.1870),
+    (-26.2041, 28.0473), (30.0444, 31.2357), (9.0300, 38.7400), (-6.7924, 39.2083),
+]
+
+
+def populate(db, n, seed=0):
+    from app.geo import encode
+    from app.models import Product, SellerProfile, User
+
+    rng = random.Random(seed)
+    users, profiles, products = [], [], []
+    for i in range(1, n + 1):
+        lat, lon = rng.choice(CITIES)
+        lat += rng.gauss(0, 0.5)
+        lon += rng.gauss(0, 0.5)
+        users.append({"id": i, "username": f"seller{i}", "email": f"seller{i}@example.com", "role": "seller"})
+        profiles.append({
+            "user_id": i, "shop_name": f"Shop {i}",
+            "latitude": lat, "longitude": lon, "geohash": encode(lat, lon),
+        })
+        products.append({
+            "name": f"Shoe {i}", "price": 10.0, "seller_id": i,
+            "stock_quantity": 0 if rng.random() < 0.2 else rng.randint(1, 10),
+        })
+    for model, rows in ((User, users), (SellerProfile, profiles), (Product, products)):
+        for start in range(0, len(rows), 10000):
+            db.session.execute(model.__table__.insert(), rows[start:start + 10000])
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sellers", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--per-page", type=int, default=24)
+    args = parser.parse_args()
+
+    path = tempfile.mktemp(suffix=".db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + path
+    os.environ.setdefault("CLOUDINARY_BACKEND", "fake")
+    from app import create_app, db
+    from app.geo import nearby_sellers
+
+    app = create_app()
+    with app.app_context():
+        started = time.perf_counter()
+        populate(db, args.sellers)
+        print(f"sellers             {args.sellers:,} (loaded in {time.perf_counter() - started:.1f}s)")
+
+        rng = random.Random(1)
+        for radius in (5, 25, 100):
+            timings, totals = [], []
+            for _ in range(args.queries):
+                lat, lon = rng.choice(CITIES)
+                lat += rng.gauss(0, 0.3)
+                lon += rng.gauss(0, 0.3)
+                started = time.perf_counter()
+                rows, total = nearby_sellers(lat, lon, radius, page=1, per_page=args.per_page)
+                timings.append((time.perf_counter() - started) * 1000)
+                totals.append(total)
+                db.session.rollback()
+            timings.sort()
+            print(
+                f"{radius:>4} km  matches {statistics.median(totals):>7,.0f}  "
+                f"p50 {timings[len(timings) // 2]:7.2f}ms  p95 {timings[int(len(timings) * 0.95)]:7.2f}ms"
+            )
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
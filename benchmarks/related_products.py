@@ -0,0 +1,77 @@
+"""Benchmark the related-products build on a synthetic catalogue.
+
+Times TF-IDF construction and the batched top-k similarity pass that
+``flask related build --full`` performs, without touching a database.
+
+    python benchmarks/related_products.py --products 1000000
+"""
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.related import build_matrix, candidate_index, document_tokens, top_k  # noqa: E402
+
+WORDS = (
+    "leather suede canvas mesh rubber sole lace slip on boot sandal sneaker loafer "
+    "heel flat oxford derby brogue mule slipper trainer runner hiking work formal "
+    "casual handmade classic vintage retro woven beaded ankara aso oke kente black "
+    "brown tan white red blue green navy grey beige cream burgundy gold silver"
+).split()
+CATEGORIES = ["Men", "Women", "Kids", "Sandals", "Boots", "Sneakers", "Formal", "Traditional"]
+SIZES = ["EU 38", "EU 40", "EU 42", "EU 44", "UK 6", "UK 8", "UK 10", "US 9", "US 11"]
+
+
+def synthetic_catalogue(n, seed=0, vocabulary=50_000):
+    """Shoe words plus a Zipf-distributed long tail, like real listings."""
+    rng = random.Random(seed)
+    tail = [f"w{i}" for i in range(vocabulary)]
+    cumulative = list(itertools.accumulate(1 / (rank + 1) for rank in range(vocabulary)))
+    for _ in range(n):
+        words = rng.choices(WORDS, k=2) + rng.choices(tail, cum_weights=cumulative, k=2)
+        description = rng.choices(WORDS, k=4) + rng.choices(tail, cum_weights=cumulative, k=8)
+        yield document_tokens(
+            " ".join(words),
+            " ".join(description),
+            rng.choice(SIZES),
+            rng.choice(CATEGORIES),
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--k", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--max-df", type=float, default=0.3)
+    parser.add_argument("--max-postings", type=int, default=1000)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    docs = list(synthetic_catalogue(args.products))
+    generated = time.perf_counter()
+
+    matrix = build_matrix(docs, max_df=args.max_df)
+    postings = candidate_index(matrix, args.max_postings)
+    del docs
+    vectorised = time.perf_counter()
+
+    neighbours = sum(
+        1 for _ in top_k(matrix, range(matrix.shape[0]), args.k, args.batch_size, postings=postings)
+    )
+    ranked = time.perf_counter()
+
+    print(f"products            {args.products:,}")
+    print(f"vocabulary          {matrix.shape[1]:,} terms, {matrix.nnz:,} non-zeros")
+    print(f"generate            {generated - started:8.2f}s")
+    print(f"tf-idf matrix       {vectorised - generated:8.2f}s")
+    print(f"top-{args.k} neighbours     {ranked - vectorised:8.2f}s ({neighbours:,} lists)")
+    print(f"per product         {(ranked - generated) / args.products * 1e6:8.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""Throughput of each gunicorn serving profile under reads mixed with slow uploads.
+
+Fills a temporary SQLite database (or ``--database-url``) with a catalogue,
+then for each profile in gunicorn.conf.py starts gunicorn with it and runs
+``--clients`` concurrent clients for ``--seconds``. Each client is logged
+in as a seller and loops over:
+
+* reads: a storefront page, a product page and an API batch call;
+* with probability ``--upload-share``, adding a product with an image.
+  Cloudinary is the in-memory fake with ``--upload-latency`` seconds per
+  call, which stands in for a slow upload.
+
+Reports requests per second, read and upload latency, and refused
+(429) or failed requests per profile. Profiles whose worker class cannot
+be imported (gevent) are skipped.
+
+    python benchmarks/serving_profiles.py --workers 2 --clients 32 --seconds 20
+"""
+import argparse
+import atexit
+import http.cookiejar
+import importlib.util
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api_vs_html import populate  # noqa: E402
+
+PASSWORD = "benchmark"
+CSRF = re.compile(rb'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def seed(database_url, sellers, per_seller):
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.setdefault("CLOUDINARY_BACKEND", "fake")
+    from app import create_app, db
+    from app.models import User
+    from werkzeug.security import generate_password_hash
+
+    app = create_app()
+    with app.app_context():
+        total = populate(db, sellers, per_seller)
+        # One hash for everyone; hashing per user would dominate seeding
+        db.session.execute(db.update(User).values(password_hash=generate_password_hash(PASSWORD)))
+        db.session.commit()
+    return total
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Client:
+    """One browser: its own cookies and CSRF token."""
+
+    def __init__(self, base, seller_id):
+        self.base = base
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.seller_id = seller_id
+
+    def request(self, path, data=None, headers=None):
+        request = urllib.request.Request(self.base + path, data=data, headers=headers or {})
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as error:
+            return error.code, b""
+
+    def token(self, path):
+        return CSRF.search(self.request(path)[1]).group(1).decode()
+
+    def login(self):
+        body = urllib.parse.urlencode({
+            "csrf_token": self.token("/login"),
+            "email": f"seller{self.seller_id}@example.com",
+            "password": PASSWORD,
+        }).encode()
+        # Login takes 4 requests at a time per worker
+        while self.request("/login", body)[0] == 429:
+            time.sleep(0.1)
+
+    def add_product(self):
+        boundary = uuid.uuid4().hex
+        fields = {
+            "csrf_token": self.token("/seller/product/add"), "name": "Benchmark shoe", "price": "25",
+            "category_id": str(self.seller_id), "size_unit": "EU 42", "stock_quantity": "1",
+        }
+        parts = [
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            for name, value in fields.items()
+        ]
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="product_image1"; filename="shoe.jpg"\r\n'
+            f"Content-Type: image/jpeg\r\n\r\n".encode() + os.urandom(2048) + b"\r\n"
+        )
+        parts.append(f"--{boundary}--\r\n".encode())
+        return self.request(
+            "/seller/product/add", b"".join(parts),
+            {"Content-Type": f"multipart/form-data; boundary={boundary}"},
+        )[0]
+
+
+def run_client(base, args, total_products, deadline, results, seed_value):
+    rng = random.Random(seed_value)
+    client = Client(base, rng.randint(1, args.sellers))
+    client.login()
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        if rng.random() < args.upload_share:
+            kind, status = "upload", client.add_product()
+        else:
+            ids = ",".join(str(rng.randint(1, total_products)) for _ in range(12))
+            path = rng.choice((
+                f"/buyers/seller/{rng.randint(1, args.sellers)}/products",
+                f"/product/{rng.randint(1, total_products)}",
+                f"/api/v1/products/batch?ids={ids}",
+            ))
+            kind, status = "read", client.request(path, headers={"Referer": "/"})[0]
+        elapsed = time.perf_counter() - started
+        if status == 429:
+            kind = "refused"
+        elif status >= 400:
+            kind = "failed"
+        results.append((kind, elapsed))
+
+
+def percentile(values, share):
+    return values[min(int(len(values) * share), len(values) - 1)] * 1000 if values else float("nan")
+
+
+def bench_profile(profile, database_url, total_products, args):
+    port = free_port()
+    metrics_dir = tempfile.mkdtemp()
+    env = dict(
+        os.environ, GUNICORN_PROFILE=profile, WEB_CONCURRENCY=str(args.workers),
+        GUNICORN_THREADS=str(args.threads), DATABASE_URL=database_url,
+        CLOUDINARY_BACKEND="fake", CLOUDINARY_FAKE_LATENCY=str(args.upload_latency),
+        RATELIMIT_ENABLED="0", PROMETHEUS_MULTIPROC_DIR=metrics_dir,
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}", "shoemart:create_app()"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(300):
+            try:
+                urllib.request.urlopen(base + "/api/v1/products?limit=1", timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError(f"gunicorn ({profile}) did not start")
+
+        results = []
+        deadline = time.perf_counter() + args.seconds
+        clients = [
+            threading.Thread(target=run_client, args=(base, args, total_products, deadline, results, n))
+            for n in range(args.clients)
+        ]
+        started = time.perf_counter()
+        for thread in clients:
+            thread.start()
+        for thread in clients:
+            thread.join()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+
+    by_kind = {kind: sorted(t for k, t in results if k == kind) for kind in ("read", "upload", "refused", "failed")}
+    served = len(by_kind["read"]) + len(by_kind["upload"])
+    print(
+        f"{profile:<8} {served / elapsed:8.1f} req/s  "
+        f"read p50 {percentile(by_kind['read'], 0.5):7.1f}ms p95 {percentile(by_kind['read'], 0.95):7.1f}ms  "
+        f"upload p50 {percentile(by_kind['upload'], 0.5):7.1f}ms  "
+        f"{len(by_kind['upload'])} uploads, {len(by_kind['refused'])} refused, {len(by_kind['failed'])} failed"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", default="sync,gthread,gevent")
+    parser.add_argument("--database-url", help="Defaults to a temporary SQLite file.")
+    parser.add_argument("--sellers", type=int, default=50)
+    parser.add_argument("--products-per-seller", type=int, default=24)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--upload-share", type=float, default=0.1)
+    parser.add_argument("--upload-latency", type=float, default=1.0)
+    args = parser.parse_args()
+
+    database_url = args.database_url
+    if database_url is None:
+        path = tempfile.mktemp(suffix=".db")
+        atexit.register(os.remove, path)
+        database_url = "sqlite:///" + path
+    total = seed(database_url, args.sellers, args.products_per_seller)
+    print(f"products {total:,}; {args.workers} workers, {args.clients} clients, "
+          f"{args.upload_share:.0%} uploads at {args.upload_latency}s\n")
+
+    for profile in args.profiles.split(","):
+        if profile == "gevent" and importlib.util.find_spec("gevent") is None:
+            print(f"{profile:<8} skipped (gevent is not installed)")
+            continue
+        bench_profile(profile, database_url, total, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Storefront facet counts: GROUP BY queries against the columnar snapshot.
+
+Fills a temporary SQLite database with sellers, products and sizes, then
+times the counts for one seller's products page (sizes in stock, price
+steps and categories, each with the other filters applied) two ways:
+
+* three GROUP BY queries per page view;
+* ``CatalogSnapshot.facets`` over this worker's NumPy arrays (app/facets.py).
+
+Also reports how long a full snapshot load takes, its size per product,
+and how long patching in a few changed products takes.
+
+    python benchmarks/storefront_facets.py --sellers 2000 --products-per-seller 50
+"""
+import argparse
+import atexit
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_vs_html import populate  # noqa: E402
+
+
+def timed(function, repeat):
+    """Microseconds per call (p50, p95)."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1e6)
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def group_by_facets(db, seller_id, size, max_price, steps):
+    from app.models import Product, ProductVariant
+
+    sizes = db.session.execute(
+        db.select(ProductVariant.size_system, ProductVariant.size, db.func.count())
+        .join(Product, Product.id == ProductVariant.product_id)
+        .where(Product.seller_id == seller_id, ProductVariant.stock > 0, Product.price <= max_price)
+        .group_by(ProductVariant.size_system, ProductVariant.size)
+    ).all()
+    with_size = (
+        db.select(ProductVariant.product_id)
+        .join(Product, Product.id == ProductVariant.product_id)
+        .where(
+            Product.seller_id == seller_id, ProductVariant.size_system == size[0],
+            ProductVariant.size == size[1], ProductVariant.stock > 0,
+        )
+    )
+    step = db.case(*[(Product.price <= s, s) for s in steps], else_=None)
+    prices = db.session.execute(
+        db.select(step, db.func.count())
+        .where(Product.seller_id == seller_id, Product.id.in_(with_size))
+        .group_by(step)
+    ).all()
+    categories = db.session.execute(
+        db.select(Product.category_id, db.func.count())
+        .where(Product.seller_id == seller_id, Product.id.in_(with_size), Product.price <= max_price)
+        .group_by(Product.category_id)
+    ).all()
+    return sizes, prices, categories
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sellers", type=int, default=2000)
+    parser.add_argument("--products-per-seller", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    path = tempfile.mktemp(suffix=".db")
+    atexit.register(os.remove, path)
+    os.environ["DATABASE_URL"] = "sqlite:///" + path
+    os.environ.setdefault("CLOUDINARY_BACKEND", "fake")
+    from app import create_app, db
+    from app.facets import _records, load_snapshot
+
+    app = create_app()
+    steps = app.config["FACET_PRICE_STEPS"] = [25.0, 50.0, 100.0, 150.0]
+    with app.app_context():
+        started = time.perf_counter()
+        total = populate(db, args.sellers, args.products_per_seller)
+        print(f"products            {total:,} (loaded in {time.perf_counter() - started:.1f}s)")
+        # Without statistics SQLite picks the size index and scans every seller's EU 42
+        db.session.execute(db.text("ANALYZE"))
+
+        started = time.perf_counter()
+        snapshot = load_snapshot()
+        print(f"snapshot load       {time.perf_counter() - started:.2f}s, {snapshot.nbytes / 1024:,.0f} KiB "
+              f"({snapshot.nbytes / len(snapshot):.1f} bytes per product incl. sizes)")
+
+        rng = random.Random(0)
+        seller = rng.randint(1, args.sellers)
+        size, max_price = ("EU", 42.0), 100.0
+        changed = [(seller - 1) * args.products_per_seller + n for n in range(1, 6)]
+        products, sizes = _records(db.session.execute, changed)
+        p50, p95 = timed(lambda: snapshot.patched(changed, products, sizes), 50)
+        print(f"patch {len(changed)} products    p50 {p50:9.1f}us  p95 {p95:9.1f}us")
+        patched = snapshot.patched(changed, products, sizes)
+
+        print(f"\nfacets for one seller ({args.products_per_seller} products), size {size[0]} {size[1]:g}, "
+              f"max price {max_price:g}")
+        for label, function in (
+            ("3 GROUP BY queries", lambda: group_by_facets(db, seller, size, max_price, steps)),
+            ("CatalogSnapshot.facets", lambda: snapshot.facets(seller, size=size, max_price=max_price, price_steps=steps)),
+            ("  ...after the patch", lambda: patched.facets(seller, size=size, max_price=max_price, price_steps=steps)),
+        ):
+            p50, p95 = timed(function, args.repeat)
+            print(f"{label:<24} p50 {p50:9.1f}us  p95 {p95:9.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -17,3 +17,160 @@ class Config:
         )
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool per worker; gunicorn.conf.py sizes it for the worker model
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        key: int(os.environ[name])
+        for key, name in (
+            ('pool_size', 'DB_POOL_SIZE'),
+            ('max_overflow', 'DB_MAX_OVERFLOW'),
+            ('pool_timeout', 'DB_POOL_TIMEOUT'),
+        )
+        if os.environ.get(name)
+    }
+
+    # Optional read replicas (comma-separated URLs); GET requests read from them
+    SQLALCHEMY_REPLICA_URIS = [
+        uri.strip().replace("postgres://", "postgresql://", 1)
+        for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if uri.strip()
+    ]
+    # After a write, the same client reads from the primary for this long
+    READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+    REPLICA_HEALTH_INTERVAL = int(os.environ.get('REPLICA_HEALTH_INTERVAL', 10))
+    REPLICA_RETRY_SECONDS = int(os.environ.get('REPLICA_RETRY_SECONDS', 30))
+
+    # Conversations idle for longer than this are moved to compressed cold storage
+    MESSAGE_ARCHIVE_AFTER_DAYS = int(os.environ.get('MESSAGE_ARCHIVE_AFTER_DAYS', 180))
+    # Number of messages shown per page in a conversation
+    CONVERSATION_PAGE_SIZE = int(os.environ.get('CONVERSATION_PAGE_SIZE', 50))
+
+    # "cloudinary" for the real service, "fake" for the in-memory stand-in
+    CLOUDINARY_BACKEND = os.environ.get('CLOUDINARY_BACKEND', 'cloudinary')
+
+    # Throttling for login, registration, messaging and uploads.
+    # "memory" keeps counters per worker, "database" shares them across workers.
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', '1') == '1'
+    RATELIMIT_STORAGE = os.environ.get('RATELIMIT_STORAGE', 'memory')
+    # How often each worker deletes expired "database" counters
+    RATELIMIT_PRUNE_SECONDS = float(os.environ.get('RATELIMIT_PRUNE_SECONDS', 600))
+    # Proxies in front of the app that append to X-Forwarded-For (Render's
+    # router is one). Set to 0 when clients connect directly, or they could
+    # pick their own address.
+    PROXY_FIX_HOPS = int(os.environ.get('PROXY_FIX_HOPS', 1))
+
+    # Outgoing mail (sent from the outbox by `flask mail send`)
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'localhost')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 1025))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', '0') == '1'
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'no-reply@afrido.local')
+    MAIL_DIGEST_DELAY_MINUTES = int(os.environ.get('MAIL_DIGEST_DELAY_MINUTES', 10))
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', 5))
+    # Public address of the site, for links built outside a request
+    SITE_URL = os.environ.get('SITE_URL', 'http://localhost:5000')
+
+    # Neighbours stored per product by `flask related build`
+    RELATED_PRODUCTS_K = int(os.environ.get('RELATED_PRODUCTS_K', 8))
+
+    # Product view counters are buffered per worker and flushed in batches
+    ANALYTICS_FLUSH_SECONDS = float(os.environ.get('ANALYTICS_FLUSH_SECONDS', 30))
+    ANALYTICS_FLUSH_SIZE = int(os.environ.get('ANALYTICS_FLUSH_SIZE', 500))
+
+    # On-demand request profiling (see app/profiling.py). Off by default;
+    # when off, no profiling hooks are installed.
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'
+    # Fraction of requests profiled at random, e.g. 0.01
+    PROFILER_SAMPLE_RATE = float(os.environ.get('PROFILER_SAMPLE_RATE', 0))
+    # Shared secret for profiling a request with `X-Profile: <token>`
+    PROFILER_TOKEN = os.environ.get('PROFILER_TOKEN')
+    PROFILER_INTERVAL = float(os.environ.get('PROFILER_INTERVAL', 0.001))
+    PROFILER_KEEP = int(os.environ.get('PROFILER_KEEP', 200))
+    if os.environ.get('PROFILER_DIR'):
+        PROFILER_DIR = os.environ['PROFILER_DIR']
+    # Users allowed on /admin/profiles and to profile with a bare X-Profile header
+    ADMIN_EMAILS = [
+        email.strip().lower()
+        for email in os.environ.get('ADMIN_EMAILS', '').split(',')
+        if email.strip()
+    ]
+
+    # Prometheus metrics at /metrics. Scrapes send `Authorization: Bearer
+    # <METRICS_TOKEN>`; without a token only localhost is answered.
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+    # Offline gazetteer for resolving seller locations (GeoNames dump or
+    # name<TAB>lat<TAB>lon file); see app/geo.py
+    GAZETTEER_PATH = os.environ.get(
+        'GAZETTEER_PATH', os.path.join(basedir, 'instance', 'gazetteer.tsv')
+    )
+    # "Sellers near me" search radius and page size
+    NEARBY_DEFAULT_KM = float(os.environ.get('NEARBY_DEFAULT_KM', 25))
+    NEARBY_MAX_KM = float(os.environ.get('NEARBY_MAX_KM', 500))
+    NEARBY_PAGE_SIZE = int(os.environ.get('NEARBY_PAGE_SIZE', 24))
+
+    # In-process typeahead index behind /autocomplete
+    AUTOCOMPLETE_MAX_ENTRIES = int(os.environ.get('AUTOCOMPLETE_MAX_ENTRIES', 100000))
+    # Full rebuild interval, to pick up writes made by other workers
+    AUTOCOMPLETE_REFRESH_SECONDS = float(os.environ.get('AUTOCOMPLETE_REFRESH_SECONDS', 300))
+    # Build in-process indexes when the app starts rather than on first use;
+    # the Procfile turns this off for commands that serve no pages
+    PRELOAD_INDEXES = os.environ.get('PRELOAD_INDEXES', '1') == '1'
+
+    # Compiled templates are cached on disk and shared by all workers
+    # (see app/templating.py); TEMPLATE_CACHE_DIR defaults to Jinja's temp dir
+    TEMPLATE_BYTECODE_CACHE = os.environ.get('TEMPLATE_BYTECODE_CACHE', '1') == '1'
+    if os.environ.get('TEMPLATE_CACHE_DIR'):
+        TEMPLATE_CACHE_DIR = os.environ['TEMPLATE_CACHE_DIR']
+    # Compile every template when the app starts rather than on first use
+    TEMPLATE_PRECOMPILE = os.environ.get('TEMPLATE_PRECOMPILE', '1') == '1'
+    # Raise if a template queries the database while rendering
+    TEMPLATE_STRICT_QUERIES = os.environ.get('TEMPLATE_STRICT_QUERIES', '0') == '1'
+    # Log renders slower than this (0 disables)
+    TEMPLATE_RENDER_BUDGET_MS = float(os.environ.get('TEMPLATE_RENDER_BUDGET_MS', 50))
+
+    # Postgres timeouts for `flask db upgrade` (see app/online_migrations.py):
+    # DDL gives up on a busy table instead of stalling traffic behind it
+    MIGRATION_LOCK_TIMEOUT = os.environ.get('MIGRATION_LOCK_TIMEOUT', '5s')
+    MIGRATION_STATEMENT_TIMEOUT = os.environ.get('MIGRATION_STATEMENT_TIMEOUT', '10min')
+
+    # JSON API (see app/api.py): default and largest page, ids per batch call
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 24))
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 100))
+    API_BATCH_MAX = int(os.environ.get('API_BATCH_MAX', 100))
+
+    # Cloudinary circuit breaker (see app/media.py): per-request timeout, calls
+    # slower than CLOUDINARY_SLOW_SECONDS count as failures, and after
+    # CLOUDINARY_BREAKER_FAILURES in a row calls are refused for the reset period
+    CLOUDINARY_TIMEOUT = float(os.environ.get('CLOUDINARY_TIMEOUT', 10))
+    CLOUDINARY_SLOW_SECONDS = float(os.environ.get('CLOUDINARY_SLOW_SECONDS', 5))
+    CLOUDINARY_BREAKER_FAILURES = int(os.environ.get('CLOUDINARY_BREAKER_FAILURES', 5))
+    CLOUDINARY_BREAKER_RESET_SECONDS = float(os.environ.get('CLOUDINARY_BREAKER_RESET_SECONDS', 30))
+    # Simulated latency (seconds) and failure rate (0-1) for CLOUDINARY_BACKEND=fake
+    CLOUDINARY_FAKE_LATENCY = float(os.environ.get('CLOUDINARY_FAKE_LATENCY', 0))
+    CLOUDINARY_FAKE_ERROR_RATE = float(os.environ.get('CLOUDINARY_FAKE_ERROR_RATE', 0))
+
+    # Trending feed (see app/trending.py): scores halve every
+    # TRENDING_HALF_LIFE_HOURS and are dropped below TRENDING_MIN_SCORE
+    TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 24))
+    TRENDING_MIN_SCORE = float(os.environ.get('TRENDING_MIN_SCORE', 0.01))
+    TRENDING_FEED_SIZE = int(os.environ.get('TRENDING_FEED_SIZE', 12))
+
+    # Storefront facet counts come from a per-worker snapshot (see app/facets.py),
+    # reloaded this often to pick up other workers' writes
+    FACETS_REFRESH_SECONDS = float(os.environ.get('FACETS_REFRESH_SECONDS', 300))
+    # How often committed product changes are patched into the snapshot
+    FACETS_APPLY_SECONDS = float(os.environ.get('FACETS_APPLY_SECONDS', 2))
+    # "Up to" price links on a storefront
+    FACET_PRICE_STEPS = [
+        float(step) for step in os.environ.get('FACET_PRICE_STEPS', '5000,10000,20000,50000').split(',')
+    ]
+
+    # Service worker for offline browsing (see app/offline.py). The version
+    # defaults to a hash of the static files and templates.
+    SERVICE_WORKER_ENABLED = os.environ.get('SERVICE_WORKER_ENABLED', '1') == '1'
+    SERVICE_WORKER_VERSION = os.environ.get('SERVICE_WORKER_VERSION')
+    SERVICE_WORKER_IMAGE_CACHE_MB = int(os.environ.get('SERVICE_WORKER_IMAGE_CACHE_MB', 50))
+    SERVICE_WORKER_PAGE_CACHE_ENTRIES = int(os.environ.get('SERVICE_WORKER_PAGE_CACHE_ENTRIES', 50))
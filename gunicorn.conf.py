@@ -0,0 +1,88 @@
+"""gunicorn settings, picked up automatically from the working directory.
+
+``GUNICORN_PROFILE`` picks the worker model:
+
+* ``gthread`` (default): ``GUNICORN_THREADS`` threads per worker, so a
+  request waiting on Cloudinary or the database holds one thread instead of
+  a whole worker.
+* ``gevent``: up to ``GUNICORN_WORKER_CONNECTIONS`` greenlets per worker.
+  Needs gevent and psycogreen; psycopg2 is patched to yield while it waits.
+* ``sync``: one request at a time per worker, as before.
+
+The app is loaded once in the master (``preload_app``) and workers are
+forked from it, so they share its memory until they write to it. Each
+worker then drops the database connections it inherited and opens its own.
+
+Each worker's connection pool is sized for its concurrency, within
+``DB_CONNECTION_BUDGET`` connections per database for all workers together.
+``benchmarks/serving_profiles.py`` compares the profiles.
+"""
+import gc
+import multiprocessing
+import os
+import shutil
+
+PROFILES = ("gthread", "gevent", "sync")
+profile = os.environ.get("GUNICORN_PROFILE", "gthread")
+if profile not in PROFILES:
+    raise RuntimeError(f"GUNICORN_PROFILE must be one of {', '.join(PROFILES)}, not {profile!r}")
+
+if profile == "gevent":
+    # Before the app is preloaded, so everything it imports cooperates.
+    # Neither package is in requirements.txt: only this profile needs them.
+    try:
+        from gevent import monkey
+        monkey.patch_all()
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
+    except ImportError as exc:
+        raise RuntimeError(
+            f"GUNICORN_PROFILE=gevent needs the gevent and psycogreen packages ({exc}); "
+            "install them with `pip install gevent psycogreen`"
+        ) from exc
+
+preload_app = True
+worker_class = profile
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get("GUNICORN_THREADS", 4)) if profile == "gthread" else 1
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+
+# Requests one worker serves at once. A request can hold two connections
+# (its session plus a rate-limit or analytics write), so the pool may grow
+# to twice that, capped by this worker's share of the budget.
+concurrency = {"gthread": threads, "gevent": worker_connections, "sync": 1}[profile]
+pool_cap = max(min(2 * concurrency, int(os.environ.get("DB_CONNECTION_BUDGET", 90)) // workers), 2)
+os.environ.setdefault("DB_POOL_SIZE", str(pool_cap // 2))
+os.environ.setdefault("DB_MAX_OVERFLOW", str(pool_cap - pool_cap // 2))
+
+# Metrics from every worker are written here and summed by /metrics.
+# Must be set, and the directory exist, before the app (and
+# prometheus_client) is imported: with preload_app that happens before any
+# server hook runs. Counters left over from a previous run would be added
+# to this one's, so start empty.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/afrido-prometheus")
+shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+
+def when_ready(server):
+    # The preloaded app is never collected; moving it out of the collector's
+    # reach stops garbage collection in workers from touching (and so
+    # copying) the pages it lives on
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading (create_all, template precompile)
+    # belong to the master; close=False leaves them to it
+    from app import db
+    app = server.app.wsgi()
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -5,6 +5,8 @@ from flask import current_app
 
 from alembic import context
 
+from app.online_migrations import configure_session
+
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
@@ -94,9 +96,18 @@ def run_migrations_online():
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
 
+    # Commit each revision on its own, so one that times out does not undo
+    # the ones before it (see app/online_migrations.py)
+    conf_args.setdefault("transaction_per_migration", True)
+
     connectable = get_engine()
 
     with connectable.connect() as connection:
+        configure_session(
+            connection,
+            lock_timeout=current_app.config['MIGRATION_LOCK_TIMEOUT'],
+            statement_timeout=current_app.config['MIGRATION_STATEMENT_TIMEOUT'],
+        )
         context.configure(
             connection=connection,
             target_metadata=get_metadata(),
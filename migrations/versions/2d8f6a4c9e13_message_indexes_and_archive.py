@@ -0,0 +1,72 @@
+"""message indexes and the message_archive cold store
+
+Revision ID: 2d8f6a4c9e13
+Revises: 5a9d2c7e31b8
+Create Date: 2026-10-19 15:00:00
+
+The inbox and conversation indexes on ``message`` are built with CREATE
+INDEX CONCURRENTLY on Postgres (see app/online_migrations.py), so the
+table stays writable while they build. ``message_archive`` is new, so its
+indexes are created directly; on Postgres it is range-partitioned by
+month and app/message_store.py adds partitions as it archives.
+
+``sqlite_autoincrement`` on ``message`` only applies to databases created
+from the models; existing SQLite databases keep plain rowid reuse.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.online_migrations import create_index_online, drop_index_online
+
+
+# revision identifiers, used by Alembic.
+revision = '2d8f6a4c9e13'
+down_revision = '5a9d2c7e31b8'
+branch_labels = None
+depends_on = None
+
+MESSAGE_INDEXES = (
+    ('ix_message_sender_id', ['sender_id']),
+    ('ix_message_receiver_id', ['receiver_id']),
+    ('ix_message_timestamp', ['timestamp']),
+    ('ix_message_product_timestamp', ['product_id', 'timestamp']),
+    ('ix_message_receiver_read', ['receiver_id', 'is_read']),
+)
+
+
+def upgrade():
+    for name, columns in MESSAGE_INDEXES:
+        create_index_online(name, 'message', columns)
+
+    if not sa.inspect(op.get_bind()).has_table('message_archive'):
+        op.create_table(
+            'message_archive',
+            sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('month', sa.Date(), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=True),
+            sa.Column('user_low_id', sa.Integer(), nullable=False),
+            sa.Column('user_high_id', sa.Integer(), nullable=False),
+            sa.Column('first_timestamp', sa.DateTime(), nullable=True),
+            sa.Column('last_timestamp', sa.DateTime(), nullable=True),
+            sa.Column('message_count', sa.Integer(), nullable=True),
+            sa.Column('preview', sa.String(length=200), nullable=True),
+            sa.Column('payload', sa.LargeBinary(), nullable=False),
+            sa.PrimaryKeyConstraint('id', 'month'),
+            postgresql_partition_by='RANGE (month)',
+        )
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('message_archive')}
+    if 'ix_message_archive_conversation' not in indexes:
+        op.create_index(
+            'ix_message_archive_conversation', 'message_archive',
+            ['product_id', 'user_low_id', 'user_high_id'],
+        )
+    if 'ix_message_archive_month' not in indexes:
+        op.create_index('ix_message_archive_month', 'message_archive', ['month'])
+
+
+def downgrade():
+    op.drop_index('ix_message_archive_month', table_name='message_archive')
+    op.drop_index('ix_message_archive_conversation', table_name='message_archive')
+    op.drop_table('message_archive')
+    for name, _ in reversed(MESSAGE_INDEXES):
+        drop_index_online(name, 'message')
@@ -0,0 +1,51 @@
+"""seller coordinates and geohash
+
+Revision ID: 3f1c9a2b7d10
+Revises: 
+Create Date: 2026-10-19 04:20:00
+
+Tables are created by ``db.create_all()`` at startup, so on a fresh
+database the columns already exist; this only fills in older databases.
+Run ``flask geo backfill`` afterwards to resolve existing locations.
+
+The indexes are built with CREATE INDEX CONCURRENTLY on Postgres (see
+app/online_migrations.py), so product stays writable while they build.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.online_migrations import create_index_online, drop_index_online
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a2b7d10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    columns = {c['name'] for c in inspector.get_columns('seller_profile')}
+    with op.batch_alter_table('seller_profile') as batch_op:
+        if 'latitude' not in columns:
+            batch_op.add_column(sa.Column('latitude', sa.Float(), nullable=True))
+        if 'longitude' not in columns:
+            batch_op.add_column(sa.Column('longitude', sa.Float(), nullable=True))
+        if 'geohash' not in columns:
+            batch_op.add_column(sa.Column('geohash', sa.String(length=12), nullable=True))
+
+    create_index_online(
+        'ix_seller_profile_geohash_point', 'seller_profile',
+        ['geohash', 'latitude', 'longitude', 'user_id']
+    )
+    create_index_online('ix_product_seller_stock', 'product', ['seller_id', 'stock_quantity'])
+
+
+def downgrade():
+    drop_index_online('ix_product_seller_stock', 'product')
+    drop_index_online('ix_seller_profile_geohash_point', 'seller_profile')
+    with op.batch_alter_table('seller_profile') as batch_op:
+        batch_op.drop_column('geohash')
+        batch_op.drop_column('longitude')
+        batch_op.drop_column('latitude')
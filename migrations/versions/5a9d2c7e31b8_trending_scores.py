@@ -0,0 +1,39 @@
+"""trending scores for products and sellers
+
+Revision ID: 5a9d2c7e31b8
+Revises: e7a35c90d4f1
+Create Date: 2026-10-19 12:00:00
+
+Run `flask trending rebuild` once afterwards to seed scores from existing
+messages and listings.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a9d2c7e31b8'
+down_revision = 'e7a35c90d4f1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table('trending_score'):
+        op.create_table(
+            'trending_score',
+            sa.Column('kind', sa.String(length=10), nullable=False),
+            sa.Column('subject_id', sa.Integer(), autoincrement=False, nullable=False),
+            sa.Column('score', sa.Float(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('kind', 'subject_id'),
+        )
+    indexes = {index['name'] for index in sa.inspect(op.get_bind()).get_indexes('trending_score')}
+    if 'ix_trending_score_kind_score' not in indexes:
+        op.create_index('ix_trending_score_kind_score', 'trending_score', ['kind', 'score'])
+
+
+def downgrade():
+    op.drop_index('ix_trending_score_kind_score', table_name='trending_score')
+    op.drop_table('trending_score')
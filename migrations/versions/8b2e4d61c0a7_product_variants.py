@@ -0,0 +1,132 @@
+"""product variants
+
+Revision ID: 8b2e4d61c0a7
+Revises: 3f1c9a2b7d10
+Create Date: 2026-10-19 05:00:00
+
+Creates product_variant (unless create_all already did) and fills it from
+product.size_unit in batches. The backfill skips products that already
+have variants, so an interrupted run can be finished with
+``flask variants backfill``.
+
+The size parser is a frozen copy of app/variants.py as of this revision,
+so the migration keeps doing the same thing however the app changes.
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d61c0a7'
+down_revision = '3f1c9a2b7d10'
+branch_labels = None
+depends_on = None
+
+SYSTEM_ALIASES = {"EU": "EU", "EUR": "EU", "UK": "UK", "US": "US", "USA": "US"}
+SIZE_RANGES = {"EU": (15, 52), "UK": (0, 16), "US": (0, 18)}
+MAX_RANGE_SPAN = 15
+SYSTEM_RE = re.compile(r"\b(EUR?|UK|USA?)\b")
+RANGE_RE = re.compile(r"(\d+(?:\.5)?)\s*(?:-|–|TO)\s*(\d+(?:\.5)?)")
+NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+product = sa.table(
+    'product',
+    sa.column('id', sa.Integer), sa.column('size_unit', sa.String),
+    sa.column('stock_quantity', sa.Integer), sa.column('price', sa.Float),
+)
+product_variant = sa.table(
+    'product_variant',
+    sa.column('id', sa.Integer), sa.column('product_id', sa.Integer),
+    sa.column('size_system', sa.String), sa.column('size', sa.Float),
+    sa.column('stock', sa.Integer), sa.column('price', sa.Float),
+)
+
+
+def parse_size_unit(text):
+    text = (text or "").upper()
+    match = SYSTEM_RE.search(text)
+    system = SYSTEM_ALIASES[match.group(1)] if match else None
+
+    sizes = []
+    for low, high in RANGE_RE.findall(text):
+        low, high = float(low), float(high)
+        if low < high <= low + MAX_RANGE_SPAN:
+            sizes.extend(float(s) for s in range(int(low), int(high) + 1))
+    text = RANGE_RE.sub(" ", text)
+    sizes.extend(float(n) for n in NUMBER_RE.findall(text))
+
+    # Bare numbers are only unambiguous in the EU range
+    system = system or ("EU" if sizes and min(sizes) >= 30 else None)
+    if system is None:
+        return []
+    low, high = SIZE_RANGES[system]
+    return list(dict.fromkeys(
+        (system, s) for s in sizes if low <= s <= high and (s * 2).is_integer()
+    ))
+
+
+def split_stock(total, parts):
+    share, extra = divmod(max(total or 0, 0), parts)
+    return [share + (1 if i < extra else 0) for i in range(parts)]
+
+
+def backfill_variants(bind, batch_size=1000):
+    """Variants from ``size_unit`` for products that have none, in id order."""
+    has_variants = (
+        sa.select(product_variant.c.id).where(product_variant.c.product_id == product.c.id).exists()
+    )
+    after_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(product.c.id, product.c.size_unit, product.c.stock_quantity, product.c.price)
+            .where(product.c.id > after_id, product.c.size_unit.isnot(None), ~has_variants)
+            .order_by(product.c.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        inserts = []
+        for product_id, size_unit, stock, price in rows:
+            sizes = parse_size_unit(size_unit)
+            for (system, size), share in zip(sizes, split_stock(stock, len(sizes) or 1)):
+                inserts.append({
+                    "product_id": product_id, "size_system": system, "size": size,
+                    "stock": share, "price": price,
+                })
+        if inserts:
+            bind.execute(product_variant.insert(), inserts)
+        after_id = rows[-1][0]
+
+
+def upgrade():
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if not inspector.has_table('product_variant'):
+        op.create_table(
+            'product_variant',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('product_id', sa.Integer(), nullable=False),
+            sa.Column('size_system', sa.String(length=4), nullable=False),
+            sa.Column('size', sa.Float(), nullable=False),
+            sa.Column('stock', sa.Integer(), nullable=False),
+            sa.Column('price', sa.Float(), nullable=False),
+            sa.ForeignKeyConstraint(['product_id'], ['product.id'], ondelete='CASCADE'),
+            sa.PrimaryKeyConstraint('id'),
+            sa.UniqueConstraint('product_id', 'size_system', 'size', name='uq_product_variant_size'),
+        )
+        inspector = sa.inspect(bind)
+    if 'ix_product_variant_in_stock' not in {i['name'] for i in inspector.get_indexes('product_variant')}:
+        op.create_index(
+            'ix_product_variant_in_stock', 'product_variant',
+            ['size_system', 'size', 'price', 'product_id'],
+            postgresql_where=sa.text('stock > 0'), sqlite_where=sa.text('stock > 0'),
+        )
+
+    backfill_variants(bind)
+
+
+def downgrade():
+    op.drop_index('ix_product_variant_in_stock', table_name='product_variant')
+    op.drop_table('product_variant')
@@ -0,0 +1,40 @@
+"""content-hash index of uploaded assets
+
+Revision ID: c41d7e9a5b22
+Revises: 8b2e4d61c0a7
+Create Date: 2026-10-19 07:00:00
+
+Assets uploaded before this revision are not indexed (hashing them would
+mean downloading every one); they keep being deleted directly.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9a5b22'
+down_revision = '8b2e4d61c0a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if sa.inspect(op.get_bind()).has_table('media_asset'):
+        return  # created by db.create_all() on app start
+    op.create_table(
+        'media_asset',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('sha256', sa.String(length=64), nullable=False),
+        sa.Column('public_id', sa.String(length=200), nullable=False),
+        sa.Column('url', sa.String(length=200), nullable=False),
+        sa.Column('bytes', sa.Integer(), nullable=True),
+        sa.Column('ref_count', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('sha256'),
+        sa.UniqueConstraint('public_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('media_asset')
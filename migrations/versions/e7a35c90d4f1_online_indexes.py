@@ -0,0 +1,44 @@
+"""indexes for image covers, category listings and conversations
+
+Revision ID: e7a35c90d4f1
+Revises: c41d7e9a5b22
+Create Date: 2026-10-19 09:00:00
+
+The indexes are built with CREATE INDEX CONCURRENTLY on Postgres (see
+app/online_migrations.py), so product, product_image and message stay
+writable while they build.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from app.online_migrations import create_index_online, drop_index_online
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a35c90d4f1'
+down_revision = 'c41d7e9a5b22'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if not sa.inspect(op.get_bind()).has_table('online_backfill_progress'):
+        op.create_table(
+            'online_backfill_progress',
+            sa.Column('name', sa.String(length=100), nullable=False),
+            sa.Column('last_id', sa.BigInteger(), nullable=False),
+            sa.Column('finished_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.PrimaryKeyConstraint('name'),
+        )
+
+    create_index_online('ix_product_image_product_id', 'product_image', ['product_id', 'id'])
+    create_index_online('ix_product_category_id', 'product', ['category_id'])
+    create_index_online('ix_message_conversation', 'message', ['product_id', 'sender_id', 'receiver_id', 'id'])
+
+
+def downgrade():
+    drop_index_online('ix_message_conversation', 'message')
+    drop_index_online('ix_product_category_id', 'product')
+    drop_index_online('ix_product_image_product_id', 'product_image')
+    op.drop_table('online_backfill_progress')
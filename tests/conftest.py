@@ -0,0 +1,38 @@
+"""Shared test setup: each test module gets its own app on a throwaway SQLite file.
+
+``config.Config`` reads the environment once, when it is imported, so
+settings that differ between modules are patched onto the class instead.
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["CLOUDINARY_BACKEND"] = "fake"
+os.environ["METRICS_ENABLED"] = "0"
+
+from config import Config  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def make_app(tmp_path_factory):
+    """``make_app(**config)`` creates an app with ``config`` set on ``Config``.
+
+    The primary database is a new SQLite file; the overrides last until the
+    end of the module.
+    """
+    from app import create_app
+
+    with pytest.MonkeyPatch.context() as patch:
+        def make_app(**config):
+            path = tmp_path_factory.mktemp("db") / "primary.db"
+            patch.setattr(Config, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{path}")
+            # Before create_app, so extensions see it too (Flask-Mail then
+            # records emails instead of connecting to a server)
+            patch.setattr(Config, "TESTING", True, raising=False)
+            for key, value in config.items():
+                patch.setattr(Config, key, value, raising=False)
+            return create_app()
+        yield make_app
@@ -0,0 +1,144 @@
+"""The Cloudinary circuit breaker (app/breaker.py) and how app/media.py uses it.
+
+``FakeCloudinary`` injects the errors and latency; the breaker's clock is
+a list the tests move forward by hand.
+"""
+import io
+
+import pytest
+
+from app import db
+from app.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from app.media import CircuitOpen, MediaUnavailable, call_cloudinary
+from app.models import Product, ProductImage, User
+from app.routes import IMAGES_NOT_SAVED
+
+
+@pytest.fixture(scope="module")
+def app(make_app):
+    app = make_app(
+        WTF_CSRF_ENABLED=False, RATELIMIT_ENABLED=False,
+        CLOUDINARY_BREAKER_FAILURES=3, CLOUDINARY_BREAKER_RESET_SECONDS=30,
+        CLOUDINARY_SLOW_SECONDS=0.05,
+    )
+    with app.app_context():
+        seller = User(username="seller", email="seller@example.com", role="seller")
+        seller.set_password("secret1")
+        db.session.add(seller)
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def now():
+    return [1000.0]
+
+
+@pytest.fixture
+def breaker(app, now):
+    """A fresh breaker on the test clock, installed for media.py to use."""
+    breaker = CircuitBreaker("cloudinary", failure_threshold=3, reset_seconds=30, clock=lambda: now[0])
+    app.extensions["cloudinary_breaker"] = breaker
+    return breaker
+
+
+@pytest.fixture
+def fake(app):
+    fake = app.extensions["cloudinary_backend"]
+    fake.latency, fake.error_rate = 0.0, 0.0
+    fake.calls.clear()
+    yield fake
+    fake.latency, fake.error_rate = 0.0, 0.0
+
+
+def fail(app, fake, times):
+    fake.error_rate = 1.0
+    with app.app_context():
+        for _ in range(times):
+            with pytest.raises(MediaUnavailable):
+                call_cloudinary("destroy", "products/1/a")
+    fake.error_rate = 0.0
+
+
+def test_consecutive_failures_open_the_circuit(app, fake, breaker):
+    fail(app, fake, 2)
+    assert breaker.state == CLOSED
+    with app.app_context():
+        # A success resets the count
+        call_cloudinary("destroy", "products/1/a")
+    fail(app, fake, 2)
+    assert breaker.state == CLOSED
+    fail(app, fake, 1)
+    assert breaker.state == OPEN
+
+
+def test_slow_calls_count_as_failures(app, fake, breaker):
+    fake.latency = 0.06
+    with app.app_context():
+        for _ in range(3):
+            call_cloudinary("destroy", "products/1/a")
+    assert breaker.state == OPEN
+
+
+def test_open_circuit_refuses_without_calling(app, fake, breaker):
+    fail(app, fake, 3)
+    fake.calls.clear()
+    with app.app_context():
+        for _ in range(5):
+            with pytest.raises(CircuitOpen):
+                call_cloudinary("destroy", "products/1/a")
+    assert fake.calls == []
+
+
+def test_half_open_probe_success_closes_the_circuit(app, fake, breaker, now):
+    fail(app, fake, 3)
+    now[0] += 30
+    assert breaker.state == HALF_OPEN
+    fake.calls.clear()
+    with app.app_context():
+        call_cloudinary("destroy", "products/1/a")
+    assert fake.calls == [("destroy", "products/1/a")]
+    assert breaker.state == CLOSED
+
+
+def test_half_open_probe_failure_opens_it_again(app, fake, breaker, now):
+    fail(app, fake, 3)
+    now[0] += 30
+    fail(app, fake, 1)
+    assert breaker.state == OPEN
+    # ...for another full reset period
+    now[0] += 29
+    with app.app_context(), pytest.raises(CircuitOpen):
+        call_cloudinary("destroy", "products/1/a")
+
+
+def test_only_one_probe_at_a_time(breaker, now):
+    for _ in range(3):
+        breaker.record_failure()
+    now[0] += 30
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.record_success()
+    assert breaker.allow() is True
+
+
+def test_add_product_saves_the_text_while_the_circuit_is_open(app, fake, breaker):
+    fail(app, fake, 3)
+    fake.calls.clear()
+    client = app.test_client()
+    client.post("/login", data={"email": "seller@example.com", "password": "secret1"})
+    client.get("/seller/product/add")  # creates the seller's first category
+
+    response = client.post("/seller/product/add", data={
+        "name": "Trail Runner", "description": "Grippy", "price": "45", "category_id": "1",
+        "size_unit": "EU 42", "stock_quantity": "2",
+        "product_image1": (io.BytesIO(b"\x89PNG not really"), "shoe.png"),
+    }, content_type="multipart/form-data")
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert ("warning", IMAGES_NOT_SAVED) in session["_flashes"]
+    with app.app_context():
+        product = Product.query.filter_by(name="Trail Runner").one()
+        assert product.price == 45
+        assert ProductImage.query.filter_by(product_id=product.id).count() == 0
+    assert fake.calls == []
@@ -0,0 +1,101 @@
+"""The email outbox (app/email.py): rows queued by views, sent by `flask mail send`.
+
+Flask-Mail records instead of sending while testing, so
+``mail.record_messages()`` sees exactly what would reach the SMTP server.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db, mail
+from app.email import NEW_MESSAGE, RESET_PASSWORD
+from app.models import EmailOutbox, Message, Product, User
+
+
+@pytest.fixture(scope="module")
+def app(make_app):
+    app = make_app(
+        WTF_CSRF_ENABLED=False, RATELIMIT_ENABLED=False,
+        SITE_URL="https://afrido.example", MAIL_DIGEST_DELAY_MINUTES=10,
+    )
+    with app.app_context():
+        seller = User(username="seller", email="seller@example.com", role="seller")
+        buyer = User(username="buyer", email="buyer@example.com", role="buyer")
+        for user in (seller, buyer):
+            user.set_password("secret1")
+        db.session.add_all([seller, buyer])
+        db.session.flush()
+        db.session.add_all([
+            Product(id=1, name="Red Runner", price=10, seller_id=seller.id),
+            Product(id=2, name="Blue Boot", price=20, seller_id=seller.id),
+        ])
+        db.session.commit()
+    return app
+
+
+@pytest.fixture(autouse=True)
+def empty_outbox(app):
+    with app.app_context():
+        EmailOutbox.query.delete()
+        Message.query.delete()
+        db.session.commit()
+
+
+def send(app):
+    with mail.record_messages() as outbox:
+        result = app.test_cli_runner().invoke(args=["mail", "send"])
+    assert result.exit_code == 0, result.output
+    return result.output, outbox
+
+
+def test_reset_email_is_queued_with_a_link_on_site_url(app):
+    client = app.test_client()
+    response = client.post(
+        "/forgot-password", data={"email": "buyer@example.com"},
+        headers={"Host": "attacker.example"},
+    )
+    assert response.status_code == 302
+    with app.app_context():
+        row = EmailOutbox.query.one()
+        assert (row.kind, row.recipient, row.sent_at) == (RESET_PASSWORD, "buyer@example.com", None)
+        assert "https://afrido.example/reset-password/" in row.body
+        assert "attacker.example" not in row.body
+
+
+def test_mail_send_delivers_the_outbox_and_marks_rows_sent(app):
+    app.test_client().post("/forgot-password", data={"email": "buyer@example.com"})
+
+    output, sent = send(app)
+    assert "Sent 1 email(s)." in output
+    assert [m.recipients for m in sent] == [["buyer@example.com"]]
+    assert "https://afrido.example/reset-password/" in sent[0].body
+    with app.app_context():
+        assert EmailOutbox.query.one().sent_at is not None
+
+    # Nothing is sent twice
+    output, sent = send(app)
+    assert "Sent 0 email(s)." in output and sent == []
+
+
+def test_message_notifications_are_coalesced_into_one_digest(app):
+    client = app.test_client()
+    client.post("/login", data={"email": "buyer@example.com", "password": "secret1"})
+    for product_id, content in ((1, "hi"), (1, "still there?"), (2, "and this one")):
+        assert client.post(f"/product/{product_id}/message", data={"content": content}).status_code == 302
+
+    with app.app_context():
+        assert EmailOutbox.query.filter_by(kind=NEW_MESSAGE).count() == 3
+    # The oldest notification has not waited MAIL_DIGEST_DELAY_MINUTES yet
+    assert send(app)[1] == []
+
+    with app.app_context():
+        EmailOutbox.query.update({"created_at": datetime.utcnow() - timedelta(minutes=11)})
+        db.session.commit()
+    output, sent = send(app)
+    assert "Sent 1 email(s)." in output
+    assert len(sent) == 1 and sent[0].recipients == ["seller@example.com"]
+    assert sent[0].subject == "You have 3 new messages on Afrido"
+    assert "2 about Red Runner" in sent[0].body and "1 about Blue Boot" in sent[0].body
+    assert "https://afrido.example/inbox" in sent[0].body
+    with app.app_context():
+        assert EmailOutbox.query.filter_by(sent_at=None).count() == 0
@@ -0,0 +1,137 @@
+"""Deferred Cloudinary deletion and reconciliation (app/media.py) against FakeCloudinary."""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.breaker import CircuitBreaker
+from app.media import BULK_DELETE_LIMIT, drain_deletions, schedule_cloudinary_delete
+from app.models import CloudinaryDeletion, Product, ProductImage, User
+
+OLD = (datetime.utcnow() - timedelta(days=2)).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+@pytest.fixture(scope="module")
+def app(make_app):
+    app = make_app()
+    with app.app_context():
+        seller = User(username="seller", email="seller@example.com", role="seller")
+        db.session.add(seller)
+        db.session.flush()
+        db.session.add(Product(id=1, name="Runner", price=10, seller_id=seller.id))
+        db.session.commit()
+    return app
+
+
+@pytest.fixture
+def fake(app):
+    fake = app.extensions["cloudinary_backend"]
+    fake.assets.clear()
+    fake.calls.clear()
+    fake.error_rate = 0.0
+    # Failures here are the point of some tests; keep the circuit closed
+    app.extensions["cloudinary_breaker"] = CircuitBreaker("cloudinary", failure_threshold=1000)
+    with app.app_context():
+        CloudinaryDeletion.query.delete()
+        ProductImage.query.delete()
+        db.session.commit()
+    yield fake
+    fake.error_rate = 0.0
+
+
+def store(fake, *public_ids):
+    for public_id in public_ids:
+        fake.assets[public_id] = {"bytes": 1, "created_at": OLD}
+
+
+def queued(app):
+    with app.app_context():
+        return sorted(pid for (pid,) in db.session.query(CloudinaryDeletion.public_id))
+
+
+def test_deletions_are_queued_with_the_transaction(app, fake):
+    with app.app_context():
+        schedule_cloudinary_delete("products/1/a", "products/1/b")
+        db.session.rollback()
+    assert queued(app) == []
+
+    with app.app_context():
+        schedule_cloudinary_delete("products/1/a", "products/1/b")
+        db.session.commit()
+    assert queued(app) == ["products/1/a", "products/1/b"]
+    # Nothing was deleted inline
+    assert fake.calls == []
+
+
+def test_drain_deletes_in_batches_of_at_most_100(app, fake):
+    ids = [f"products/1/{n:03}" for n in range(250)]
+    store(fake, *ids)
+    with app.app_context():
+        schedule_cloudinary_delete(*ids)
+        db.session.commit()
+        assert drain_deletions() == (250, 0)
+
+    batches = [call[1] for call in fake.calls if call[0] == "delete_resources"]
+    assert [len(batch) for batch in batches] == [BULK_DELETE_LIMIT, BULK_DELETE_LIMIT, 50]
+    assert sorted(pid for batch in batches for pid in batch) == ids
+    assert fake.assets == {}
+    assert queued(app) == []
+
+
+def test_drain_keeps_failed_deletions_for_a_retry(app, fake):
+    store(fake, "products/1/a", "products/1/b")
+    with app.app_context():
+        schedule_cloudinary_delete("products/1/a", "products/1/b")
+        db.session.commit()
+
+        fake.error_rate = 1.0
+        assert drain_deletions() == (0, 2)
+        rows = CloudinaryDeletion.query.all()
+        assert [row.attempts for row in rows] == [1, 1]
+        assert all("injected" in row.last_error for row in rows)
+
+        fake.error_rate = 0.0
+        assert drain_deletions() == (2, 0)
+    assert queued(app) == [] and fake.assets == {}
+
+
+def test_drain_gives_up_after_max_attempts(app, fake):
+    store(fake, "products/1/a")
+    with app.app_context():
+        schedule_cloudinary_delete("products/1/a")
+        db.session.commit()
+        fake.error_rate = 1.0
+        for _ in range(3):
+            drain_deletions(max_attempts=3)
+        fake.error_rate = 0.0
+        assert drain_deletions(max_attempts=3) == (0, 0)
+    assert queued(app) == ["products/1/a"]
+
+
+def test_drain_never_deletes_an_id_that_is_used_again(app, fake):
+    store(fake, "products/1/a")
+    with app.app_context():
+        schedule_cloudinary_delete("products/1/a")
+        db.session.add(ProductImage(product_id=1, public_id="products/1/a", image_url="https://x/a"))
+        db.session.commit()
+        assert drain_deletions() == (0, 0)
+    assert "products/1/a" in fake.assets
+    assert queued(app) == []
+
+
+def test_reconcile_lists_and_purges_orphans(app, fake):
+    store(fake, "products/1/used", "products/1/orphan", "products/1/queued", "sellers/9/orphan")
+    fake.assets["products/1/young"] = {"bytes": 1, "created_at": datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")}
+    with app.app_context():
+        db.session.add(ProductImage(product_id=1, public_id="products/1/used", image_url="https://x/used"))
+        schedule_cloudinary_delete("products/1/queued")
+        db.session.commit()
+
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=["media", "reconcile"])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ["products/1/orphan", "sellers/9/orphan", "2 orphaned asset(s)."]
+
+    result = runner.invoke(args=["media", "reconcile", "--prefix", "products/", "--purge"])
+    assert result.output.splitlines() == ["products/1/orphan", "1 orphaned asset(s) queued for deletion."]
+    assert queued(app) == ["products/1/orphan", "products/1/queued"]
@@ -0,0 +1,128 @@
+"""Rate limits and concurrency caps (app/ratelimit.py).
+
+The limiter runs on ``MemoryBackend`` with a clock the tests move by hand.
+"""
+import threading
+
+import pytest
+
+from app import db
+from app.models import RateLimitCounter
+from app.ratelimit import (
+    PRUNE_AFTER, DatabaseBackend, MemoryBackend, RateLimiter, concurrency_limit, rate_limit
+)
+
+entered, release = threading.Event(), threading.Event()
+
+
+@pytest.fixture(scope="module")
+def app(make_app):
+    app = make_app(PROXY_FIX_HOPS=1)
+
+    @app.route("/_limited", methods=["GET", "POST"])
+    @rate_limit("3/minute", by="ip")
+    def limited():
+        return "ok"
+
+    @app.route("/_slow", methods=["POST"])
+    @concurrency_limit(1)
+    def slow():
+        entered.set()
+        release.wait(5)
+        return "ok"
+
+    return app
+
+
+@pytest.fixture
+def now():
+    return [60_000.0]
+
+
+@pytest.fixture
+def backend(app, now):
+    backend = MemoryBackend()
+    app.extensions["rate_limiter"] = RateLimiter(backend, clock=lambda: now[0])
+    return backend
+
+
+def post(app, ip="203.0.113.7"):
+    return app.test_client().post("/_limited", headers={"X-Forwarded-For": ip})
+
+
+def test_request_over_the_limit_gets_429_with_retry_after(app, backend, now):
+    assert [post(app).status_code for _ in range(3)] == [200, 200, 200]
+    now[0] += 15
+    response = post(app)
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "45"
+
+
+def test_only_counted_methods_are_limited(app, backend):
+    for _ in range(3):
+        post(app)
+    client = app.test_client()
+    assert client.get("/_limited", headers={"X-Forwarded-For": "203.0.113.7"}).status_code == 200
+
+
+def test_window_rolls_over(app, backend, now):
+    for _ in range(3):
+        post(app)
+    assert post(app).status_code == 429
+    # Half way into the next window, half of the previous one still counts
+    now[0] += 90
+    assert post(app).status_code == 200
+    assert post(app).status_code == 429
+    # Rejected requests count too, so a clean slate takes two windows
+    now[0] += 120
+    assert [post(app).status_code for _ in range(3)] == [200, 200, 200]
+
+
+def test_sliding_window_estimate():
+    clock = [0.0]
+    limiter = RateLimiter(MemoryBackend(), clock=lambda: clock[0])
+    for _ in range(10):
+        assert limiter.hit("k", 10, 60) == (True, 0)
+    clock[0] = 60 + 30  # previous window counts for 10 * 30/60 = 5
+    assert [limiter.hit("k", 10, 60)[0] for _ in range(6)] == [True] * 5 + [False]
+
+
+def test_clients_are_keyed_on_x_forwarded_for(app, backend):
+    for _ in range(3):
+        post(app, ip="203.0.113.7")
+    assert post(app, ip="203.0.113.7").status_code == 429
+    assert post(app, ip="198.51.100.2").status_code == 200
+    assert {key for key in backend._counters} == {
+        "limited:ip:203.0.113.7", "limited:ip:198.51.100.2",
+    }
+
+
+def test_concurrency_limit_rejects_while_full(app):
+    entered.clear()
+    release.clear()
+    first = {}
+    thread = threading.Thread(target=lambda: first.update(response=app.test_client().post("/_slow")))
+    thread.start()
+    try:
+        assert entered.wait(5)
+        response = app.test_client().post("/_slow")
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+    finally:
+        release.set()
+        thread.join(5)
+    assert first["response"].status_code == 200
+    assert app.test_client().post("/_slow").status_code == 200
+
+
+def test_database_backend_prunes_windows_of_every_key(app):
+    backend = DatabaseBackend()
+    now = 10 * PRUNE_AFTER
+    with app.app_context():
+        backend.incr("login:ip:old", now - PRUNE_AFTER - 60, 60)
+        backend.incr("login:ip:recent", now - 60, 60)
+        backend.incr("login:user:1", now - 86400, 86400)
+        assert backend.prune(now) == 1
+        assert sorted(key for (key,) in db.session.query(RateLimitCounter.key)) == [
+            "login:ip:recent", "login:user:1",
+        ]
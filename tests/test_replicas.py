@@ -0,0 +1,82 @@
+"""Replica routing (app/replicas.py) with two SQLite files standing in for replicas.
+
+Each database holds user 1 under a different name, so a query's answer
+says which database served it.
+"""
+import pytest
+
+from app import db
+from app.models import User
+
+
+@pytest.fixture(scope="module")
+def app(make_app, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("replicas")
+    app = make_app(SQLALCHEMY_REPLICA_URIS=[
+        f"sqlite:///{directory / name}.db" for name in ("replica_0", "replica_1")
+    ])
+    with app.app_context():
+        for key, name in ((None, "primary"), ("replica_0", "replica_0"), ("replica_1", "replica_1")):
+            engine = db.engines[key]
+            db.metadata.create_all(bind=engine)
+            with engine.begin() as conn:
+                conn.execute(User.__table__.insert(), {"id": 1, "username": name, "email": f"{name}@example.com"})
+
+    @app.route("/_which")
+    def which():
+        # Several statements, as a page makes; all must go to one database
+        return ",".join(sorted({
+            db.session.execute(db.select(User.username).where(User.id == 1)).scalar()
+            for _ in range(10)
+        }))
+
+    @app.route("/_write", methods=["POST"])
+    def write():
+        db.session.execute(db.update(User).where(User.id == 1).values(role="buyer"))
+        db.session.commit()
+        return "ok"
+
+    return app
+
+
+@pytest.fixture
+def pool(app):
+    pool = app.extensions["replica_pool"]
+    pool._down_until.clear()
+    return pool
+
+
+def test_get_reads_from_one_replica_per_request(app, pool):
+    client = app.test_client()
+    served = {client.get("/_which").text for _ in range(30)}
+    assert served == {"replica_0", "replica_1"}
+
+
+def test_writes_go_to_primary_and_pin_reads_to_it(app, pool):
+    client = app.test_client()
+    assert client.post("/_write").text == "ok"
+    with app.app_context():
+        assert db.session.get(User, 1).role == "buyer"
+    # Read-your-writes: this client now reads from the primary...
+    assert {client.get("/_which").text for _ in range(10)} == {"primary"}
+    # ...while other clients still read from replicas
+    assert app.test_client().get("/_which").text != "primary"
+
+
+def test_failover_skips_down_replicas_then_uses_primary(app, pool):
+    client = app.test_client()
+    pool.mark_down("replica_0")
+    assert {client.get("/_which").text for _ in range(10)} == {"replica_1"}
+    pool.mark_down("replica_1")
+    assert {client.get("/_which").text for _ in range(10)} == {"primary"}
+
+
+def test_pinned_replica_failing_mid_request_falls_back_to_primary(app, pool):
+    with app.test_request_context("/_which"):
+        app.preprocess_request()
+        first = db.session.execute(db.select(User.username).where(User.id == 1)).scalar()
+        assert first.startswith("replica_")
+        pool.mark_down(first)
+        second = db.session.execute(db.select(User.username).where(User.id == 1)).scalar()
+        assert second == "primary"
+        db.session.remove()